@@ -0,0 +1,649 @@
+"""SCO Web API benchmark - Measure throughput and latency of API calls and Web
+API requests against an in-memory database with a synthetic data set.
+
+The benchmark creates a server instance with an in-memory database (requires
+mongomock) in a temporary directory and populates it with a synthetic data set
+(see module seed). Each benchmark either calls the server API directly (names
+starting with api.) or sends a request to the Flask app via the test client
+(names starting with http.). Requests are sent sequentially. The report
+contains the throughput (requests per second) and the 50th and 99th percentile
+of the request latency (milliseconds) for each benchmark.
+
+If the budget file exists (default: budget.yaml) the results are compared
+against the budget. The program exits with status 1 if any benchmark exceeds
+its budget. The budget also contains the settings of the run that produced it.
+The check is skipped with a warning if the settings of the current run are
+different. Use --write-budget to create a budget from the results of the
+current run on the machine that runs the benchmarks (e.g., the CI machine).
+The repository contains an example budget only (budget.example.yaml).
+
+Usage: python benchmark.py [-h] [options]
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+
+sys.path.insert(
+    0,
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+)
+
+from seed import create_data_set
+
+
+"""Default budget file."""
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'budget.yaml')
+
+"""Base configuration for the benchmark server."""
+CONFIG_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..',
+    'config',
+    'config.yaml'
+)
+
+"""Page size for listing requests."""
+LISTING_SIZE = 10
+
+"""Benchmark settings that have to match the settings of the run that produced
+a budget."""
+SETTINGS = [
+    'experiments',
+    'runs',
+    'widgets',
+    'subjects',
+    'image_groups',
+    'requests',
+    'warmup',
+    'seed'
+]
+
+
+class Benchmark(object):
+    """Benchmark for a single API call or Web API request.
+
+    Attributes
+    ----------
+    name : string
+        Unique benchmark name
+    request : func
+        Function that sends a single request. Expects a random number generator
+        as the only argument. Raises ValueError if the request failed.
+    """
+    def __init__(self, name, request):
+        """Initialize the benchmark.
+
+        Parameters
+        ----------
+        name : string
+            Unique benchmark name
+        request : func
+            Function that sends a single request
+        """
+        self.name = name
+        self.request = request
+
+    def run(self, requests, warmup, rand):
+        """Run the benchmark.
+
+        Parameters
+        ----------
+        requests : int
+            Number of measured requests
+        warmup : int
+            Number of requests before measurement starts
+        rand : random.Random
+            Random number generator
+
+        Returns
+        -------
+        BenchmarkResult
+        """
+        for i in range(warmup):
+            self.request(rand)
+        durations = []
+        start = time.time()
+        for i in range(requests):
+            req_start = time.time()
+            self.request(rand)
+            durations.append(time.time() - req_start)
+        return BenchmarkResult(self.name, durations, time.time() - start)
+
+
+class BenchmarkResult(object):
+    """Latency and throughput of a benchmark run.
+
+    Attributes
+    ----------
+    name : string
+        Benchmark name
+    count : int
+        Number of requests
+    p50 : float
+        Median request latency in milliseconds
+    p99 : float
+        99th percentile of the request latency in milliseconds
+    throughput : float
+        Requests per second
+    """
+    def __init__(self, name, durations, elapsed):
+        """Compute statistics for the given request durations.
+
+        Parameters
+        ----------
+        name : string
+            Benchmark name
+        durations : list(float)
+            Request durations in seconds
+        elapsed : float
+            Total benchmark duration in seconds
+        """
+        self.name = name
+        self.count = len(durations)
+        durations = sorted(durations)
+        self.p50 = percentile(durations, 50) * 1000
+        self.p99 = percentile(durations, 99) * 1000
+        self.throughput = self.count / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        """Dictionary serialization of the benchmark result.
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            'name' : self.name,
+            'count' : self.count,
+            'p50' : self.p50,
+            'p99' : self.p99,
+            'throughput' : self.throughput
+        }
+
+
+# ------------------------------------------------------------------------------
+#
+# Benchmarks
+#
+# ------------------------------------------------------------------------------
+
+def api_benchmarks(api, data):
+    """Benchmarks for direct calls to the server API.
+
+    Parameters
+    ----------
+    api : scoserv.api.SCOServerAPI
+        Server API
+    data : seed.DataSet
+        Identifiers of objects in the data set
+
+    Returns
+    -------
+    list(Benchmark)
+    """
+    def expect(result):
+        if result is None:
+            raise ValueError('unknown resource')
+        return result
+    def list_offset(rand, size):
+        return rand.randint(0, max(size - LISTING_SIZE, 0))
+    return [
+        Benchmark(
+            'api.experiments.list',
+            lambda r: api.experiments_list(
+                limit=LISTING_SIZE,
+                offset=list_offset(r, len(data.experiments))
+            )
+        ),
+        Benchmark(
+            'api.experiments.get',
+            lambda r: expect(api.experiments_get(r.choice(data.experiments)))
+        ),
+        Benchmark(
+            'api.predictions.list',
+            lambda r: expect(
+                api.experiments_predictions_list(r.choice(data.experiments))
+            )
+        ),
+        Benchmark(
+            'api.predictions.get',
+            lambda r: expect(api.experiments_predictions_get(*r.choice(data.runs)))
+        ),
+        Benchmark(
+            'api.image_groups.get',
+            lambda r: expect(api.image_groups_get(r.choice(data.image_groups)))
+        ),
+        Benchmark(
+            'api.subjects.list',
+            lambda r: api.subjects_list(
+                limit=LISTING_SIZE,
+                offset=list_offset(r, len(data.subjects))
+            )
+        ),
+        Benchmark(
+            'api.widgets.list',
+            lambda r: api.widgets_list(
+                limit=LISTING_SIZE,
+                offset=list_offset(r, len(data.widgets))
+            )
+        )
+    ]
+
+
+def http_benchmarks(client, data):
+    """Benchmarks for Web API requests that are sent to the Flask app.
+
+    Parameters
+    ----------
+    client : flask.testing.FlaskClient
+        Test client for the Flask app
+    data : seed.DataSet
+        Identifiers of objects in the data set
+
+    Returns
+    -------
+    list(Benchmark)
+    """
+    def get(url):
+        return expect(client.get(url), 200)
+    def post(url, body, status):
+        return expect(
+            client.post(url, data=json.dumps(body), content_type='application/json'),
+            status
+        )
+    def expect(response, status):
+        if response.status_code != status:
+            raise ValueError(
+                'unexpected response status ' + str(response.status_code)
+            )
+        return response
+    def list_url(url, rand, size):
+        offset = rand.randint(0, max(size - LISTING_SIZE, 0))
+        return url + '?offset=' + str(offset) + '&limit=' + str(LISTING_SIZE)
+    def run_url(run):
+        return '/experiments/' + run[0] + '/predictions/' + run[1]
+    return [
+        Benchmark('http.service', lambda r: get('/')),
+        Benchmark(
+            'http.experiments.list',
+            lambda r: get(list_url('/experiments', r, len(data.experiments)))
+        ),
+        Benchmark(
+            'http.experiments.get',
+            lambda r: get('/experiments/' + r.choice(data.experiments))
+        ),
+        Benchmark(
+            'http.experiments.properties',
+            lambda r: post(
+                '/experiments/' + r.choice(data.experiments) + '/properties',
+                {'properties' : [{'key' : 'tag', 'value' : str(r.random())}]},
+                200
+            )
+        ),
+        Benchmark(
+            'http.predictions.list',
+            lambda r: get(
+                '/experiments/' + r.choice(data.experiments) + '/predictions'
+            )
+        ),
+        Benchmark(
+            'http.predictions.get',
+            lambda r: get(run_url(r.choice(data.runs)))
+        ),
+        Benchmark(
+            'http.predictions.create',
+            lambda r: post(
+                '/experiments/' + r.choice(data.experiments) + '/predictions',
+                {
+                    'name' : 'Benchmark Run',
+                    'model' : data.model_id,
+                    'arguments' : [{'name' : 'sigma', 'value' : r.random()}]
+                },
+                201
+            )
+        ),
+        Benchmark(
+            'http.image_groups.get',
+            lambda r: get('/images/groups/' + r.choice(data.image_groups))
+        ),
+        Benchmark(
+            'http.subjects.list',
+            lambda r: get(list_url('/subjects', r, len(data.subjects)))
+        ),
+        Benchmark(
+            'http.widgets.list',
+            lambda r: get(list_url('/widgets', r, len(data.widgets)))
+        ),
+        Benchmark(
+            'http.widgets.get',
+            lambda r: get('/widgets/' + r.choice(data.widgets))
+        )
+    ]
+
+
+# ------------------------------------------------------------------------------
+#
+# Budget
+#
+# ------------------------------------------------------------------------------
+
+def check_budget(results, budget):
+    """Compare benchmark results against the budget. Benchmarks that are not
+    in the budget are not checked.
+
+    Parameters
+    ----------
+    results : list(BenchmarkResult)
+        Benchmark results
+    budget : dict
+        Dictionary of budgets by benchmark name. Each budget may contain a
+        maximum p50 and p99 latency (milliseconds) and a minimum throughput
+        (requests per second).
+
+    Returns
+    -------
+    list(string)
+        Violations of the budget
+    """
+    violations = []
+    for result in results:
+        if not result.name in budget:
+            continue
+        limits = budget[result.name]
+        for key in ['p50', 'p99']:
+            if key in limits and getattr(result, key) > limits[key]:
+                violations.append(
+                    '%s: %s %.2f ms exceeds budget of %.2f ms' % (
+                        result.name, key, getattr(result, key), limits[key]
+                    )
+                )
+        if 'throughput' in limits and result.throughput < limits['throughput']:
+            violations.append(
+                '%s: throughput %.1f req/s is below budget of %.1f req/s' % (
+                    result.name, result.throughput, limits['throughput']
+                )
+            )
+    return violations
+
+
+def compare_settings(settings, budget_settings):
+    """Get the benchmark settings that differ from the settings of the run
+    that produced a budget. Budgets without settings match no run.
+
+    Parameters
+    ----------
+    settings : dict
+        Settings of the current run
+    budget_settings : dict
+        Settings from the budget file (None if missing)
+
+    Returns
+    -------
+    list(string)
+        Descriptions of settings that differ
+    """
+    if budget_settings is None:
+        return ['budget contains no settings']
+    differences = []
+    for key in SETTINGS:
+        if budget_settings.get(key) != settings[key]:
+            differences.append(
+                '--%s is %s (budget: %s)' % (
+                    key.replace('_', '-'),
+                    settings[key],
+                    budget_settings.get(key)
+                )
+            )
+    return differences
+
+
+def read_budget(filename):
+    """Read budget file.
+
+    Parameters
+    ----------
+    filename : string
+        Path to budget file
+
+    Returns
+    -------
+    (dict, dict)
+        Dictionary of budgets by benchmark name and the settings of the run
+        that produced the budget (None if missing)
+    """
+    with open(filename, 'r') as f:
+        obj = yaml.load(f.read())
+    if obj is None:
+        return {}, None
+    return obj.get('benchmarks', {}), obj.get('settings')
+
+
+def write_budget(results, filename, headroom, settings=None):
+    """Write a budget for the given benchmark results. Latencies are
+    multiplied and the throughput is divided by the headroom factor. The file
+    header records the machine that produced the budget. The settings of the
+    run are stored together with the budget.
+
+    Parameters
+    ----------
+    results : list(BenchmarkResult)
+        Benchmark results
+    filename : string
+        Path to budget file
+    headroom : float
+        Tolerated slow-down factor
+    settings : dict, optional
+        Settings of the benchmark run
+    """
+    budget = {}
+    for result in results:
+        budget[result.name] = {
+            'p50' : round(result.p50 * headroom, 2),
+            'p99' : round(result.p99 * headroom, 2),
+            'throughput' : round(result.throughput / headroom, 1)
+        }
+    header = [
+        'Regression budget for the benchmark suite (see benchmark.py). For each',
+        'benchmark the budget contains the maximum median (p50) and 99th percentile',
+        '(p99) latency in milliseconds and the minimum throughput in requests per',
+        'second. Benchmarks without an entry are reported but not checked. The',
+        'budget is only checked for runs with the same settings.',
+        '',
+        'Generated by benchmark.py --write-budget on ' + time.strftime('%Y-%m-%d'),
+        '',
+        '  machine: ' + platform.platform(),
+        '  processor: ' + (platform.processor() or platform.machine()),
+        '  cpus: ' + str(multiprocessing.cpu_count()),
+        '  python: ' + platform.python_version()
+    ]
+    header.extend([
+        '',
+        'The budget depends on the machine that runs the benchmarks. Recalibrate',
+        'the budget on that machine with:',
+        '',
+        '  python benchmark.py --budget none --write-budget budget.yaml --headroom 1.5'
+    ])
+    with open(filename, 'w') as f:
+        for line in header:
+            f.write(('# ' + line).rstrip() + '\n')
+        obj = {'benchmarks' : budget}
+        if not settings is None:
+            obj['settings'] = settings
+        yaml.safe_dump(obj, f, default_flow_style=False)
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def create_server(base_dir):
+    """Import the server module with a configuration for an in-memory
+    database. Data and log files are written to the given directory.
+
+    Parameters
+    ----------
+    base_dir : string
+        Base directory for server files
+
+    Returns
+    -------
+    module
+    """
+    with open(CONFIG_FILE, 'r') as f:
+        obj = yaml.load(f.read())
+    config = {item['key']:item['value'] for item in obj['properties']}
+    home_page = os.path.join(base_dir, 'home.html')
+    with open(home_page, 'w') as f:
+        f.write('<p>SCO Benchmark</p>')
+    config.update({
+        'server.datadir' : os.path.join(base_dir, 'data'),
+        'server.logfile' : os.path.join(base_dir, 'scoserv.log'),
+        'mongo.inmemory' : True,
+        'app.debug' : False,
+        'home.content' : home_page,
+        'doc.pages' : [],
+        'engine.dispatch' : 'sync',
+        'engine.broker' : 'inprocess'
+    })
+    config_file = os.path.join(base_dir, 'config.yaml')
+    with open(config_file, 'w') as f:
+        yaml.safe_dump(
+            {'properties' : [{'key' : k, 'value' : config[k]} for k in config]},
+            f,
+            default_flow_style=False
+        )
+    os.environ['SCOSERVER_CONFIG'] = config_file
+    import scoserv.server
+    return scoserv.server
+
+
+def percentile(values, p):
+    """Get percentile of a sorted list of values (nearest rank).
+
+    Parameters
+    ----------
+    values : list(float)
+        Sorted list of values
+    p : float
+        Percentile (0-100)
+
+    Returns
+    -------
+    float
+    """
+    if len(values) == 0:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def print_report(results):
+    """Print table of benchmark results.
+
+    Parameters
+    ----------
+    results : list(BenchmarkResult)
+        Benchmark results
+    """
+    width = max([len(r.name) for r in results] + [9])
+    print '%-*s %8s %12s %10s %10s' % (
+        width, 'benchmark', 'requests', 'throughput', 'p50 (ms)', 'p99 (ms)'
+    )
+    for r in results:
+        print '%-*s %8d %12.1f %10.2f %10.2f' % (
+            width, r.name, r.count, r.throughput, r.p50, r.p99
+        )
+
+
+# ------------------------------------------------------------------------------
+#
+# Main
+#
+# ------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SCO Web API benchmark')
+    parser.add_argument('--experiments', type=int, default=2000, help='Number of experiments')
+    parser.add_argument('--runs', type=int, default=5, help='Model runs per experiment')
+    parser.add_argument('--widgets', type=int, default=1000, help='Number of widgets')
+    parser.add_argument('--subjects', type=int, default=100, help='Number of subjects')
+    parser.add_argument('--image-groups', type=int, default=100, help='Number of image groups')
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per benchmark')
+    parser.add_argument('--warmup', type=int, default=20, help='Warm-up requests per benchmark')
+    parser.add_argument('--filter', default=None, help='Only run benchmarks whose name starts with the given prefix')
+    parser.add_argument('--budget', default=BUDGET_FILE, help='Budget file (use "none" to skip the check)')
+    parser.add_argument('--write-budget', default=None, help='Write budget for the results to the given file')
+    parser.add_argument('--headroom', type=float, default=1.5, help='Tolerated slow-down factor for --write-budget')
+    parser.add_argument('--output', default=None, help='Write results as Json to the given file')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for random numbers')
+    args = parser.parse_args()
+    base_dir = tempfile.mkdtemp()
+    try:
+        server = create_server(base_dir)
+        start = time.time()
+        data = create_data_set(
+            server.api,
+            subjects=args.subjects,
+            image_groups=args.image_groups,
+            experiments=args.experiments,
+            runs=args.runs,
+            widgets=args.widgets,
+            seed=args.seed
+        )
+        print 'created data set in %.1f s (%d experiments, %d runs, %d widgets)' % (
+            time.time() - start,
+            len(data.experiments),
+            len(data.runs),
+            len(data.widgets)
+        )
+        benchmarks = api_benchmarks(server.api, data)
+        benchmarks.extend(http_benchmarks(server.app.test_client(), data))
+        if not args.filter is None:
+            benchmarks = [b for b in benchmarks if b.name.startswith(args.filter)]
+        rand = random.Random(args.seed)
+        results = [b.run(args.requests, args.warmup, rand) for b in benchmarks]
+    finally:
+        shutil.rmtree(base_dir)
+    print_report(results)
+    if not args.output is None:
+        with open(args.output, 'w') as f:
+            json.dump([r.to_dict() for r in results], f, indent=4)
+    settings = {key : getattr(args, key) for key in SETTINGS}
+    if not args.write_budget is None:
+        settings['headroom'] = args.headroom
+        write_budget(results, args.write_budget, args.headroom, settings=settings)
+    if args.budget.lower() != 'none' and os.path.isfile(args.budget):
+        budget, budget_settings = read_budget(args.budget)
+        differences = compare_settings(settings, budget_settings)
+        if len(differences) > 0:
+            # Results for a different data set or number of requests cannot be
+            # compared against the budget
+            print
+            print 'WARNING: budget check skipped, settings differ from ' + args.budget
+            for d in differences:
+                print '  ' + d
+            sys.exit(0)
+        violations = check_budget(results, budget)
+        if len(violations) > 0:
+            print
+            print 'BUDGET EXCEEDED'
+            for v in violations:
+                print '  ' + v
+            sys.exit(1)
+        print
+        print 'all benchmarks within budget'
+    elif args.budget.lower() != 'none':
+        print
+        print 'no budget file ' + args.budget + ' (budget check skipped)'
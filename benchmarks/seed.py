@@ -0,0 +1,242 @@
+"""Benchmark data - Populate the database of a server API with a synthetic
+data set.
+
+Subjects, images, and image groups are inserted into the database directly
+(they would otherwise require uploading FreeSurfer archives and image files).
+Experiments and widgets are created using the data store and the widget
+registry of the server API (the API responses do not contain the identifier of
+created objects). Model runs are created via the server API. Files of
+subjects and images do not exist on disk, i.e., the data set cannot be used to
+benchmark file downloads.
+"""
+
+import os
+import random
+import uuid
+
+from scodata.datastore import PROPERTY_FILENAME, PROPERTY_FILESIZE
+from scodata.datastore import PROPERTY_FILETYPE, PROPERTY_MIMETYPE
+from scodata.datastore import PROPERTY_NAME
+from scodata.image import GroupImage, ImageHandle, ImageGroupHandle
+from scodata.subject import SubjectHandle, FILE_TYPE_FREESURFER_DIRECTORY
+
+from scoserv.batch import ModelRunSpec
+from scoserv.widget import WidgetInput
+
+
+"""Identifier of the model that is registered for benchmark runs."""
+BENCHMARK_MODEL = 'benchmark'
+
+"""Number of images in each image group."""
+GROUP_SIZE = 20
+
+
+class DataSet(object):
+    """Identifiers of the objects in a synthetic data set.
+
+    Attributes
+    ----------
+    experiments : list(string)
+        Experiment identifiers
+    image_groups : list(string)
+        Image group identifiers
+    model_id : string
+        Identifier of the benchmark model
+    runs : list((string, string))
+        Pairs of experiment and model run identifier
+    subjects : list(string)
+        Subject identifiers
+    widgets : list(string)
+        Widget identifiers
+    """
+    def __init__(self):
+        """Initialize empty lists of identifiers."""
+        self.experiments = []
+        self.image_groups = []
+        self.model_id = BENCHMARK_MODEL
+        self.runs = []
+        self.subjects = []
+        self.widgets = []
+
+
+def create_data_set(api, subjects=100, image_groups=100, experiments=2000, runs=5, widgets=1000, seed=42):
+    """Create a synthetic data set.
+
+    Parameters
+    ----------
+    api : scoserv.api.SCOServerAPI
+        Server API with empty database
+    subjects : int, optional
+        Number of subjects
+    image_groups : int, optional
+        Number of image groups
+    experiments : int, optional
+        Number of experiments
+    runs : int, optional
+        Number of model runs per experiment
+    widgets : int, optional
+        Number of widgets
+    seed : int, optional
+        Seed for the random number generator
+
+    Returns
+    -------
+    DataSet
+    """
+    rand = random.Random(seed)
+    data = DataSet()
+    register_model(api)
+    # Subjects
+    documents = []
+    for i in range(subjects):
+        identifier = str(uuid.uuid4())
+        documents.append(
+            to_document(
+                api.db.subjects,
+                SubjectHandle(
+                    identifier,
+                    {
+                        PROPERTY_NAME : 'Subject ' + str(i),
+                        PROPERTY_FILENAME : 'subject-' + str(i) + '.tar.gz',
+                        PROPERTY_FILETYPE : FILE_TYPE_FREESURFER_DIRECTORY,
+                        PROPERTY_MIMETYPE : 'application/x-tar',
+                        PROPERTY_FILESIZE : rand.randint(10000000, 50000000)
+                    },
+                    os.path.join(api.db.subjects.directory, identifier)
+                )
+            )
+        )
+        data.subjects.append(identifier)
+    api.db.subjects.collection.insert_many(documents)
+    # Images and image groups
+    image_docs = []
+    group_docs = []
+    for i in range(image_groups):
+        images = []
+        for j in range(GROUP_SIZE):
+            identifier = str(uuid.uuid4())
+            filename = 'img-' + str(j) + '.png'
+            image_docs.append(
+                to_document(
+                    api.db.images,
+                    ImageHandle(
+                        identifier,
+                        {
+                            PROPERTY_NAME : filename,
+                            PROPERTY_FILENAME : filename,
+                            PROPERTY_MIMETYPE : 'image/png',
+                            PROPERTY_FILESIZE : rand.randint(10000, 100000)
+                        },
+                        os.path.join(api.db.images.directory, identifier)
+                    )
+                )
+            )
+            images.append(GroupImage(identifier, '/', filename, filename))
+        identifier = str(uuid.uuid4())
+        group_docs.append(
+            to_document(
+                api.db.image_groups,
+                ImageGroupHandle(
+                    identifier,
+                    {
+                        PROPERTY_NAME : 'Image Group ' + str(i),
+                        PROPERTY_FILENAME : 'images-' + str(i) + '.tar.gz',
+                        PROPERTY_MIMETYPE : 'application/x-tar',
+                        PROPERTY_FILESIZE : rand.randint(1000000, 5000000)
+                    },
+                    os.path.join(api.db.image_groups.directory, identifier),
+                    images,
+                    {}
+                )
+            )
+        )
+        data.image_groups.append(identifier)
+    api.db.images.collection.insert_many(image_docs)
+    api.db.image_groups.collection.insert_many(group_docs)
+    # Experiments and their model runs
+    for i in range(experiments):
+        experiment = api.db.experiments_create(
+            rand.choice(data.subjects),
+            rand.choice(data.image_groups),
+            {PROPERTY_NAME : 'Experiment ' + str(i)}
+        )
+        experiment_id = experiment.identifier
+        data.experiments.append(experiment_id)
+        if runs > 0:
+            result = api.experiments_predictions_create_batch(
+                experiment_id,
+                data.model_id,
+                [
+                    ModelRunSpec(
+                        'Run ' + str(j),
+                        [{'name' : 'sigma', 'value' : rand.random()}]
+                    ) for j in range(runs)
+                ]
+            )
+            for run in result['runs']:
+                data.runs.append((experiment_id, run['id']))
+    # Set a fraction of the model runs to active to get a mix of states
+    for experiment_id, run_id in rand.sample(data.runs, len(data.runs) / 5):
+        api.experiments_predictions_update_state_active(experiment_id, run_id)
+    # Widgets
+    for i in range(widgets):
+        widget = api.widgets.create_widget(
+            {PROPERTY_NAME : 'Widget ' + str(i)},
+            'vega',
+            {'spec' : {'mark' : 'point', 'width' : 400, 'height' : 300}},
+            [WidgetInput.from_dict({
+                'model' : data.model_id,
+                'attachment' : 'result-' + str(i % 10)
+            })]
+        )
+        data.widgets.append(widget.identifier)
+    return data
+
+
+def register_model(api):
+    """Register the model that is used for benchmark runs.
+
+    Parameters
+    ----------
+    api : scoserv.api.SCOServerAPI
+        Server API
+    """
+    api.models_register(
+        BENCHMARK_MODEL,
+        {PROPERTY_NAME : 'Benchmark Model'},
+        [{
+            'id' : 'sigma',
+            'name' : 'Sigma',
+            'description' : 'Model parameter',
+            'type' : {'name' : 'float'},
+            'default' : 0.5
+        }],
+        {
+            'prediction' : {
+                'filename' : 'prediction.nii',
+                'mimeType' : 'application/x-nifti',
+                'path' : 'prediction.nii'
+            },
+            'attachments' : []
+        },
+        {'connector' : 'inprocess'}
+    )
+
+
+def to_document(store, obj):
+    """Get database document for an object handle.
+
+    Parameters
+    ----------
+    store : scodata.datastore.MongoDBStore
+        Object store for the object
+    obj : scodata.datastore.ObjectHandle
+        Object handle
+
+    Returns
+    -------
+    dict
+    """
+    document = store.to_dict(obj)
+    document['active'] = True
+    return document
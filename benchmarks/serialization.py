@@ -0,0 +1,291 @@
+"""Serialization micro-benchmarks - Measure the functions that convert objects
+into their Json representation in isolation from the database and the Flask
+app.
+
+Every response passes object handles through object_to_dict() (single
+objects) or listing_to_dict() (listings). Both generate the references for
+each object with HATEOASReferenceFactory.object_references(), which converts a
+dictionary of references into a reference list with to_references(). The
+benchmark measures each of these functions for every object type (model runs
+for every run state) and listing sizes from 10 to 10,000 objects. Objects are
+created in memory as listing summaries.
+
+Each measurement is repeated and the fastest repetition is reported as the
+total time for all objects (milliseconds) and the time per object
+(microseconds). Results can be saved as Json (--output) and compared against
+the results of an earlier run (--baseline) to validate optimizations.
+
+Usage: python serialization.py [-h] [options]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(
+    0,
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+)
+
+from scodata.datastore import PROPERTY_FILENAME, PROPERTY_NAME
+from scodata.experiment import TYPE_EXPERIMENT
+from scodata.image import TYPE_IMAGE, TYPE_IMAGE_GROUP
+from scodata.modelrun import TYPE_MODEL_RUN
+from scodata.modelrun import STATE_FAILED, STATE_IDLE, STATE_RUNNING, STATE_SUCCESS
+from scodata.subject import TYPE_SUBJECT
+from scoserv.api import listing_to_dict, object_to_dict
+from scoserv.hateoas import HATEOASReferenceFactory, to_references
+from scoserv.hateoas import LIST_KEY, LIST_VALUE
+from scoserv.listing import ListingPage, ObjectSummary, RunStateSummary
+from scoserv.listing import COUNT_EXACT
+from scoserv.widget import TYPE_WIDGET
+
+
+"""Base Url for generated references."""
+BASE_URL = 'http://localhost:5000/sco-server/api/v1/'
+
+"""Listing sizes."""
+SIZES = [10, 100, 1000, 10000]
+
+"""Benchmarked object types. Model runs are benchmarked for each state."""
+OBJECT_TYPES = [
+    TYPE_EXPERIMENT,
+    TYPE_IMAGE,
+    TYPE_IMAGE_GROUP,
+    TYPE_MODEL_RUN + ':' + STATE_IDLE,
+    TYPE_MODEL_RUN + ':' + STATE_RUNNING,
+    TYPE_MODEL_RUN + ':' + STATE_FAILED,
+    TYPE_MODEL_RUN + ':' + STATE_SUCCESS,
+    TYPE_SUBJECT,
+    TYPE_WIDGET
+]
+
+"""Benchmarked functions."""
+FUNC_LISTING_TO_DICT = 'listing_to_dict'
+FUNC_OBJECT_REFERENCES = 'object_references'
+FUNC_OBJECT_TO_DICT = 'object_to_dict'
+FUNC_TO_REFERENCES = 'to_references'
+
+FUNCTIONS = [
+    FUNC_TO_REFERENCES,
+    FUNC_OBJECT_REFERENCES,
+    FUNC_OBJECT_TO_DICT,
+    FUNC_LISTING_TO_DICT
+]
+
+
+def create_objects(type_label, count):
+    """Create summaries for objects of the given type.
+
+    Parameters
+    ----------
+    type_label : string
+        Object type (for model runs followed by ':' and the run state)
+    count : int
+        Number of objects
+
+    Returns
+    -------
+    list(scoserv.listing.ObjectSummary)
+    """
+    pos = type_label.find(':')
+    if pos >= 0:
+        object_type = type_label[:pos]
+        state = RunStateSummary(type_label[pos+1:])
+    else:
+        object_type = type_label
+        state = None
+    timestamp = datetime.datetime.utcnow()
+    objects = []
+    for i in range(count):
+        properties = {
+            PROPERTY_NAME : 'Object ' + str(i),
+            PROPERTY_FILENAME : 'file-' + str(i) + '.tar.gz',
+            'description' : 'Object in serialization benchmark'
+        }
+        objects.append(
+            ObjectSummary(
+                str(uuid.uuid4()),
+                timestamp,
+                properties,
+                object_type,
+                experiment_id=str(uuid.uuid4()),
+                fmri_data_id=str(uuid.uuid4()) if i % 2 == 0 else None,
+                state=state
+            )
+        )
+    return objects
+
+
+def measure(func, repeat):
+    """Get the fastest of several executions of the given function.
+
+    Parameters
+    ----------
+    func : func
+        Function without arguments
+    repeat : int
+        Number of executions
+
+    Returns
+    -------
+    float
+        Duration in seconds
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def run_benchmarks(refs, object_types, sizes, functions, repeat):
+    """Run the benchmarks for all combinations of object type, listing size,
+    and function.
+
+    Parameters
+    ----------
+    refs : scoserv.hateoas.HATEOASReferenceFactory
+        Url factory for API resources
+    object_types : list(string)
+        Benchmarked object types
+    sizes : list(int)
+        Listing sizes
+    functions : list(string)
+        Benchmarked functions
+    repeat : int
+        Number of executions per measurement
+
+    Returns
+    -------
+    list(dict)
+    """
+    results = []
+    for type_label in object_types:
+        for size in sizes:
+            objects = create_objects(type_label, size)
+            listing = ListingPage(objects, 0, size, size * 10, COUNT_EXACT, True)
+            # Inputs for to_references are the reference dictionaries of the
+            # objects
+            ref_dicts = [
+                {r[LIST_KEY] : r[LIST_VALUE] for r in refs.object_references(obj)}
+                    for obj in objects
+            ]
+            calls = {
+                FUNC_TO_REFERENCES : lambda: [to_references(d) for d in ref_dicts],
+                FUNC_OBJECT_REFERENCES : lambda: [refs.object_references(o) for o in objects],
+                FUNC_OBJECT_TO_DICT : lambda: [object_to_dict(o, refs) for o in objects],
+                FUNC_LISTING_TO_DICT : lambda: listing_to_dict(
+                    listing,
+                    refs.base_url + '/listing',
+                    refs,
+                    properties=['description']
+                )
+            }
+            for func in functions:
+                duration = measure(calls[func], repeat)
+                results.append({
+                    'function' : func,
+                    'type' : type_label,
+                    'size' : size,
+                    'total' : duration * 1000,
+                    'perItem' : duration * 1000000 / size
+                })
+    return results
+
+
+def result_key(result):
+    """Unique key for a benchmark result.
+
+    Parameters
+    ----------
+    result : dict
+        Benchmark result
+
+    Returns
+    -------
+    string
+    """
+    return '/'.join([result['function'], result['type'], str(result['size'])])
+
+
+def print_report(results, baseline=None):
+    """Print table of benchmark results. Includes the speedup compared to the
+    baseline if given.
+
+    Parameters
+    ----------
+    results : list(dict)
+        Benchmark results
+    baseline : list(dict), optional
+        Results of an earlier run
+    """
+    base_times = {}
+    if not baseline is None:
+        base_times = {result_key(r) : r['perItem'] for r in baseline}
+    header = '%-18s %-20s %6s %12s %14s' % (
+        'function', 'type', 'size', 'total (ms)', 'per item (us)'
+    )
+    if not baseline is None:
+        header += ' %9s' % 'speedup'
+    print header
+    for r in results:
+        line = '%-18s %-20s %6d %12.3f %14.3f' % (
+            r['function'], r['type'], r['size'], r['total'], r['perItem']
+        )
+        key = result_key(r)
+        if key in base_times and r['perItem'] > 0:
+            line += ' %8.2fx' % (base_times[key] / r['perItem'])
+        print line
+
+
+# ------------------------------------------------------------------------------
+#
+# Main
+#
+# ------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SCO serialization micro-benchmarks')
+    parser.add_argument('--sizes', default=','.join([str(s) for s in SIZES]), help='Comma-separated list of listing sizes')
+    parser.add_argument('--types', default=None, help='Comma-separated list of object types (default: all)')
+    parser.add_argument('--functions', default=None, help='Comma-separated list of functions (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='Executions per measurement')
+    parser.add_argument('--output', default=None, help='Write results as Json to the given file')
+    parser.add_argument('--baseline', default=None, help='Compare against results in the given Json file')
+    args = parser.parse_args()
+    object_types = OBJECT_TYPES
+    if not args.types is None:
+        object_types = args.types.split(',')
+        for type_label in object_types:
+            if not type_label in OBJECT_TYPES:
+                parser.error('unknown object type: ' + type_label)
+    functions = FUNCTIONS
+    if not args.functions is None:
+        functions = args.functions.split(',')
+        for func in functions:
+            if not func in FUNCTIONS:
+                parser.error('unknown function: ' + func)
+    sizes = [int(s) for s in args.sizes.split(',')]
+    results = run_benchmarks(
+        HATEOASReferenceFactory(BASE_URL, BASE_URL + 'doc'),
+        object_types,
+        sizes,
+        functions,
+        args.repeat
+    )
+    baseline = None
+    if not args.baseline is None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print_report(results, baseline=baseline)
+    if not args.output is None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
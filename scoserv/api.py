@@ -8,26 +8,100 @@ The SCO API class contains all the method calls that are available through the
 Web API.
 """
 
+import datetime
 import json
 import os
+import shutil
+import threading
 import urllib2
 import yaml
 
 from scodata import SCODataStore
 from scodata.attribute import AttributeDefinition
+from scodata.experiment import TYPE_EXPERIMENT, PROPERTY_RUN_COUNT
+from scodata.image import TYPE_IMAGE, TYPE_IMAGE_GROUP
+from scodata.modelrun import TYPE_MODEL_RUN
 from scodata.mongo import MongoDBFactory
-from scoengine import EngineException
+from scodata.subject import TYPE_SUBJECT
 from scoengine.model import ModelOutputs
 from scoengine import SCOEngine
 
-from content import ContentPage
+from config import DEFAULT_THREADS, ENV_PREFORK
+from content import ContentPage, DEFAULT_TTL
+import batch
+import dispatch
+import events
 import hateoas
-from widget import WidgetRegistry, WidgetInput
+import listing
+from loader import ComposedResourceLoader, EXPERIMENT_REFS
+from memdb import InMemoryMongoDBFactory
+from metrics import register_mongo_metrics, ENGINE_LATENCY
+import modelcache
+from monitor import call_stats, register_query_counter, InstrumentedProxy
+import runcache
+import upload
+from widget import WidgetRegistry, WidgetInput, TYPE_WIDGET
 
 
 """Home page content identifier."""
 PAGE_HOME = 'home'
 
+"""Object stores of the data store whose calls are recorded in the per-request
+call statistics."""
+DATASTORE_STORES = [
+    'experiments',
+    'funcdata',
+    'images',
+    'image_groups',
+    'predictions',
+    'subjects'
+]
+
+"""Fields of composed resources that contain referenced objects. Referenced
+objects are either expanded (i.e., embedded) or represented by their
+identifier and self reference.
+"""
+FIELD_EXPERIMENT = 'experiment'
+FIELD_FMRI = 'fmri'
+FIELD_IMAGES = 'images'
+FIELD_MODEL = 'model'
+FIELD_SUBJECT = 'subject'
+FIELD_WIDGETS = 'widgets'
+
+"""Fields that are included in every object serialization."""
+FIELDS_REQUIRED = ['id', 'links']
+
+"""Selectable fields and expandable references for experiments."""
+EXPERIMENT_FIELDS = [
+    'name',
+    'timestamp',
+    'properties',
+    FIELD_SUBJECT,
+    FIELD_IMAGES,
+    FIELD_FMRI
+]
+EXPERIMENT_EXPAND = EXPERIMENT_REFS
+
+"""Selectable fields and expandable references for model runs. References of
+the experiment are expanded using the prefix 'experiment.'.
+"""
+PREDICTION_FIELDS = [
+    'name',
+    'timestamp',
+    'properties',
+    'state',
+    'errors',
+    'schedule',
+    'arguments',
+    'attachments',
+    FIELD_MODEL,
+    FIELD_EXPERIMENT,
+    FIELD_WIDGETS
+]
+PREDICTION_EXPAND = [FIELD_MODEL, FIELD_EXPERIMENT] + [
+    FIELD_EXPERIMENT + '.' + ref for ref in EXPERIMENT_REFS
+]
+
 
 class SCOServerAPI(object):
     """The server API implements all API calls that are accessible via the SCO
@@ -47,21 +121,148 @@ class SCOServerAPI(object):
         base_url : string
             Base Url for API resource Urls
         """
-        # Create MongoDB database connector
-        mongo = MongoDBFactory(db_name=config['mongo.db'])
+        # Count MongoDB round trips and record command durations. Command
+        # listeners have to be registered before the first MongoDB client is
+        # created.
+        register_query_counter()
+        register_mongo_metrics()
+        # Create MongoDB database connector. The in-memory database is used
+        # for benchmarks and local development without a MongoDB server.
+        if 'mongo.inmemory' in config and config['mongo.inmemory']:
+            mongo = InMemoryMongoDBFactory(db_name=config['mongo.db'])
+        else:
+            mongo = MongoDBFactory(db_name=config['mongo.db'])
         # Instantiate the Standard Cortical Observer Data Store.
-        self.db = SCODataStore(mongo, os.path.abspath(config['server.datadir']))
-        # Initalize the Url factory
-        self.refs = hateoas.HATEOASReferenceFactory(base_url, config['app.doc'])
-        # Instantiate the SCO workflow engine.
-        self.engine = SCOEngine(mongo)
+        # Calls to the data store (including its object stores), engine,
+        # widget registry, and loader are recorded in the per-request call
+        # statistics.
+        datastore = SCODataStore(mongo, os.path.abspath(config['server.datadir']))
+        self.db = InstrumentedProxy(
+            'db',
+            datastore,
+            call_stats,
+            nested=DATASTORE_STORES
+        )
+        # Directory for file uploads. Should be on the same file system as
+        # the data store.
+        if 'server.uploaddir' in config:
+            self.upload_dir = os.path.abspath(config['server.uploaddir'])
+        else:
+            self.upload_dir = os.path.join(
+                os.path.abspath(config['server.datadir']),
+                'uploads'
+            )
+        # Manager for resumable upload sessions
+        self.uploads = upload.UploadSessionManager(
+            self.upload_dir,
+            ttl=config['uploads.ttl'] if 'uploads.ttl' in config else upload.DEFAULT_SESSION_TTL
+        )
+        # Loader for objects together with the objects they reference
+        # (uses the data store directly to avoid recording its calls twice)
+        self.loader = InstrumentedProxy(
+            'loader',
+            ComposedResourceLoader(datastore),
+            call_stats
+        )
         # Instantiate the widget registry
-        self.widgets = WidgetRegistry(mongo)
+        self.widgets = InstrumentedProxy('widgets', WidgetRegistry(mongo), call_stats)
+        # Ensure that indexes for keyset pagination of object listings exist
+        for store in [
+            self.db.experiments,
+            self.db.images,
+            self.db.image_groups,
+            self.db.subjects,
+            self.widgets
+        ]:
+            listing.ensure_listing_index(store)
+        listing.ensure_listing_index(self.db.predictions, ['experiment'])
+        # Initalize the Url factories for the different reference modes in
+        # responses. The reference mode is set per request (see
+        # set_links_mode()). Urls that are passed to the engine are always
+        # absolute.
+        self.ref_factories = {
+            mode : hateoas.HATEOASReferenceFactory(
+                base_url,
+                config['app.doc'],
+                links=mode
+            ) for mode in hateoas.LINKS_MODES
+        }
+        self.urls = self.ref_factories[hateoas.LINKS_FULL]
+        self.request_state = threading.local()
+        # Instantiate the SCO workflow engine. The duration of all engine
+        # calls is recorded in the engine latency metric.
+        self.engine = InstrumentedProxy(
+            'engine',
+            SCOEngine(mongo),
+            call_stats,
+            latency=ENGINE_LATENCY
+        )
+        # Model definitions are cached in memory. Changes on other nodes are
+        # detected using a version counter in the database.
+        self.model_cache = modelcache.ModelCache(
+            self.engine,
+            mongo,
+            check_interval=config['models.cache.interval'] if 'models.cache.interval' in config else modelcache.DEFAULT_CHECK_INTERVAL
+        )
+        # Model runs are dispatched asynchronously via the outbox unless the
+        # dispatch mode is sync. The in-process broker does not publish runs
+        # to the engine (for tests and local installations). The dispatcher
+        # thread is started by the server once the app has been loaded by the
+        # worker process (or by the first notification).
+        dispatch_mode = config['engine.dispatch'] if 'engine.dispatch' in config else dispatch.DISPATCH_OUTBOX
+        if not dispatch_mode in dispatch.DISPATCH_MODES:
+            raise ValueError('unknown dispatch mode: ' + str(dispatch_mode))
+        if 'engine.broker' in config and config['engine.broker'] == 'inprocess':
+            self.broker = dispatch.InProcessBroker()
+        else:
+            self.broker = dispatch.EngineBroker(self.engine)
+        # Event bus for model run state changes. The mongo backend distributes
+        # events between worker processes. Every open event stream occupies a
+        # request thread. Under the worker pool, at most half of the threads of
+        # a worker serve event streams by default.
+        events_backend = config['events.backend'] if 'events.backend' in config else events.BACKEND_LOCAL
+        if 'events.maxstreams' in config:
+            max_streams = config['events.maxstreams']
+        elif os.environ.get(ENV_PREFORK) == 'true':
+            threads = config['server.threads'] if 'server.threads' in config else DEFAULT_THREADS
+            max_streams = threads // 2
+        else:
+            max_streams = None
+        if events_backend == events.BACKEND_MONGO:
+            self.events = events.EventBus(
+                events.MongoBackend(mongo),
+                max_subscriptions=max_streams
+            )
+        elif events_backend == events.BACKEND_LOCAL:
+            self.events = events.EventBus(max_subscriptions=max_streams)
+        else:
+            raise ValueError('unknown event backend: ' + str(events_backend))
+        if dispatch_mode == dispatch.DISPATCH_OUTBOX:
+            self.outbox = dispatch.Outbox(mongo)
+            self.dispatcher = dispatch.OutboxDispatcher(
+                self.outbox,
+                self.db,
+                self.broker,
+                interval=config['engine.dispatch.interval'] if 'engine.dispatch.interval' in config else dispatch.DEFAULT_INTERVAL,
+                max_attempts=config['engine.dispatch.attempts'] if 'engine.dispatch.attempts' in config else dispatch.DEFAULT_MAX_ATTEMPTS,
+                events=self.events
+            )
+        else:
+            self.outbox = None
+            self.dispatcher = None
+        # Results of successful model runs are reused for new runs with
+        # identical inputs if deduplication is enabled.
+        if 'engine.dedup' in config and config['engine.dedup']:
+            self.run_cache = runcache.RunCache(mongo)
+        else:
+            self.run_cache = None
         # Initialize the set of content pages. Add default home page at the end.
+        # Page bodies are cached for the configured number of seconds.
+        page_ttl = config['pages.ttl'] if 'pages.ttl' in config else DEFAULT_TTL
         self.pages = {}
         page_descriptors = []
         for doc in config['doc.pages']:
-            page = ContentPage(doc)
+            page = ContentPage(doc, ttl=page_ttl)
             self.pages[page.id] = page
             page_descriptors.append(page)
         home_page = ContentPage({
@@ -70,7 +271,7 @@ class SCOServerAPI(object):
             'title': config['home.title'],
             'sortOrder': -1,
             'resource': config['home.content']
-        })
+        }, ttl=page_ttl)
         self.pages[PAGE_HOME] = home_page
         page_descriptors.append(home_page)
         # Initialize the server description object. Name and title are elements
@@ -94,6 +295,32 @@ class SCOServerAPI(object):
             'links': self.refs.service_references()
         }
 
+    @property
+    def refs(self):
+        """Url factory for the references in responses. Depends on the
+        reference mode of the current request (default: full).
+
+        Returns
+        -------
+        hateoas.HATEOASReferenceFactory
+        """
+        return self.ref_factories[
+            getattr(self.request_state, 'links', hateoas.LINKS_FULL)
+        ]
+
+    def set_links_mode(self, mode):
+        """Set the reference mode for responses to the current request (i.e.,
+        for the calling thread). Raises ValueError for unknown modes.
+
+        Parameters
+        ----------
+        mode : string
+            Reference mode (full, relative, or none)
+        """
+        if not mode in hateoas.LINKS_MODES:
+            raise ValueError('invalid links mode: ' + str(mode))
+        self.request_state.links = mode
+
     # --------------------------------------------------------------------------
     # Experiments
     # --------------------------------------------------------------------------
@@ -139,13 +366,17 @@ class SCOServerAPI(object):
         """
         return self.db.experiments_delete(experiment_id)
 
-    def experiments_get(self, experiment_id):
+    def experiments_get(self, experiment_id, fields=None, expand=None):
         """Retrieve an experiment object from the data store.
 
         Parameters
         ----------
         experiment_id : string
             Unique experiment identifier
+        fields : list(string), optional
+            Fields to include in the result (default: all)
+        expand : list(string), optional
+            Referenced objects that are embedded in the result (default: all)
 
         Returns
         -------
@@ -153,32 +384,26 @@ class SCOServerAPI(object):
             Dictionary representing the experiment object or None if no
             experiment with the given identifier exists
         """
-        # Get experiment object from database. Return None if not experiment
-        # with given identifier exists
-        experiment = self.db.experiments_get(experiment_id)
+        # Get experiment object together with associated subject, image_group,
+        # and fMRI data (if present) from database. Only the objects that are
+        # expanded are loaded. Return None if not experiment with given
+        # identifier exists
+        experiment = self.loader.get_experiment(
+            experiment_id,
+            refs=[
+                ref for ref in EXPERIMENT_REFS
+                    if is_expanded(ref, fields, expand)
+            ]
+        )
         if experiment is None:
             return None
-        # Retrieve associated subject, image_group, and fMRI data (if present)
-        # TODO: Handle cases where either of the objects has been deleted
-        # By now we return None, i.e., the experiment does not exist if
-        # the subject or image group has been deleted (CASCADE DELETE).
-        obj = object_to_dict(experiment, self.refs)
-        subject = self.subjects_get(experiment.subject_id)
-        if subject is None:
-            return None
-        else:
-            obj['subject'] = subject
-        image_group = self.image_groups_get(experiment.image_group_id)
-        if image_group is None:
-            return None
-        else:
-            obj['images'] = image_group
-        if not experiment.fmri_data_id is None:
-            obj['fmri'] = self.experiments_fmri_get(experiment.identifier)
-        # Return Json serialization of object.
-        return obj
+        return self.experiment_to_dict(
+            experiment,
+            fields=fields,
+            expand=expand
+        )
 
-    def experiments_list(self, limit=-1, offset=0, properties=None):
+    def experiments_list(self, limit=-1, offset=0, properties=None, cursor=None, count_mode=listing.COUNT_EXACT):
         """Get a listing of all experiment objects in the data store.
 
         Parameters
@@ -191,14 +416,33 @@ class SCOServerAPI(object):
         properties : list(string), optional
             List of additional properties to be included in the listing for
             each item
+        cursor : string, optional
+            Listing cursor for keyset pagination. If given, the offset is
+            ignored. An empty cursor refers to the first page in the listing.
+        count_mode : string, optional
+            Mode for counting the total number of objects in the listing
+            (exact, estimated, or none)
 
         Returns
         -------
         dict
             Dictionary representing a listing of experiment objects
         """
+        objects = listing.list_objects(
+            self.db.experiments,
+            TYPE_EXPERIMENT,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+            properties=properties,
+            count_mode=count_mode
+        )
+        # The run count is not stored with the experiment. It is only computed
+        # if requested.
+        if not properties is None and PROPERTY_RUN_COUNT in properties:
+            listing.set_run_counts(self.db.predictions, objects.items)
         return listing_to_dict(
-            self.db.experiments_list(limit=limit, offset=offset),
+            objects,
             self.refs.experiments_reference(),
             self.refs,
             properties=properties
@@ -224,6 +468,68 @@ class SCOServerAPI(object):
         """
         return self.db.experiments_upsert_property(experiment_id, properties)
 
+    def experiment_to_dict(self, experiment, fields=None, expand=None):
+        """Dictionary serialization for an experiment including the serialized
+        subject, image group, and fMRI data objects. Referenced objects that
+        are not expanded are represented by their identifier and self
+        reference.
+
+        Parameters
+        ----------
+        experiment : loader.ComposedExperiment
+            Experiment handle together with associated object handles
+        fields : list(string), optional
+            Fields to include in the result (default: all)
+        expand : list(string), optional
+            Referenced objects that are embedded in the result (default: all)
+
+        Returns
+        -------
+        dict
+            Dictionary representing the experiment object or None if the
+            subject or image group of the experiment have been deleted
+        """
+        # TODO: Handle cases where either of the objects has been deleted
+        # By now we return None, i.e., the experiment does not exist if
+        # the subject or image group has been deleted (CASCADE DELETE). This
+        # can only be detected for objects that have been loaded.
+        if is_expanded(FIELD_SUBJECT, fields, expand):
+            if experiment.subject is None:
+                return None
+        if is_expanded(FIELD_IMAGES, fields, expand):
+            if experiment.image_group is None:
+                return None
+        handle = experiment.experiment
+        obj = select_fields(object_to_dict(handle, self.refs), fields)
+        if is_expanded(FIELD_SUBJECT, fields, expand):
+            obj[FIELD_SUBJECT] = object_to_dict(experiment.subject, self.refs)
+        elif is_selected(FIELD_SUBJECT, fields):
+            obj[FIELD_SUBJECT] = reference_to_dict(
+                handle.subject_id,
+                self.refs.subject_reference(handle.subject_id),
+                self.refs
+            )
+        if is_expanded(FIELD_IMAGES, fields, expand):
+            obj[FIELD_IMAGES] = self.image_group_to_dict(experiment.image_group)
+        elif is_selected(FIELD_IMAGES, fields):
+            obj[FIELD_IMAGES] = reference_to_dict(
+                handle.image_group_id,
+                self.refs.image_group_reference(handle.image_group_id),
+                self.refs
+            )
+        if is_expanded(FIELD_FMRI, fields, expand):
+            if not experiment.fmri is None:
+                obj[FIELD_FMRI] = object_to_dict(experiment.fmri, self.refs)
+        elif is_selected(FIELD_FMRI, fields):
+            if not handle.fmri_data_id is None:
+                obj[FIELD_FMRI] = reference_to_dict(
+                    handle.fmri_data_id,
+                    self.refs.experiments_fmri_reference(handle.identifier),
+                    self.refs
+                )
+        # Return Json serialization of object.
+        return obj
+
     # --------------------------------------------------------------------------
     # Functional Data
     # --------------------------------------------------------------------------
@@ -366,7 +672,7 @@ class SCOServerAPI(object):
         # Get the model definition for a list of attachments. If the resource
         # identifier matches a defined attachment use the defined MimeType for
         # the attachment. Otherwise, MimeType will be inferred from file suffix.
-        model = self.engine.get_model(model_run.model_id)
+        model = self.model_cache.get_model(model_run.model_id)
         if model is None:
             return None
         mime_type = None
@@ -442,7 +748,12 @@ class SCOServerAPI(object):
         )
 
     def experiments_predictions_create(self, experiment_id, model_id, name, arguments=None, properties=None):
-        """Create new model run for given experiment.
+        """Create new model run for given experiment. In outbox dispatch mode
+        the run is recorded for dispatch by the background dispatcher and the
+        method returns without contacting the engine. If result deduplication
+        is enabled and a successful run with identical inputs exists, the new
+        run reuses its result and is not dispatched at all. In sync dispatch
+        mode the run is set to failed if it cannot be published.
 
         Raises a ValueError is the specified model does not exist.
 
@@ -465,42 +776,182 @@ class SCOServerAPI(object):
             Dictionary representing a successful response. The result is None if
             the specified experiment does not exist.
         """
-        # Make sure that the referenced model exists.
-        model = self.engine.get_model(model_id)
+        # Make sure that the experiment and the referenced model exist.
+        if not self.db.experiments.exists_object(experiment_id):
+            return None
+        model = self.model_cache.get_model(model_id)
         if model is None:
             raise ValueError('unknown model: ' + model_id)
-        # Call create method of API to get a new model run object handle.
-        model_run = self.db.experiments_predictions_create(
+        model_run = batch.build_model_run(
+            self.db.predictions,
             experiment_id,
             model_id,
             model.parameters,
-            name,
-            arguments=arguments,
-            properties=properties
+            batch.ModelRunSpec(
+                name,
+                arguments if not arguments is None else [],
+                properties=properties
+            )
         )
-        # The result is None if experiment does not exists
-        if model_run is None:
-            return None
-        # Start the model run
-        try:
-            self.engine.run_model(
-                model_run,
-                self.refs.experiments_prediction_reference(
-                    experiment_id,
-                    model_run.identifier
-                )
+        run_url = self.urls.experiments_prediction_reference(
+            experiment_id,
+            model_run.identifier
+        )
+        # Look for a successful run with identical inputs before anything is
+        # written. The new run reuses its result and is never recorded for
+        # dispatch in this case.
+        if not self.run_cache is None:
+            fingerprint, cached_run = self.find_cached_result(
+                self.db.experiments_get(experiment_id),
+                model,
+                model_run
             )
-        except EngineException as ex:
-            # Delete model run from database if running the model failed.
-            self.db.experiments_predictions_delete(
+            if not cached_run is None:
+                self.insert_model_runs([model_run])
+                return response_success(
+                    self.reuse_cached_result(cached_run, model_run, fingerprint),
+                    self.refs
+                )
+            self.run_cache.add(model_run, fingerprint)
+        # Record the model run for dispatch before the run is inserted, i.e.,
+        # no run exists without a dispatch request.
+        if not self.outbox is None:
+            self.outbox.add(model_run, run_url)
+        self.insert_model_runs([model_run])
+        if not self.outbox is None:
+            self.dispatcher.notify()
+            return response_success(model_run, self.refs)
+        # Start the model run. Set the run to failed if it cannot be
+        # published (as the dispatcher does in outbox mode).
+        try:
+            self.broker.publish(model_run, run_url)
+        except Exception as ex:
+            failed_run = self.experiments_predictions_update_state_error(
                 model_run.experiment_id,
                 model_run.identifier,
-                erase=True
+                [getattr(ex, 'message', None) or str(ex)]
             )
-            raise ValueError(ex.message)
+            if not failed_run is None:
+                model_run = failed_run
         # Return success including list of references for new model run.
         return response_success(model_run, self.refs)
 
+    def experiments_predictions_create_batch(self, experiment_id, model_id, runs):
+        """Create a batch of model runs for given experiment. The model is
+        retrieved once and the arguments of all runs are validated before any
+        run is created. All runs are inserted with a single write. In outbox
+        dispatch mode the dispatch requests for all runs are recorded with a
+        single write. In sync dispatch mode the runs are published with a
+        single broker call.
+
+        Raises a ValueError is the specified model does not exist or if the
+        arguments for any of the runs are invalid.
+
+        Parameters
+        ----------
+        experiment_id : string
+            Unique experiment identifier
+        model_id : string
+            Unique identifier of model to run
+        runs : list(batch.ModelRunSpec)
+            Specification of model runs
+
+        Returns
+        -------
+        dict
+            Dictionary representing a successful response. The result is None if
+            the specified experiment does not exist. If the engine fails while
+            the runs are started, the result is 'PARTIAL'. Element 'runs' then
+            lists the runs that have been started and element 'failed' the
+            runs that have been marked as failed.
+        """
+        # Make sure that the experiment and the referenced model exist.
+        if not self.db.experiments.exists_object(experiment_id):
+            return None
+        model = self.model_cache.get_model(model_id)
+        if model is None:
+            raise ValueError('unknown model: ' + model_id)
+        model_runs = batch.build_model_runs(
+            self.db.predictions,
+            experiment_id,
+            model_id,
+            model.parameters,
+            runs
+        )
+        run_urls = [
+            self.urls.experiments_prediction_reference(
+                experiment_id,
+                model_run.identifier
+            ) for model_run in model_runs
+        ]
+        # Look for successful runs with identical inputs before anything is
+        # written. Runs that reuse a result are never recorded for dispatch.
+        cache_hits = dict()
+        if not self.run_cache is None:
+            experiment = self.db.experiments_get(experiment_id)
+            for model_run in model_runs:
+                fingerprint, cached_run = self.find_cached_result(
+                    experiment,
+                    model,
+                    model_run
+                )
+                if not cached_run is None:
+                    cache_hits[model_run.identifier] = (fingerprint, cached_run)
+                else:
+                    self.run_cache.add(model_run, fingerprint)
+        pending = [
+            i for i in range(len(model_runs))
+                if not model_runs[i].identifier in cache_hits
+        ]
+        pending_runs = [model_runs[i] for i in pending]
+        pending_urls = [run_urls[i] for i in pending]
+        # Record the dispatch requests for all pending runs before the runs
+        # are inserted, i.e., no run exists without a dispatch request.
+        if not self.outbox is None and len(pending_runs) > 0:
+            self.outbox.add_many(pending_runs, pending_urls)
+        self.insert_model_runs(model_runs)
+        # Copy the results for runs with identical inputs.
+        for i in range(len(model_runs)):
+            if model_runs[i].identifier in cache_hits:
+                fingerprint, cached_run = cache_hits[model_runs[i].identifier]
+                model_runs[i] = self.reuse_cached_result(
+                    cached_run,
+                    model_runs[i],
+                    fingerprint
+                )
+        if not self.outbox is None:
+            if len(pending_runs) > 0:
+                self.dispatcher.notify()
+        elif len(pending_runs) > 0:
+            try:
+                self.broker.publish_many(pending_runs, pending_urls)
+            except dispatch.BatchPublishError as ex:
+                # Runs that have been started cannot be withdrawn. Mark the
+                # remaining runs as failed instead of deleting them and report
+                # the partial success to the client.
+                message = ex.message
+                failed_runs = pending_runs[ex.count:]
+                for model_run in failed_runs:
+                    self.experiments_predictions_update_state_error(
+                        experiment_id,
+                        model_run.identifier,
+                        [message]
+                    )
+                failed_ids = set([r.identifier for r in failed_runs])
+                return {
+                    'result' : 'PARTIAL',
+                    'runs' : runs_to_dict(
+                        [r for r in model_runs if not r.identifier in failed_ids],
+                        self.refs
+                    ),
+                    'failed' : runs_to_dict(failed_runs, self.refs),
+                    'error' : message
+                }
+        return {
+            'result' : 'SUCCESS',
+            'runs' : runs_to_dict(model_runs, self.refs)
+        }
+
     def experiments_predictions_delete(self, experiment_id, run_id):
         """Delete given prediction for experiment.
 
@@ -516,7 +967,10 @@ class SCOServerAPI(object):
         ModelRunHandle
             Handle for deleted model run or None if unknown
         """
-        return self.db.experiments_predictions_delete(experiment_id, run_id)
+        model_run = self.db.experiments_predictions_delete(experiment_id, run_id)
+        if not model_run is None and not self.run_cache is None:
+            self.run_cache.delete(run_id)
+        return model_run
 
     def experiments_predictions_download(self, experiment_id, prediction_id):
         """Download model run result data file.
@@ -539,7 +993,7 @@ class SCOServerAPI(object):
             prediction_id
         )
 
-    def experiments_predictions_get(self, experiment_id, prediction_id):
+    def experiments_predictions_get(self, experiment_id, prediction_id, fields=None, expand=None):
         """Get model run object that is associated with a given experiment.
 
         Parameters
@@ -548,6 +1002,11 @@ class SCOServerAPI(object):
             Unique experiment identifier
         prediction_id : string
             Unique model run identifier
+        fields : list(string), optional
+            Fields to include in the result (default: all)
+        expand : list(string), optional
+            Referenced objects that are embedded in the result (default: all).
+            References of the experiment are prefixed by 'experiment.'.
 
         Returns
         -------
@@ -555,82 +1014,92 @@ class SCOServerAPI(object):
             Dictionary representing model run or None if no model run with given
             identifier exists or is associated with given experiment.
         """
-        # Get model run object from database. Return None if model run does
-        # not exist.
-        model_run = self.db.experiments_predictions_get(
+        # Get model run object together with the experiment and the objects
+        # the experiment references from database. Only the objects of an
+        # expanded experiment are loaded. Return None if model run does not
+        # exist.
+        experiment_expand = expand_arguments(expand, FIELD_EXPERIMENT)
+        refs = []
+        if is_expanded(FIELD_EXPERIMENT, fields, expand):
+            refs = [
+                ref for ref in EXPERIMENT_REFS
+                    if is_expanded(ref, None, experiment_expand)
+            ]
+        result = self.loader.get_model_run(
             experiment_id,
-            prediction_id
+            prediction_id,
+            refs=refs
         )
-        if model_run is None:
+        if result is None:
             return None
-        obj = object_to_dict(model_run, self.refs)
-        # Add model identifier. If the model is None it has been deleted. In
-        # this case the overall result will be None
-        model =  self.models_get(model_run.model_id)
-        if model is None:
-            return None
-        obj['model'] = model
+        model_run, experiment = result
+        obj = select_fields(object_to_dict(model_run, self.refs), fields)
+        # Add model. If the model is None it has been deleted. In this case
+        # the overall result will be None. The model registry is only accessed
+        # if the model is expanded.
+        if is_expanded(FIELD_MODEL, fields, expand):
+            model =  self.models_get(model_run.model_id)
+            if model is None:
+                return None
+            obj[FIELD_MODEL] = model
+        elif is_selected(FIELD_MODEL, fields):
+            obj[FIELD_MODEL] = reference_to_dict(
+                model_run.model_id,
+                self.refs.model_reference(model_run.model_id),
+                self.refs
+            )
         # Add experiment information
-        obj['experiment'] = self.experiments_get(experiment_id)
+        if is_expanded(FIELD_EXPERIMENT, fields, expand):
+            obj[FIELD_EXPERIMENT] = self.experiment_to_dict(
+                experiment,
+                expand=experiment_expand
+            )
+        elif is_selected(FIELD_EXPERIMENT, fields):
+            obj[FIELD_EXPERIMENT] = reference_to_dict(
+                experiment_id,
+                self.refs.experiment_reference(experiment_id),
+                self.refs
+            )
         # Add state information
-        obj['state'] =  str(model_run.state)
-        if model_run.state.is_failed:
+        if is_selected('state', fields):
+            obj['state'] =  str(model_run.state)
+        if is_selected('errors', fields) and model_run.state.is_failed:
             obj['errors'] = model_run.state.errors
         # Add life cycle Timestamps
-        obj['schedule'] = model_run.schedule
+        if is_selected('schedule', fields):
+            obj['schedule'] = model_run.schedule
         # Add model run arguments
-        obj['arguments'] = [
-            {
-                'name' : attr,
-                'value' : model_run.arguments[attr].value
-            } for attr in model_run.arguments
-        ]
+        if is_selected('arguments', fields):
+            obj['arguments'] = [
+                {
+                    'name' : attr,
+                    'value' : model_run.arguments[attr].value
+                } for attr in model_run.arguments
+            ]
         # Add model run attachments
-        obj['attachments'] = [
-            {
-                'id' : attachment,
-                'mimeType' : model_run.attachments[attachment].mime_type,
-                'filesize' : model_run.attachments[attachment].filesize,
-                'links' : self.refs.experiments_prediction_attachment_references(
-                    experiment_id,
-                    prediction_id,
-                    model_run.attachments[attachment]
-                )
-            } for attachment in sorted(model_run.attachments)
-        ]
-        # Add widgets
-        obj['widgets'] = [];
-        # Get all widgets that have been defined for the model that was run.
-        # Widgets are keyed by attachment.
-        model_widgets = self.widgets.find_widgets_for_model(model_run.model_id)
-        for key in model_run.attachments:
-            if key in model_widgets:
-                for widget in model_widgets[key]:
-                    if widget.engine_id == 'VEGALITE':
-                        attachment = model_run.attachments[key]
-                        url = self.refs.experiments_prediction_attachment_reference(
-                            experiment_id,
-                            prediction_id,
-                            key
-                        )
-                        mime_type = attachment.mime_type
-                        if mime_type == 'text/csv':
-                            format_type = 'csv'
-                        elif mime_type == 'text/tab-separated-values':
-                            format_type = 'tsv'
-                        else:
-                            format_type = 'json'
-                        code = {key : widget.code[key] for key in widget.code}
-                        code['$schema'] = 'https://vega.github.io/schema/vega-lite/v2.json'
-                        code['data'] = {
-                            'url' : url,
-                            'formatType' : format_type
-                        }
-                        obj['widgets'].append({
-                            'engine' : widget.engine_id,
-                            'title' : widget.title,
-                            'code' : code
-                        })
+        if is_selected('attachments', fields):
+            obj['attachments'] = [
+                {
+                    'id' : attachment,
+                    'mimeType' : model_run.attachments[attachment].mime_type,
+                    'filesize' : model_run.attachments[attachment].filesize
+                } for attachment in sorted(model_run.attachments)
+            ]
+            if self.refs.links != hateoas.LINKS_NONE:
+                for item in obj['attachments']:
+                    item['links'] = self.refs.experiments_prediction_attachment_references(
+                        experiment_id,
+                        prediction_id,
+                        model_run.attachments[item['id']]
+                    )
+        # Add widgets. The widget registry is only accessed if widgets are
+        # included in the result.
+        if is_selected(FIELD_WIDGETS, fields):
+            obj[FIELD_WIDGETS] = self.model_run_widgets(
+                experiment_id,
+                prediction_id,
+                model_run
+            )
         # Return complete serialization of model run
         return obj
 
@@ -663,7 +1132,7 @@ class SCOServerAPI(object):
             return None
         return object_to_dict(image_set, self.refs)
 
-    def experiments_predictions_list(self, experiment_id, limit=-1, offset=0, properties=None):
+    def experiments_predictions_list(self, experiment_id, limit=-1, offset=0, properties=None, cursor=None, count_mode=listing.COUNT_EXACT):
         """Get a listing of all model runs for a given experiment in the data
         store.
 
@@ -679,23 +1148,70 @@ class SCOServerAPI(object):
         properties : list(string), optional
             List of additional properties to be included in the listing for
             each item
+        cursor : string, optional
+            Listing cursor for keyset pagination. If given, the offset is
+            ignored. An empty cursor refers to the first page in the listing.
+        count_mode : string, optional
+            Mode for counting the total number of objects in the listing
+            (exact, estimated, or none)
 
         Returns
         -------
         dict
-            Dictionary representing a listing of model runs
+            Dictionary representing a listing of model runs or None if the
+            experiment does not exist
         """
+        # Return None if the experiment does not exist
+        if not self.db.experiments.exists_object(experiment_id):
+            return None
+        objects = listing.list_objects(
+            self.db.predictions,
+            TYPE_MODEL_RUN,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+            query={'experiment' : experiment_id},
+            properties=properties,
+            count_mode=count_mode
+        )
         return listing_to_dict(
-            self.db.experiments_predictions_list(
-                experiment_id,
-                limit=limit,
-                offset=offset
-            ),
+            objects,
             self.refs.experiments_predictions_reference(experiment_id),
             self.refs,
             properties=properties
         )
 
+    def experiments_predictions_subscribe(self, experiment_id, run_id=None):
+        """Subscribe to state changes of a model run or of all model runs for
+        an experiment. The subscription is created before the current state is
+        read, i.e., no state change is missed.
+
+        Parameters
+        ----------
+        experiment_id : string
+            Unique experiment identifier
+        run_id : string, optional
+            Unique model run identifier
+
+        Raises events.StreamLimitExceeded if the maximum number of open event
+        streams has been reached.
+
+        Returns
+        -------
+        (events.Subscription, list(dict))
+            Subscription and state events for the current state of the
+            model run. None if the experiment or model run does not exist.
+        """
+        subscription = self.events.subscribe(experiment_id, run_id=run_id)
+        if not run_id is None:
+            model_run = self.db.experiments_predictions_get(experiment_id, run_id)
+            if not model_run is None:
+                return subscription, [events.state_event(model_run)]
+        elif self.db.experiments.exists_object(experiment_id):
+            return subscription, []
+        self.events.unsubscribe(subscription)
+        return None
+
     def experiments_predictions_update_state_active(self, experiment_id, run_id):
         """Update state of given prediction to active.
 
@@ -711,10 +1227,13 @@ class SCOServerAPI(object):
         ModelRunHandle
             Handle for updated model run or None is prediction is undefined
         """
-        return self.db.experiments_predictions_update_state_active(
+        model_run = self.db.experiments_predictions_update_state_active(
             experiment_id,
             run_id
         )
+        if not model_run is None:
+            self.events.publish_state(model_run)
+        return model_run
 
     def experiments_predictions_update_state_error(self, experiment_id, run_id, errors):
         """Update state of given prediction to failed. Set error messages that
@@ -734,11 +1253,16 @@ class SCOServerAPI(object):
         ModelRunHandle
             Handle for updated model run or None is prediction is undefined
         """
-        return self.db.experiments_predictions_update_state_error(
+        model_run = self.db.experiments_predictions_update_state_error(
             experiment_id,
             run_id,
             errors
         )
+        if not model_run is None:
+            if not self.run_cache is None:
+                self.run_cache.delete(run_id)
+            self.events.publish_state(model_run)
+        return model_run
 
     def experiments_predictions_update_state_success(self, experiment_id, run_id, result_file):
         """Update state of given prediction to success. Create a function data
@@ -758,11 +1282,16 @@ class SCOServerAPI(object):
         ModelRunHandle
             Handle for updated model run or None is prediction is undefined
         """
-        return self.db.experiments_predictions_update_state_success(
+        model_run = self.db.experiments_predictions_update_state_success(
             experiment_id,
             run_id,
             result_file
         )
+        if not model_run is None:
+            if not self.run_cache is None:
+                self.run_cache.set_success(run_id)
+            self.events.publish_state(model_run)
+        return model_run
 
     def experiments_predictions_upsert_property(self, experiment_id, run_id, properties):
         """Upsert property of a prodiction for an experiment.
@@ -790,6 +1319,126 @@ class SCOServerAPI(object):
             properties
         )
 
+    def insert_model_runs(self, model_runs):
+        """Insert new model runs with a single write. If the write fails, the
+        dispatch requests and run cache entries that have been recorded for the
+        runs are removed.
+
+        Parameters
+        ----------
+        model_runs : list(scodata.modelrun.ModelRunHandle)
+            Handles for new model runs
+        """
+        try:
+            batch.insert_model_runs(self.db.predictions, model_runs)
+        except Exception:
+            if not self.outbox is None:
+                self.outbox.remove([r.identifier for r in model_runs])
+            if not self.run_cache is None:
+                for model_run in model_runs:
+                    self.run_cache.delete(model_run.identifier)
+            raise
+
+    def model_run_widgets(self, experiment_id, prediction_id, model_run):
+        """Get serializations of all widgets that have been defined for the
+        attachments of a given model run.
+
+        Parameters
+        ----------
+        experiment_id : string
+            Unique experiment identifier
+        prediction_id : string
+            Unique model run identifier
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for model run
+
+        Returns
+        -------
+        list(dict)
+        """
+        widgets = []
+        # Get all widgets that have been defined for the model that was run.
+        # Widgets are keyed by attachment.
+        model_widgets = self.widgets.find_widgets_for_model(model_run.model_id)
+        for key in model_run.attachments:
+            if key in model_widgets:
+                for widget in model_widgets[key]:
+                    if widget.engine_id == 'VEGALITE':
+                        attachment = model_run.attachments[key]
+                        url = self.refs.experiments_prediction_attachment_reference(
+                            experiment_id,
+                            prediction_id,
+                            key
+                        )
+                        mime_type = attachment.mime_type
+                        if mime_type == 'text/csv':
+                            format_type = 'csv'
+                        elif mime_type == 'text/tab-separated-values':
+                            format_type = 'tsv'
+                        else:
+                            format_type = 'json'
+                        code = {key : widget.code[key] for key in widget.code}
+                        code['$schema'] = 'https://vega.github.io/schema/vega-lite/v2.json'
+                        code['data'] = {
+                            'url' : url,
+                            'formatType' : format_type
+                        }
+                        widgets.append({
+                            'engine' : widget.engine_id,
+                            'title' : widget.title,
+                            'code' : code
+                        })
+        return widgets
+
+    def find_cached_result(self, experiment, model, model_run):
+        """Get a successful model run with the same inputs as a new model run.
+
+        Parameters
+        ----------
+        experiment : scodata.experiment.ExperimentHandle
+            Handle for the experiment of the model run
+        model : scoengine.model.ModelHandle
+            Handle for the model that is run
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for new model run
+
+        Returns
+        -------
+        (string, scodata.modelrun.ModelRunHandle)
+            Fingerprint of the new model run and the successful model run with
+            identical inputs (None if no such run exists)
+        """
+        fingerprint = runcache.fingerprint(
+            model,
+            experiment,
+            model_run.arguments
+        )
+        return fingerprint, self.run_cache.find(self.db, fingerprint)
+
+    def reuse_cached_result(self, cached_run, model_run, fingerprint):
+        """Set a new model run that has been inserted without a dispatch
+        request to success using the result of a successful run with identical
+        inputs. Records the fingerprint of the new run in the run cache.
+
+        Parameters
+        ----------
+        cached_run : scodata.modelrun.ModelRunHandle
+            Handle for successful model run with identical inputs
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for new model run
+        fingerprint : string
+            Fingerprint of model run inputs
+
+        Returns
+        -------
+        scodata.modelrun.ModelRunHandle
+            Handle for the updated model run
+        """
+        model_run = runcache.copy_result(self.db, cached_run, model_run)
+        self.events.publish_state(model_run)
+        self.run_cache.add(model_run, fingerprint, success=True)
+        return model_run
+
     # --------------------------------------------------------------------------
     # Image Files
     # --------------------------------------------------------------------------
@@ -846,7 +1495,7 @@ class SCOServerAPI(object):
             return None
         return object_to_dict(img_file, self.refs)
 
-    def image_files_list(self, limit=-1, offset=0, properties=None):
+    def image_files_list(self, limit=-1, offset=0, properties=None, cursor=None, count_mode=listing.COUNT_EXACT):
         """Get a listing of all image file objects in the data store.
 
         Parameters
@@ -859,14 +1508,29 @@ class SCOServerAPI(object):
         properties : list(string), optional
             List of additional properties to be included in the listing for
             each item
+        cursor : string, optional
+            Listing cursor for keyset pagination. If given, the offset is
+            ignored. An empty cursor refers to the first page in the listing.
+        count_mode : string, optional
+            Mode for counting the total number of objects in the listing
+            (exact, estimated, or none)
 
         Returns
         -------
         dict
             Dictionary representing a listing of image file objects
         """
+        objects = listing.list_objects(
+            self.db.images,
+            TYPE_IMAGE,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+            properties=properties,
+            count_mode=count_mode
+        )
         return listing_to_dict(
-            self.db.image_files_list(limit=limit, offset=offset),
+            objects,
             self.refs.image_files_reference(),
             self.refs,
             properties=properties
@@ -946,16 +1610,29 @@ class SCOServerAPI(object):
         img_grp = self.db.image_groups_get(image_group_id)
         if img_grp is None:
             return None
+        return self.image_group_to_dict(img_grp)
+
+    def image_group_to_dict(self, img_grp):
+        """Dictionary serialization for image group.
+
+        Parameters
+        ----------
+        img_grp : scodata.image.ImageGroupHandle
+            Image group handle
+
+        Returns
+        -------
+        dict
+        """
         obj = object_to_dict(img_grp, self.refs)
         # Add list of contained images
-        obj['images'] =  {
-            'count' : len(img_grp.images),
-            'links' : hateoas.self_reference_set(
+        obj['images'] =  {'count' : len(img_grp.images)}
+        if self.refs.links != hateoas.LINKS_NONE:
+            obj['images']['links'] = hateoas.self_reference_set(
                 self.refs.image_group_images_list_reference(
                     img_grp.identifier
                 )
             )
-        }
         # Add image group options
         obj['options'] = [
             {
@@ -991,31 +1668,35 @@ class SCOServerAPI(object):
         if image_listing is None:
             return None
         # Generate list of object in listing
+        refs = self.refs
         items = []
         for obj in image_listing.items:
             # Create baseic object representation
-            items.append({
+            item = {
                 'id' : obj.identifier,
                 'name' : obj.name,
-                'folder' : obj.folder,
-                'links' : self.refs.image_group_image_references(
+                'folder' : obj.folder
+            }
+            if refs.links != hateoas.LINKS_NONE:
+                item['links'] = refs.image_group_image_references(
                     obj.identifier,
                     os.path.basename(obj.filename)
                 )
-            })
+            items.append(item)
         # Call generic item listing decorator
         return items_listing_to_dict(
             image_listing,
             items,
             None,
-            self.refs.image_group_images_list_reference(image_group_id),
+            refs.image_group_images_list_reference(image_group_id),
             links={
                 hateoas.REF_KEY_IMAGE_GROUP :
-                self.refs.image_group_reference(image_group_id)
-            }
+                refs.image_group_reference(image_group_id)
+            },
+            links_mode=refs.links
         )
 
-    def image_groups_list(self, limit=-1, offset=0, properties=None):
+    def image_groups_list(self, limit=-1, offset=0, properties=None, cursor=None, count_mode=listing.COUNT_EXACT):
         """Get a listing of all image group objects in the data store.
 
         Parameters
@@ -1028,14 +1709,29 @@ class SCOServerAPI(object):
         properties : list(string), optional
             List of additional properties to be included in the listing for
             each item
+        cursor : string, optional
+            Listing cursor for keyset pagination. If given, the offset is
+            ignored. An empty cursor refers to the first page in the listing.
+        count_mode : string, optional
+            Mode for counting the total number of objects in the listing
+            (exact, estimated, or none)
 
         Returns
         -------
         dict
             Dictionary representing a listing of image group objects
         """
+        objects = listing.list_objects(
+            self.db.image_groups,
+            TYPE_IMAGE_GROUP,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+            properties=properties,
+            count_mode=count_mode
+        )
         return listing_to_dict(
-            self.db.image_groups_list(limit=limit, offset=offset),
+            objects,
             self.refs.image_groups_reference(),
             self.refs,
             properties=properties
@@ -1134,7 +1830,10 @@ class SCOServerAPI(object):
         ModelHandle
             Handle for deleted model or None if unknown
         """
-        return self.engine.delete_model(model_id)
+        model = self.engine.delete_model(model_id)
+        if not model is None:
+            self.model_cache.invalidate()
+        return model
 
     def models_get(self, model_id):
         """Retrieve a model description from the model registry.
@@ -1152,7 +1851,7 @@ class SCOServerAPI(object):
         """
         # Get subject from database. Return None if not subject with given
         # identifier exist.
-        model = self.engine.get_model(model_id)
+        model = self.model_cache.get_model(model_id)
         if model is None:
             return None
         # Model handle does not inherit from ObjectHandle. Thus, we cannot use
@@ -1216,15 +1915,15 @@ class SCOServerAPI(object):
                 attributeDefs.append(AttributeDefinition.from_dict(doc))
         except KeyError as ex:
             raise ValueError(str(ex))
-        return self.model_to_dict(
-            self.engine.register_model(
-                model_id,
-                properties,
-                attributeDefs,
-                ModelOutputs.from_dict(outputs),
-                connector
-            )
+        model = self.engine.register_model(
+            model_id,
+            properties,
+            attributeDefs,
+            ModelOutputs.from_dict(outputs),
+            connector
         )
+        self.model_cache.invalidate()
+        return self.model_to_dict(model)
 
     def models_update_connector(self, model_id, connector):
         """Update the connector information for a given model.
@@ -1243,9 +1942,10 @@ class SCOServerAPI(object):
         ModelHandle
             Handle for updated model or None if model doesn't exist
         """
-        return self.model_to_dict(
-            self.engine.update_model_connector(model_id, connector)
-        )
+        model = self.engine.update_model_connector(model_id, connector)
+        if not model is None:
+            self.model_cache.invalidate()
+        return self.model_to_dict(model)
 
     def models_upsert_property(self, model_id, properties):
         """Upsert properties of given model.
@@ -1265,7 +1965,10 @@ class SCOServerAPI(object):
         ModelHandle
             Handle for updated model or None if model doesn't exist
         """
-        return self.engine.upsert_model_properties(model_id, properties)
+        model = self.engine.upsert_model_properties(model_id, properties)
+        if not model is None:
+            self.model_cache.invalidate()
+        return model
 
     def model_to_dict(self, model):
         """Convert a model handle to a serializable dictionary.
@@ -1408,7 +2111,7 @@ class SCOServerAPI(object):
             return None
         return object_to_dict(subject, self.refs)
 
-    def subjects_list(self, limit=-1, offset=0, properties=None):
+    def subjects_list(self, limit=-1, offset=0, properties=None, cursor=None, count_mode=listing.COUNT_EXACT):
         """Get a listing of all subjects in the data store.
 
         Parameters
@@ -1421,14 +2124,29 @@ class SCOServerAPI(object):
         properties : list(string), optional
             List of additional properties to be included in the listing for
             each item
+        cursor : string, optional
+            Listing cursor for keyset pagination. If given, the offset is
+            ignored. An empty cursor refers to the first page in the listing.
+        count_mode : string, optional
+            Mode for counting the total number of objects in the listing
+            (exact, estimated, or none)
 
         Returns
         -------
         dict
             Dictionary representing a listing of subjects
         """
+        objects = listing.list_objects(
+            self.db.subjects,
+            TYPE_SUBJECT,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+            properties=properties,
+            count_mode=count_mode
+        )
         return listing_to_dict(
-            self.db.subjects_list(limit=limit, offset=offset),
+            objects,
             self.refs.subjects_reference(),
             self.refs,
             properties=properties
@@ -1473,6 +2191,176 @@ class SCOServerAPI(object):
         # description object and add model listing
         return {key: self.description[key] for key in self.description}
 
+    # --------------------------------------------------------------------------
+    # Uploads
+    # --------------------------------------------------------------------------
+
+    def uploads_create(self, upload_type, filename, size, experiment_id=None):
+        """Create a resumable upload session for a file of given type and
+        size.
+
+        Raises ValueError if invalid arguments are given.
+
+        Parameters
+        ----------
+        upload_type : string
+            Type of the uploaded file (fmri, image, or subject)
+        filename : string
+            Name of the uploaded file
+        size : int
+            File size in bytes
+        experiment_id : string, optional
+            Identifier of the experiment for fMRI data uploads
+
+        Returns
+        -------
+        dict
+            Dictionary representing the upload session or None if the
+            experiment for an fMRI data upload does not exist
+        """
+        if upload_type == upload.UPLOAD_TYPE_FMRI and not experiment_id is None:
+            if not self.db.experiments.exists_object(experiment_id):
+                return None
+        session = self.uploads.create_session(
+            upload_type,
+            filename,
+            size,
+            experiment_id=experiment_id
+        )
+        return self.upload_session_to_dict(session)
+
+    def uploads_delete(self, session_id):
+        """Delete upload session and all chunks that have been received.
+
+        Parameters
+        ----------
+        session_id : string
+            Unique upload session identifier
+
+        Returns
+        -------
+        bool
+            True, if the session existed
+        """
+        return self.uploads.delete_session(session_id)
+
+    def uploads_finalize(self, session_id, checksum=None):
+        """Finalize upload session. Creates a subject, image, or fMRI data
+        object from the uploaded file. The session is deleted after the object
+        has been created.
+
+        Raises ValueError if the upload is incomplete, the checksum does not
+        match, or the uploaded file is invalid. Raises UploadConflictError if
+        the session is being finalized by another request.
+
+        Parameters
+        ----------
+        session_id : string
+            Unique upload session identifier
+        checksum : string, optional
+            Expected SHA-256 hex digest of the uploaded file
+
+        Returns
+        -------
+        dict
+            Dictionary representing a successful response or None if the
+            session (or the experiment for an fMRI upload) does not exist
+        """
+        result = self.uploads.finalize_session(session_id, expected_checksum=checksum)
+        if result is None:
+            return None
+        session, temp_dir, upload_file = result
+        response = None
+        try:
+            if session.upload_type == upload.UPLOAD_TYPE_FMRI:
+                response = self.experiments_fmri_create(session.experiment_id, upload_file)
+            elif session.upload_type == upload.UPLOAD_TYPE_IMAGE:
+                response = self.images_create(upload_file)
+            else:
+                response = self.subjects_create(upload_file)
+        finally:
+            shutil.rmtree(temp_dir)
+            # Keep the session if the object was not created so that the
+            # client can retry.
+            if response is None:
+                self.uploads.release_session(session_id)
+        if not response is None:
+            self.uploads.delete_session(session_id)
+        return response
+
+    def uploads_get(self, session_id):
+        """Get status of upload session.
+
+        Parameters
+        ----------
+        session_id : string
+            Unique upload session identifier
+
+        Returns
+        -------
+        dict
+            Dictionary representing the upload session or None if the
+            session does not exist
+        """
+        session = self.uploads.get_session(session_id)
+        if session is None:
+            return None
+        return self.upload_session_to_dict(session)
+
+    def uploads_write(self, session_id, start, end, stream):
+        """Write chunk of the uploaded file.
+
+        Raises ValueError if the byte range is invalid or if the stream does
+        not contain the expected number of bytes. Raises UploadConflictError
+        if the session is being finalized.
+
+        Parameters
+        ----------
+        session_id : string
+            Unique upload session identifier
+        start : int
+            Position of first byte in the chunk
+        end : int
+            Position of last byte in the chunk
+        stream : file
+            Stream containing the chunk data
+
+        Returns
+        -------
+        dict
+            Dictionary representing the upload session or None if the
+            session does not exist
+        """
+        session = self.uploads.get_session(session_id)
+        if session is None:
+            return None
+        session.write_chunk(start, end, stream)
+        return self.upload_session_to_dict(session)
+
+    def upload_session_to_dict(self, session):
+        """Dictionary serialization of upload session status.
+
+        Parameters
+        ----------
+        session : upload.UploadSession
+            Upload session
+
+        Returns
+        -------
+        dict
+        """
+        obj = session.to_dict()
+        obj['ranges'] = [
+            {'start' : start, 'end' : end} for start, end in session.ranges
+        ]
+        obj['bytesReceived'] = session.bytes_received
+        obj['complete'] = session.is_complete
+        obj['expiresAt'] = str(datetime.datetime.utcfromtimestamp(
+            session.last_activity + self.uploads.ttl
+        ).isoformat())
+        obj['links'] = self.refs.upload_session_references(session.identifier)
+        return obj
+
     # --------------------------------------------------------------------------
     # Widgets
     # --------------------------------------------------------------------------
@@ -1562,7 +2450,7 @@ class SCOServerAPI(object):
             return None
         return self.widget_to_dict(widget)
 
-    def widgets_list(self, limit=-1, offset=0, properties=None):
+    def widgets_list(self, limit=-1, offset=0, properties=None, cursor=None, count_mode=listing.COUNT_EXACT):
         """Get a listing of all widgets in the database.
 
         Parameters
@@ -1575,14 +2463,29 @@ class SCOServerAPI(object):
         properties : list(string), optional
             List of additional properties to be included in the listing for
             each item
+        cursor : string, optional
+            Listing cursor for keyset pagination. If given, the offset is
+            ignored. An empty cursor refers to the first page in the listing.
+        count_mode : string, optional
+            Mode for counting the total number of objects in the listing
+            (exact, estimated, or none)
 
         Returns
         -------
         dict
             Dictionary representing a listing of widgets
         """
+        objects = listing.list_objects(
+            self.widgets,
+            TYPE_WIDGET,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+            properties=properties,
+            count_mode=count_mode
+        )
         return listing_to_dict(
-            self.widgets.list_widgets(limit=limit, offset=offset),
+            objects,
             self.refs.widgets_reference(),
             self.refs,
             properties=properties
@@ -1660,9 +2563,80 @@ class SCOServerAPI(object):
 #
 # ------------------------------------------------------------------------------
 
-def items_listing_to_dict(objects, items, properties, listing_url, links=None):
+def expand_arguments(expand, field):
+    """Get the expandable references of a referenced object from a list of
+    expanded references. The references of a referenced object are prefixed
+    by the field name.
+
+    Parameters
+    ----------
+    expand : list(string)
+        List of expanded references or None if all references are expanded
+    field : string
+        Name of the field that contains the referenced object
+
+    Returns
+    -------
+    list(string)
+    """
+    if expand is None:
+        return None
+    prefix = field + '.'
+    return [ref[len(prefix):] for ref in expand if ref.startswith(prefix)]
+
+
+def is_expanded(field, fields=None, expand=None):
+    """Test whether the object referenced by the given field is embedded in a
+    serialization. Referenced objects are expanded if the field is selected
+    and the object (or any of its references) is in the list of expanded
+    references.
+
+    Parameters
+    ----------
+    field : string
+        Name of the field that contains the referenced object
+    fields : list(string), optional
+        List of selected fields or None if all fields are selected
+    expand : list(string), optional
+        List of expanded references or None if all references are expanded
+
+    Returns
+    -------
+    bool
+    """
+    if not is_selected(field, fields):
+        return False
+    if expand is None:
+        return True
+    prefix = field + '.'
+    for ref in expand:
+        if ref == field or ref.startswith(prefix):
+            return True
+    return False
+
+
+def is_selected(field, fields=None):
+    """Test whether the given field is included in a serialization.
+
+    Parameters
+    ----------
+    field : string
+        Field name
+    fields : list(string), optional
+        List of selected fields or None if all fields are selected
+
+    Returns
+    -------
+    bool
+    """
+    return fields is None or field in fields
+
+
+def items_listing_to_dict(objects, items, properties, listing_url, links=None, links_mode=hateoas.LINKS_FULL):
     """Generic serializer for a list of items. Used for object listings and
-    group image listings.
+    group image listings. In reference mode none the listing does not contain
+    navigation references. The cursor for the next page is included instead
+    for listings that were retrieved using a cursor.
 
     Parameters
     ----------
@@ -1677,28 +2651,45 @@ def items_listing_to_dict(objects, items, properties, listing_url, links=None):
     links : dict, optional
         Additional references to be included in the reference set for the
         object listing
+    links_mode : string, optional
+        Reference mode (full, relative, or none)
 
     Returns
     -------
     Json-like object
         Object listing resource in Json format
     """
-    # Generate listing navigation references
-    nav = hateoas.PaginationReferenceFactory(
-        objects,
-        properties,
-        listing_url
-    ).navigation_references(links=links)
     # Return Json-like object contaiing items, references, and listing
-    # arguments and statistics
-    return {
+    # arguments and statistics. Listings that were retrieved using a cursor
+    # contain the cursor instead of the offset. The total count is omitted if
+    # the objects in the listing were not counted.
+    obj = {
         'items' : items,
-        'offset' : objects.offset,
         'limit' : objects.limit,
-        'count' : len(items),
-        'totalCount' : objects.total_count,
-        'links' : nav
+        'count' : len(items)
     }
+    # Generate listing navigation references
+    if links_mode != hateoas.LINKS_NONE:
+        obj['links'] = hateoas.PaginationReferenceFactory(
+            objects,
+            properties,
+            listing_url,
+            links=links_mode
+        ).navigation_references(links=links)
+    elif isinstance(objects, listing.ListingPage) and not objects.next_cursor is None:
+        obj['nextCursor'] = objects.next_cursor
+    if not objects.total_count is None:
+        obj['totalCount'] = objects.total_count
+    if isinstance(objects, listing.ListingPage):
+        if objects.count_mode == listing.COUNT_ESTIMATED:
+            obj['totalCountEstimated'] = True
+        if objects.is_cursor_listing:
+            obj['cursor'] = objects.cursor
+        else:
+            obj['offset'] = objects.offset
+    else:
+        obj['offset'] = objects.offset
+    return obj
 
 
 def listing_to_dict(objects, listing_url, refs, properties=None, links=None):
@@ -1728,15 +2719,17 @@ def listing_to_dict(objects, listing_url, refs, properties=None, links=None):
         Object listing resource
     """
     # Generate list of object in listing
+    with_links = refs.links != hateoas.LINKS_NONE
     items = []
     for obj in objects.items:
         # Create baseic object representation
         item = {
             'id' : obj.identifier,
             'name' : obj.name,
-            'timestamp' : str(obj.timestamp.isoformat()),
-            'links' : refs.object_references(obj)
+            'timestamp' : str(obj.timestamp.isoformat())
         }
+        if with_links:
+            item['links'] = refs.object_references(obj)
         # Add elements in property set to object representation if present
         # in object properties
         if not properties is None:
@@ -1751,13 +2744,15 @@ def listing_to_dict(objects, listing_url, refs, properties=None, links=None):
         items,
         properties,
         listing_url,
-        links=links
+        links=links,
+        links_mode=refs.links
     )
 
 
 def object_to_dict(obj, refs):
     """Basic dictionary representation for a given object. Contains the object
-    identifier, name, timestamp, list of properties, and list of references.
+    identifier, name, timestamp, list of properties, and list of references
+    (unless the reference mode is none).
 
     Parameters
     ----------
@@ -1773,15 +2768,17 @@ def object_to_dict(obj, refs):
     """
     # Generate basic object serialization
     properties = obj.properties
-    return {
+    result = {
         'id' : obj.identifier,
         'name' : obj.name,
         'timestamp' : str(obj.timestamp.isoformat()),
         'properties' : [
             {'key' : key, 'value' : properties[key]} for key in properties
-        ],
-        'links' : refs.object_references(obj)
+        ]
     }
+    if refs.links != hateoas.LINKS_NONE:
+        result['links'] = refs.object_references(obj)
+    return result
 
 
 def page_to_dict(page, refs):
@@ -1827,6 +2824,30 @@ def page_descriptor_to_dict(page, refs):
     }
 
 
+def reference_to_dict(identifier, url, refs):
+    """Dictionary representation for a referenced object that is not expanded.
+    Contains the object identifier and the self reference (unless the
+    reference mode is none).
+
+    Parameters
+    ----------
+    identifier : string
+        Unique object identifier
+    url : string
+        Self reference Url for the object
+    refs : hateoas.HATEOASReferenceFactory
+        Url factory for API resources
+
+    Returns
+    -------
+    dict
+    """
+    result = {'id' : identifier}
+    if refs.links != hateoas.LINKS_NONE:
+        result['links'] = hateoas.to_references({hateoas.REF_KEY_SELF : url})
+    return result
+
+
 def response_success(obj, refs):
     """Generate response for successful object manipulation. If the given object
     is None, the result will be None.
@@ -1849,3 +2870,48 @@ def response_success(obj, refs):
         'result' : 'SUCCESS',
         'links': refs.object_references(obj)
     }
+
+
+def runs_to_dict(model_runs, refs):
+    """Create list of identifiers and references for a list of model runs.
+
+    Parameters
+    ----------
+    model_runs : list(scodata.modelrun.ModelRunHandle)
+        Handles for model runs
+    refs : hateoas.HATEOASReferenceFactory
+        Url factory for API resources
+
+    Returns
+    -------
+    list(dict)
+    """
+    return [
+        {
+            'id' : model_run.identifier,
+            'links' : refs.object_references(model_run)
+        } for model_run in model_runs
+    ]
+
+
+def select_fields(obj, fields=None):
+    """Remove fields that are not selected from an object serialization. The
+    object identifier and references are always included.
+
+    Parameters
+    ----------
+    obj : dict
+        Object serialization
+    fields : list(string), optional
+        List of selected fields or None if all fields are selected
+
+    Returns
+    -------
+    dict
+    """
+    if fields is None:
+        return obj
+    return {
+        key : obj[key] for key in obj
+            if key in FIELDS_REQUIRED or key in fields
+    }
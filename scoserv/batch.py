@@ -0,0 +1,281 @@
+"""Batch creation of model runs - Parameter sweeps create many model runs for
+the same experiment and model that only differ in their arguments.
+
+A batch is either given as an explicit list of runs or as a parameter grid.
+The grid assigns a list of values to each swept parameter. One run is created
+for every combination of values (cartesian product). The arguments of all runs
+are validated against the model parameters before any run is created, i.e., a
+batch is either created completely or not at all. Handles for the runs are
+created before the runs are inserted, i.e., the run identifiers are known
+before the runs become visible. The runs are serialized by the model run store
+and inserted into the database with a single write. If the write fails, the
+runs of the batch that have already been inserted are erased.
+"""
+
+import itertools
+import os
+import shutil
+import uuid
+
+from scodata import attribute
+from scodata.datastore import PROPERTY_MODEL, PROPERTY_NAME, PROPERTY_STATE
+from scodata.modelrun import ModelRunHandle, ModelRunIdle
+
+
+"""Maximum number of model runs in a single batch."""
+MAX_BATCH_SIZE = 1000
+
+
+class ModelRunSpec(object):
+    """Specification of a single model run in a batch.
+
+    Attributes
+    ----------
+    name : string
+        User-provided name for the model run
+    arguments : list(dict('name':...,'value:...'))
+        List of arguments for model run
+    properties : dict, optional
+        Set of model run properties
+    """
+    def __init__(self, name, arguments, properties=None):
+        """Initialize the run specification.
+
+        Parameters
+        ----------
+        name : string
+            User-provided name for the model run
+        arguments : list(dict('name':...,'value:...'))
+            List of arguments for model run
+        properties : dict, optional
+            Set of model run properties
+        """
+        self.name = name
+        self.arguments = arguments
+        self.properties = properties
+
+
+def build_model_run(store, experiment_id, model_id, parameters, spec):
+    """Create handle for a new model run without inserting it into the
+    database. Raises ValueError if the arguments of the run are invalid.
+
+    The handle is created in the same way as by the create_object() method of
+    the model run store (which inserts the run immediately). The identifier of
+    the run is therefore known before the run becomes visible.
+
+    Parameters
+    ----------
+    store : scodata.modelrun.DefaultModelRunManager
+        Object store for model runs
+    experiment_id : string
+        Unique experiment identifier
+    model_id : string
+        Unique identifier of model to run
+    parameters : list(scodata.attribute.AttributeDefinition)
+        Definitions of model parameters
+    spec : ModelRunSpec
+        Specification of the model run
+
+    Returns
+    -------
+    scodata.modelrun.ModelRunHandle
+    """
+    validate_object_list(spec.arguments, 'arguments')
+    arguments = attribute.to_dict(spec.arguments, parameters)
+    state = ModelRunIdle()
+    run_properties = {
+        PROPERTY_NAME: spec.name,
+        PROPERTY_STATE: str(state),
+        PROPERTY_MODEL: model_id
+    }
+    if not spec.properties is None:
+        for prop in spec.properties:
+            if not prop in run_properties:
+                run_properties[prop] = spec.properties[prop]
+    identifier = str(uuid.uuid4()).replace('-', '')
+    return ModelRunHandle(
+        identifier,
+        run_properties,
+        os.path.join(store.directory, identifier),
+        state,
+        experiment_id,
+        model_id,
+        arguments
+    )
+
+
+def build_model_runs(store, experiment_id, model_id, parameters, runs):
+    """Create handles for a batch of new model runs without inserting them
+    into the database. Validates the arguments of all runs against the model
+    parameters. Raises ValueError if the arguments for any of the runs are
+    invalid or if the batch is empty or too large.
+
+    Parameters
+    ----------
+    store : scodata.modelrun.DefaultModelRunManager
+        Object store for model runs
+    experiment_id : string
+        Unique experiment identifier
+    model_id : string
+        Unique identifier of model to run
+    parameters : list(scodata.attribute.AttributeDefinition)
+        Definitions of model parameters
+    runs : list(ModelRunSpec)
+        Specification of model runs
+
+    Returns
+    -------
+    list(scodata.modelrun.ModelRunHandle)
+    """
+    validate_batch_size(len(runs))
+    model_runs = []
+    for i in range(len(runs)):
+        try:
+            model_runs.append(
+                build_model_run(store, experiment_id, model_id, parameters, runs[i])
+            )
+        except ValueError as ex:
+            raise ValueError(u'run {}: {}'.format(i, ex))
+    return model_runs
+
+
+def delete_model_runs(store, model_runs):
+    """Erase the given model runs and their resource directories with a
+    single database write.
+
+    Parameters
+    ----------
+    store : scodata.modelrun.DefaultModelRunManager
+        Object store for model runs
+    model_runs : list(scodata.modelrun.ModelRunHandle)
+        Handles for model runs
+    """
+    store.collection.delete_many({
+        '_id' : {'$in' : [model_run.identifier for model_run in model_runs]}
+    })
+    for model_run in model_runs:
+        if os.path.isdir(model_run.directory):
+            shutil.rmtree(model_run.directory)
+
+
+def expand_grid(name, grid, arguments=None, properties=None):
+    """Create run specifications for all combinations of values in a
+    parameter grid. Raises ValueError if the grid is invalid or too large.
+
+    Parameters
+    ----------
+    name : string
+        Name prefix for created model runs
+    grid : list(dict('name':...,'values':...))
+        List of swept parameters and their values
+    arguments : list(dict('name':...,'value:...')), optional
+        Arguments that are the same for all runs
+    properties : dict, optional
+        Set of properties for all runs
+
+    Returns
+    -------
+    list(ModelRunSpec)
+    """
+    validate_object_list(grid, 'grid')
+    if len(grid) == 0:
+        raise ValueError('empty parameter grid')
+    if not arguments is None:
+        validate_object_list(arguments, 'arguments')
+    names = []
+    values = []
+    size = 1
+    for para in grid:
+        for key in ['name', 'values']:
+            if not key in para:
+                raise ValueError(u'object has no key {}: {}'.format(key, para))
+        if not isinstance(para['values'], list) or len(para['values']) == 0:
+            raise ValueError(u'invalid values for parameter: {}'.format(para['name']))
+        if para['name'] in names:
+            raise ValueError(u'duplicate parameter: {}'.format(para['name']))
+        names.append(para['name'])
+        values.append(para['values'])
+        size *= len(para['values'])
+    validate_batch_size(size)
+    fixed_args = []
+    if not arguments is None:
+        fixed_args = [arg for arg in arguments if not arg.get('name') in names]
+    runs = []
+    for combination in itertools.product(*values):
+        run_args = list(fixed_args)
+        labels = []
+        for i in range(len(names)):
+            run_args.append({'name' : names[i], 'value' : combination[i]})
+            # Parameter names and values may contain non-ASCII characters
+            labels.append(u'{}={}'.format(names[i], combination[i]))
+        runs.append(
+            ModelRunSpec(
+                u'{} ({})'.format(name, ', '.join(labels)),
+                run_args,
+                properties=properties
+            )
+        )
+    return runs
+
+
+def insert_model_runs(store, model_runs):
+    """Insert the given model runs into the database with a single write.
+    Documents are created by the store's serializer in the same way as by
+    the insert_object() method of the store. Resource directories are created
+    before the runs become visible. If the write fails, the runs that have
+    been inserted are erased. The caller is expected to ensure that the
+    experiment of the runs exists.
+
+    Parameters
+    ----------
+    store : scodata.modelrun.DefaultModelRunManager
+        Object store for model runs
+    model_runs : list(scodata.modelrun.ModelRunHandle)
+        Handles for model runs
+    """
+    for model_run in model_runs:
+        if not os.access(model_run.directory, os.F_OK):
+            os.makedirs(model_run.directory)
+    documents = []
+    for model_run in model_runs:
+        obj = store.to_dict(model_run)
+        obj['active'] = True
+        documents.append(obj)
+    try:
+        store.collection.insert_many(documents)
+    except Exception:
+        delete_model_runs(store, model_runs)
+        raise
+
+
+def validate_batch_size(size):
+    """Raise ValueError if the given number of runs is not a valid batch size.
+
+    Parameters
+    ----------
+    size : int
+        Number of model runs in batch
+    """
+    if size == 0:
+        raise ValueError('empty batch')
+    if size > MAX_BATCH_SIZE:
+        raise ValueError(
+            'batch too large: ' + str(size) + ' runs (max. ' + str(MAX_BATCH_SIZE) + ')'
+        )
+
+
+def validate_object_list(value, name):
+    """Raise ValueError if the given value is not a list of Json objects.
+
+    Parameters
+    ----------
+    value : any
+        Value of request element
+    name : string
+        Name of request element
+    """
+    if not isinstance(value, list):
+        raise ValueError('invalid ' + name + ': not a list')
+    for obj in value:
+        if not isinstance(obj, dict):
+            raise ValueError('invalid ' + name + ': not a list of Json objects')
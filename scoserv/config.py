@@ -0,0 +1,52 @@
+"""Server configuration - Locate and read the server configuration file.
+
+The configuration is read from the file that is referenced by the environment
+variable SCOSERVER_CONFIG. If the variable is not set, the file config.yaml in
+the working directory or in /var/sco/config is used. As a last resort, the
+default configuration file on GitHub is read.
+"""
+
+import os
+import urllib2
+import yaml
+
+
+"""Environment Variable containing path to config file. If not set will try
+file config.yaml in working directory.
+"""
+ENV_CONFIG = 'SCOSERVER_CONFIG'
+
+"""Environment variable that is set to 'true' if the server is run by a pool
+of worker processes (see module wsgi)."""
+ENV_PREFORK = 'SCOSERVER_PREFORK'
+
+"""Default number of request threads per worker process (see module wsgi)."""
+DEFAULT_THREADS = 8
+
+"""Url to default configuration file on GitHub."""
+WEB_CONFIG_FILE_URI = 'https://raw.githubusercontent.com/heikomuller/sco-server/master/config/config.yaml'
+
+
+def read_config():
+    """Read the server configuration. The configuration file is expected to
+    contain a Json object with a single element 'properties' that is an array
+    of key, value pair objects representing the configuration parameters.
+
+    Returns
+    -------
+    dict
+        Dictionary of configuration parameters
+    """
+    local_config_file = os.getenv(ENV_CONFIG)
+    if not local_config_file is None and os.path.isfile(local_config_file):
+        with open(local_config_file, 'r') as f:
+            obj = yaml.load(f.read())
+    elif os.path.isfile('./config.yaml'):
+        with open('./config.yaml', 'r') as f:
+            obj = yaml.load(f.read())
+    elif os.path.isfile('/var/sco/config/config.yaml'):
+        with open('/var/sco/config/config.yaml', 'r') as f:
+            obj = yaml.load(f.read())
+    else:
+        obj = yaml.load(urllib2.urlopen(WEB_CONFIG_FILE_URI).read())
+    return {item['key']:item['value'] for item in obj['properties']}
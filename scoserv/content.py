@@ -1,14 +1,28 @@
 """Module containing classes to manage content pages and access their
 content.
+
+Page bodies are cached in memory. A cached body is served until its time to
+live expires. After that the body is revalidated in a background thread while
+the stale body continues to be served (stale-while-revalidate). Revalidation
+uses the ETag and Last-Modified headers for Url resources and the file
+modification time for local files, i.e., the body is only transferred again if
+the resource has actually changed.
 """
 
+import os
+import threading
+import time
 import urllib2
 
 
+"""Default number of seconds a cached page body is considered fresh."""
+DEFAULT_TTL = 300
+
+
 class ContentPage(object):
     """Representation of a content page. Content pages have unique identifier,
     short labels, titles, and a body. The content of the body is read from file
-    or from an Url on demand.
+    or from an Url on first access and cached afterwards.
 
     Attributes
     ----------
@@ -20,8 +34,10 @@ class ContentPage(object):
         (Longer) Title (e.g., to be used as Html page title or headline)
     body : string
         Content of the page
+    ttl : int
+        Number of seconds a cached page body is considered fresh
     """
-    def __init__(self, page):
+    def __init__(self, page, ttl=DEFAULT_TTL):
         """Initialize the page from a page descriptor. The descriptor is
         expected to contain the following fields: id, label, tittle, and
         content.
@@ -32,6 +48,9 @@ class ContentPage(object):
         ----------
         page : dict
             Page descriptor
+        ttl : int, optional
+            Number of seconds a cached page body is considered fresh. If the
+            value is not positive the body is read on every access.
         """
         for key in ['id', 'label', 'title', 'sortOrder', 'resource']:
             if not key in page:
@@ -41,22 +60,114 @@ class ContentPage(object):
         self.title = page['title']
         self.sort_order = page['sortOrder']
         self.resource = page['resource']
+        self.ttl = ttl
+        # Cached page body and information needed for revalidation
+        self._body = None
+        self._expires = 0
+        self._etag = None
+        self._last_modified = None
+        self._mtime = None
+        # Ensure that at most one refresh is running at any time
+        self._lock = threading.Lock()
+        self._refreshing = False
 
     @property
     def body(self):
-        """Read the page body from the content specifier that was provided as
-        part of the page descriptor when the object was initialized. Reads
-        either from a local file or a Url.
+        """Get the page body. The body is read from the content specifier that
+        was provided as part of the page descriptor on first access. After
+        that the cached body is returned. If the cached body is expired a
+        background refresh is started and the stale body is returned.
 
         Returns
         -------
         string
         """
-        # Simple distinction between local file or Url based on the content
-        # descrptior's prefix (could be improved in the future)
+        # Read the body synchronously if it has not been loaded yet or if
+        # caching is disabled.
+        if self._body is None or self.ttl <= 0:
+            self.refresh()
+            return self._body
+        if time.time() >= self._expires:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                thread = threading.Thread(target=self._background_refresh)
+                thread.daemon = True
+                thread.start()
+        return self._body
+
+    @property
+    def is_url(self):
+        """Simple distinction between local file or Url based on the content
+        descrptior's prefix (could be improved in the future).
+
+        Returns
+        -------
+        bool
+        """
         for url_prefix in ['http://', 'https://', 'file://']:
             if self.resource.startswith(url_prefix):
-                return urllib2.urlopen(self.resource).read()
-        # Read local file if resource is not a Url
+                return True
+        return False
+
+    def refresh(self):
+        """Revalidate the cached page body. Reads the page body only if the
+        resource has been modified since it was last read.
+        """
+        if self.is_url:
+            self._refresh_from_url()
+        else:
+            self._refresh_from_file()
+        self._expires = time.time() + self.ttl
+
+    def _background_refresh(self):
+        """Refresh the cached page body. Errors are ignored, i.e., the stale
+        body continues to be served until the next refresh attempt once the
+        time to live has expired again.
+        """
+        try:
+            self.refresh()
+        except Exception:
+            self._expires = time.time() + self.ttl
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_from_file(self):
+        """Read the page body from a local file if the file modification time
+        changed since the body was last read.
+        """
+        mtime = os.stat(self.resource).st_mtime
+        if not self._body is None and mtime == self._mtime:
+            return
         with open(self.resource, 'r') as f:
-            return f.read()
+            self._body = f.read()
+        self._mtime = mtime
+
+    def _refresh_from_url(self):
+        """Read the page body from the resource Url. Uses a conditional
+        request if the previous response contained an ETag or Last-Modified
+        header.
+        """
+        request = urllib2.Request(self.resource)
+        if not self._body is None:
+            if not self._etag is None:
+                request.add_header('If-None-Match', self._etag)
+            if not self._last_modified is None:
+                request.add_header('If-Modified-Since', self._last_modified)
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError as ex:
+            # Resource has not been modified since the last request
+            if ex.code == 304 and not self._body is None:
+                return
+            raise
+        try:
+            body = response.read()
+            headers = response.info()
+            self._etag = headers.getheader('ETag')
+            self._last_modified = headers.getheader('Last-Modified')
+        finally:
+            response.close()
+        self._body = body
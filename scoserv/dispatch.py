@@ -0,0 +1,646 @@
+"""Asynchronous dispatch of model runs - Model runs are dispatched to the SCO
+engine by a background dispatcher instead of inside the request that creates
+the run.
+
+When a model run is created a dispatch request is recorded in an outbox
+collection. The request that created the run returns without contacting the
+message broker. The outbox entry is written before the model run is inserted.
+Thus, no run exists without a dispatch request, even if the process dies
+between the two writes. Entries for runs that do not exist are kept until the
+lease time after their creation has passed (i.e., the run may not have been
+inserted yet) and are removed afterwards. The dispatcher claims pending outbox
+entries in batches, publishes the runs of a batch with a single broker call,
+and removes the entries that were published successfully.
+Failed publish attempts are retried with exponential backoff. If a run cannot
+be published after the maximum number of attempts its state is set to
+failed.
+
+Entries are claimed with a lease. Multiple dispatchers (e.g., one per worker
+process) can therefore share the same outbox. Entries that were claimed by a
+dispatcher that died before completing them are claimed again once the lease
+has expired.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+import uuid
+
+import pika
+import pymongo
+import scoengine
+
+
+"""Dispatch modes for model runs."""
+DISPATCH_OUTBOX = 'outbox'
+DISPATCH_SYNC = 'sync'
+
+DISPATCH_MODES = [DISPATCH_OUTBOX, DISPATCH_SYNC]
+
+"""Default dispatcher parameters."""
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_INTERVAL = 5
+DEFAULT_MAX_ATTEMPTS = 5
+
+"""Seconds before the first retry of a failed publish attempt. The delay is
+doubled for each subsequent attempt."""
+RETRY_DELAY = 2
+
+"""Seconds an outbox entry remains claimed by a dispatcher."""
+LEASE_TIME = 60
+
+# States of outbox entries
+STATE_DISPATCHING = 'DISPATCHING'
+STATE_PENDING = 'PENDING'
+
+
+# ------------------------------------------------------------------------------
+#
+# Brokers
+#
+# ------------------------------------------------------------------------------
+
+class BatchPublishError(Exception):
+    """Exception raised by brokers if publishing a list of model runs fails.
+    The runs preceding the failed run in the list have been published.
+
+    Attributes
+    ----------
+    count : int
+        Number of model runs that have been published
+    message : string
+        Error message
+    """
+    def __init__(self, count, message):
+        """Initialize the number of published runs and the error message.
+
+        Parameters
+        ----------
+        count : int
+            Number of model runs that have been published
+        message : string
+            Error message
+        """
+        Exception.__init__(self, message)
+        self.count = count
+        self.message = message
+
+
+class EngineBroker(object):
+    """Broker that publishes model runs using the SCO engine."""
+    def __init__(self, engine):
+        """Initialize the SCO engine.
+
+        Parameters
+        ----------
+        engine : scoengine.SCOEngine
+            SCO workflow engine
+        """
+        self.engine = engine
+
+    def publish(self, model_run, url):
+        """Publish request to run the given model run. Raises an exception if
+        the request cannot be published.
+
+        Parameters
+        ----------
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for model run
+        url : string
+            Url of the model run resource
+        """
+        self.engine.run_model(model_run, url)
+
+    def publish_many(self, model_runs, urls):
+        """Publish requests for a list of model runs. Requests for runs of
+        models that use the RabbitMQ connector are sent over a single
+        connection per model. Raises BatchPublishError if publishing fails.
+
+        Parameters
+        ----------
+        model_runs : list(scodata.modelrun.ModelRunHandle)
+            Handles for model runs
+        urls : list(string)
+            Urls of the model run resources
+        """
+        count = 0
+        try:
+            while count < len(model_runs):
+                # Publish the next sequence of runs for the same model
+                model_id = model_runs[count].model_id
+                end = count + 1
+                while end < len(model_runs) and model_runs[end].model_id == model_id:
+                    end += 1
+                model = self.engine.get_model(model_id)
+                if model is None:
+                    raise ValueError('unknown model: ' + model_id)
+                if model.connector.get('connector') == scoengine.CONNECTOR_RABBITMQ:
+                    count = self.publish_rabbitmq(
+                        model.connector,
+                        model_runs,
+                        urls,
+                        count,
+                        end
+                    )
+                else:
+                    for i in range(count, end):
+                        self.engine.run_model(model_runs[i], urls[i])
+                        count += 1
+        except BatchPublishError:
+            raise
+        except Exception as ex:
+            raise BatchPublishError(count, getattr(ex, 'message', None) or str(ex))
+
+    def publish_rabbitmq(self, connector, model_runs, urls, start, end):
+        """Send requests for the model runs in the given range of the list to
+        the RabbitMQ queue of a model using a single connection. Messages are
+        persistent (as for runs that are published by the engine).
+
+        Parameters
+        ----------
+        connector : dict
+            RabbitMQ connection information for the model
+        model_runs : list(scodata.modelrun.ModelRunHandle)
+            Handles for model runs
+        urls : list(string)
+            Urls of the model run resources
+        start : int
+            Index of the first run that is published
+        end : int
+            Index following the last run that is published
+
+        Returns
+        -------
+        int
+            Index following the last published run
+        """
+        scoengine.RabbitMQConnector.validate(connector)
+        con = pika.BlockingConnection(pika.ConnectionParameters(
+            host=connector['host'],
+            port=int(connector['port']),
+            virtual_host=connector['virtualHost'],
+            credentials=pika.PlainCredentials(
+                connector['user'],
+                connector['password']
+            )
+        ))
+        count = start
+        try:
+            channel = con.channel()
+            channel.queue_declare(queue=connector['queue'], durable=True)
+            factory = scoengine.RequestFactory()
+            for i in range(start, end):
+                request = factory.get_request(model_runs[i], urls[i])
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=connector['queue'],
+                    body=json.dumps(request.to_dict()),
+                    properties=pika.BasicProperties(delivery_mode=2)
+                )
+                count += 1
+        except Exception as ex:
+            raise BatchPublishError(count, getattr(ex, 'message', None) or str(ex))
+        finally:
+            con.close()
+        return count
+
+
+class InProcessBroker(object):
+    """Broker stand-in that keeps published model runs in memory. Used for
+    tests and local installations without message broker.
+
+    Attributes
+    ----------
+    published : list((string, string))
+        List of (model run identifier, Url) pairs for published runs
+    failures : int
+        Number of publish requests that fail before publishing succeeds
+    """
+    def __init__(self, failures=0):
+        """Initialize the list of published runs.
+
+        Parameters
+        ----------
+        failures : int, optional
+            Number of publish requests that fail before publishing succeeds
+        """
+        self.published = []
+        self.failures = failures
+
+    def publish(self, model_run, url):
+        """Record the given model run as published. Raises RuntimeError if the
+        broker is configured to fail.
+
+        Parameters
+        ----------
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for model run
+        url : string
+            Url of the model run resource
+        """
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError('broker unavailable')
+        self.published.append((model_run.identifier, url))
+
+    def publish_many(self, model_runs, urls):
+        """Record the given model runs as published. Raises BatchPublishError
+        without publishing any run if the broker is configured to fail.
+
+        Parameters
+        ----------
+        model_runs : list(scodata.modelrun.ModelRunHandle)
+            Handles for model runs
+        urls : list(string)
+            Urls of the model run resources
+        """
+        if self.failures > 0:
+            self.failures -= 1
+            raise BatchPublishError(0, 'broker unavailable')
+        for i in range(len(model_runs)):
+            self.published.append((model_runs[i].identifier, urls[i]))
+
+
+# ------------------------------------------------------------------------------
+#
+# Outbox
+#
+# ------------------------------------------------------------------------------
+
+class Outbox(object):
+    """Collection of pending model run dispatch requests. The identifier of an
+    outbox entry is the identifier of the model run.
+    """
+    def __init__(self, mongo):
+        """Initialize the MongoDB collection for outbox entries.
+
+        Parameters
+        ----------
+        mongo : scodata.MongoDBFactory
+            MongoDB connector
+        """
+        self.collection = mongo.get_database().outbox
+        self.collection.create_index([
+            ('state', pymongo.ASCENDING),
+            ('nextAttempt', pymongo.ASCENDING)
+        ])
+
+    def add(self, model_run, url):
+        """Add dispatch request for a model run.
+
+        Parameters
+        ----------
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for model run
+        url : string
+            Url of the model run resource
+        """
+        self.collection.insert_one(self.entry(model_run, url))
+
+    def add_many(self, model_runs, urls):
+        """Add dispatch requests for a batch of model runs with a single
+        write.
+
+        Parameters
+        ----------
+        model_runs : list(scodata.modelrun.ModelRunHandle)
+            Handles for model runs
+        urls : list(string)
+            Urls of the model run resources
+        """
+        self.collection.insert_many([
+            self.entry(model_runs[i], urls[i]) for i in range(len(model_runs))
+        ])
+
+    def claim(self, limit, lease=LEASE_TIME):
+        """Claim a batch of outbox entries that are due for dispatch. Uses
+        three round trips independently of the batch size.
+
+        Parameters
+        ----------
+        limit : int
+            Maximum number of claimed entries
+        lease : int, optional
+            Number of seconds the entries remain claimed
+
+        Returns
+        -------
+        list(dict)
+        """
+        now = datetime.datetime.utcnow()
+        query = {'$or' : [
+            {'state' : STATE_PENDING, 'nextAttempt' : {'$lte' : now}},
+            {'state' : STATE_DISPATCHING, 'leaseUntil' : {'$lt' : now}}
+        ]}
+        candidates = [
+            doc['_id'] for doc in self.collection.find(
+                query,
+                {'_id' : True}
+            ).sort('nextAttempt', pymongo.ASCENDING).limit(limit)
+        ]
+        if len(candidates) == 0:
+            return []
+        # The query condition is re-evaluated for each entry by the update.
+        # Entries that were claimed by another dispatcher in the meantime are
+        # not modified.
+        claim_id = uuid.uuid4().hex
+        query['_id'] = {'$in' : candidates}
+        self.collection.update_many(query, {'$set' : {
+            'state' : STATE_DISPATCHING,
+            'claim' : claim_id,
+            'leaseUntil' : now + datetime.timedelta(seconds=lease)
+        }})
+        return list(self.collection.find({'claim' : claim_id}))
+
+    def complete(self, entry):
+        """Remove a dispatched outbox entry.
+
+        Parameters
+        ----------
+        entry : dict
+            Outbox entry
+        """
+        self.collection.delete_one({'_id' : entry['_id'], 'claim' : entry['claim']})
+
+    def complete_many(self, entries):
+        """Remove a list of dispatched outbox entries with a single write.
+
+        Parameters
+        ----------
+        entries : list(dict)
+            Outbox entries
+        """
+        if len(entries) == 0:
+            return
+        self.collection.delete_many({'$or' : [
+            {'_id' : entry['_id'], 'claim' : entry['claim']} for entry in entries
+        ]})
+
+    def entry(self, model_run, url):
+        """Create outbox entry for a model run.
+
+        Parameters
+        ----------
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for model run
+        url : string
+            Url of the model run resource
+
+        Returns
+        -------
+        dict
+        """
+        now = datetime.datetime.utcnow()
+        return {
+            '_id' : model_run.identifier,
+            'experiment' : model_run.experiment_id,
+            'url' : url,
+            'state' : STATE_PENDING,
+            'attempts' : 0,
+            'createdAt' : now,
+            'nextAttempt' : now
+        }
+
+    def remove(self, identifiers):
+        """Remove the outbox entries for the given model runs with a single
+        write (e.g., for runs that reuse a cached result).
+
+        Parameters
+        ----------
+        identifiers : list(string)
+            Model run identifiers
+        """
+        if len(identifiers) == 0:
+            return
+        self.collection.delete_many({'_id' : {'$in' : identifiers}})
+
+    def retry(self, entry, error, delay):
+        """Release a claimed outbox entry after a failed publish attempt.
+
+        Parameters
+        ----------
+        entry : dict
+            Outbox entry
+        error : string
+            Error message for the failed attempt
+        delay : int
+            Number of seconds before the next attempt
+        """
+        self.collection.update_one(
+            {'_id' : entry['_id'], 'claim' : entry['claim']},
+            {
+                '$set' : {
+                    'state' : STATE_PENDING,
+                    'lastError' : error,
+                    'nextAttempt' : datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+                },
+                '$inc' : {'attempts' : 1},
+                '$unset' : {'claim' : '', 'leaseUntil' : ''}
+            }
+        )
+
+
+# ------------------------------------------------------------------------------
+#
+# Dispatcher
+#
+# ------------------------------------------------------------------------------
+
+class OutboxDispatcher(object):
+    """Background dispatcher for model runs in the outbox. The dispatcher
+    thread polls the outbox in regular intervals. It is woken up immediately
+    when a new entry is added by the same process.
+
+    The thread is not started when the dispatcher is created. It is started
+    by the first call to start() or notify() in each process, i.e., in the
+    server worker after it has been forked.
+    """
+    def __init__(self, outbox, db, broker, batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_INTERVAL, max_attempts=DEFAULT_MAX_ATTEMPTS, events=None):
+        """Initialize the dispatcher.
+
+        Parameters
+        ----------
+        outbox : Outbox
+            Outbox for model run dispatch requests
+        db : scodata.SCODataStore
+            SCO data store
+        broker : EngineBroker or InProcessBroker
+            Broker that publishes model runs
+        batch_size : int, optional
+            Maximum number of entries that are claimed at once
+        interval : int, optional
+            Seconds between polls of the outbox
+        max_attempts : int, optional
+            Number of publish attempts before a model run is set to failed
+        events : events.EventBus, optional
+            Event bus for state changes of model runs that are set to failed
+        """
+        self.outbox = outbox
+        self.db = db
+        self.broker = broker
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.events = events
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def dispatch_pending(self):
+        """Publish all outbox entries that are due for dispatch. The model runs
+        of each claimed batch are published with a single broker call.
+
+        Returns
+        -------
+        int
+            Number of published model runs
+        """
+        count = 0
+        while True:
+            entries = self.outbox.claim(self.batch_size)
+            if len(entries) == 0:
+                return count
+            count += self.dispatch(entries)
+
+    def dispatch(self, entries):
+        """Publish the model runs for the given outbox entries.
+
+        Parameters
+        ----------
+        entries : list(dict)
+            Claimed outbox entries
+
+        Returns
+        -------
+        int
+            Number of published model runs
+        """
+        model_runs = []
+        run_entries = []
+        deleted_entries = []
+        created_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=LEASE_TIME)
+        existing_runs = self.get_model_runs(entries)
+        for entry in entries:
+            model_run = existing_runs.get(entry['_id'])
+            if not model_run is None and model_run.experiment_id != entry['experiment']:
+                model_run = None
+            # Nothing to dispatch if the model run does not exist. The entry
+            # is written before the run is inserted. Recent entries remain
+            # claimed until the lease expires and are checked again.
+            if model_run is None:
+                if entry['createdAt'] < created_before:
+                    deleted_entries.append(entry)
+            else:
+                model_runs.append(model_run)
+                run_entries.append(entry)
+        self.outbox.complete_many(deleted_entries)
+        if len(model_runs) == 0:
+            return 0
+        try:
+            self.broker.publish_many(
+                model_runs,
+                [entry['url'] for entry in run_entries]
+            )
+        except BatchPublishError as ex:
+            self.outbox.complete_many(run_entries[:ex.count])
+            for entry in run_entries[ex.count:]:
+                self.fail(entry, ex.message)
+            return ex.count
+        self.outbox.complete_many(run_entries)
+        return len(run_entries)
+
+    def fail(self, entry, message):
+        """Handle a failed publish attempt for an outbox entry. The entry is
+        released for retry. If the maximum number of attempts has been reached
+        the entry is removed and the state of the model run is set to failed.
+
+        Parameters
+        ----------
+        entry : dict
+            Claimed outbox entry
+        message : string
+            Error message for the failed attempt
+        """
+        attempts = entry['attempts'] + 1
+        if attempts < self.max_attempts:
+            self.outbox.retry(
+                entry,
+                message,
+                RETRY_DELAY * 2 ** (attempts - 1)
+            )
+            return
+        self.logger.error(
+            'dispatch of model run %s failed: %s',
+            entry['_id'],
+            message
+        )
+        try:
+            model_run = self.db.experiments_predictions_update_state_error(
+                entry['experiment'],
+                entry['_id'],
+                [message]
+            )
+            if not model_run is None and not self.events is None:
+                self.events.publish_state(model_run)
+        except ValueError:
+            # The run state has been changed in the meantime
+            pass
+        self.outbox.complete(entry)
+
+    def get_model_runs(self, entries):
+        """Get the model runs for the given outbox entries with a single
+        database query.
+
+        Parameters
+        ----------
+        entries : list(dict)
+            Claimed outbox entries
+
+        Returns
+        -------
+        dict(scodata.modelrun.ModelRunHandle)
+            Handles for existing model runs by identifier
+        """
+        store = self.db.predictions
+        documents = store.collection.find({
+            '_id' : {'$in' : [entry['_id'] for entry in entries]},
+            'active' : True
+        })
+        model_runs = {}
+        for document in documents:
+            model_run = store.from_dict(document)
+            model_runs[model_run.identifier] = model_run
+        return model_runs
+
+    def notify(self):
+        """Wake up the dispatcher thread. Starts the thread if it is not
+        running in the current process.
+        """
+        self.start()
+        self.wakeup.set()
+
+    def run(self):
+        """Dispatch loop of the background thread."""
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.dispatch_pending()
+            except Exception as ex:
+                self.logger.exception(ex)
+
+    def start(self):
+        """Start the dispatcher thread. Has no effect if the thread has been
+        started before by the current process. Threads do not survive a fork,
+        so a new thread is started in a forked child process.
+        """
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
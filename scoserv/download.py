@@ -0,0 +1,373 @@
+"""File downloads with conditional requests and byte ranges.
+
+Responses for downloadable files contain a strong entity tag and the last
+modification time of the file. Both are derived from the file metadata (path,
+size, and modification time), i.e., the file content does not have to be read
+to validate a cached copy. Requests with If-None-Match or If-Modified-Since
+headers that match the current file are answered with 304 (Not Modified).
+
+Range requests are answered with 206 (Partial Content). Requests for multiple
+ranges are answered with a multipart/byteranges body. Ranges are ignored if
+the request contains an If-Range header that does not match the current file.
+Requests where none of the ranges can be satisfied are answered with 416.
+
+Downloads can be offloaded to a front-end proxy. Instead of the file content
+the response then contains an X-Accel-Redirect (nginx) or X-Sendfile (Apache,
+lighttpd) header that references the file. The proxy serves the file
+(including conditional and range requests) and the worker process returns
+immediately. X-Accel-Redirect references an internal proxy location whose
+prefix is mapped to the data store directory. X-Sendfile references the
+absolute file path. Files outside of the data store directory are always
+sent by the server.
+"""
+
+import datetime
+import hashlib
+import os
+import unicodedata
+import urllib
+import uuid
+
+from flask import Response, request, send_file
+from werkzeug.http import dump_options_header
+from werkzeug.urls import url_quote
+
+from metrics import DOWNLOAD_BYTES
+
+
+"""Size of blocks when streaming file ranges."""
+BLOCK_SIZE = 64 * 1024
+
+"""Modes for offloading downloads to the front-end proxy."""
+OFFLOAD_NONE = 'none'
+OFFLOAD_X_ACCEL_REDIRECT = 'x-accel-redirect'
+OFFLOAD_X_SENDFILE = 'x-sendfile'
+
+OFFLOAD_MODES = [OFFLOAD_NONE, OFFLOAD_X_ACCEL_REDIRECT, OFFLOAD_X_SENDFILE]
+
+"""Maximum number of ranges in a request. Requests with more ranges are
+answered with the full file."""
+MAX_RANGES = 32
+
+
+class DownloadOffload(object):
+    """Configuration for offloading file downloads to the front-end proxy.
+
+    Attributes
+    ----------
+    mode : string
+        Offload mode (none, x-accel-redirect, or x-sendfile)
+    root_dir : string
+        Data store directory. Only files in this directory are offloaded.
+    prefix : string
+        Internal proxy location that is mapped to the data store directory
+        (x-accel-redirect only)
+    """
+    def __init__(self, mode, root_dir, prefix='/'):
+        """Initialize the offload configuration. Raises ValueError if the
+        offload mode is unknown.
+
+        Parameters
+        ----------
+        mode : string
+            Offload mode (none, x-accel-redirect, or x-sendfile)
+        root_dir : string
+            Data store directory
+        prefix : string, optional
+            Internal proxy location for the data store directory
+        """
+        if not mode in OFFLOAD_MODES:
+            raise ValueError('unknown download offload mode: ' + str(mode))
+        self.mode = mode
+        self.root_dir = os.path.abspath(root_dir)
+        self.prefix = prefix.rstrip('/')
+
+    def get_header(self, filename):
+        """Get name and value of the response header for offloading the
+        download of the given file.
+
+        Parameters
+        ----------
+        filename : string
+            Path to file on disk
+
+        Returns
+        -------
+        (string, string)
+            None if the download of the file is not offloaded
+        """
+        if self.mode == OFFLOAD_NONE:
+            return None
+        filename = os.path.abspath(filename)
+        if not filename.startswith(self.root_dir + os.sep):
+            return None
+        if self.mode == OFFLOAD_X_SENDFILE:
+            return 'X-Sendfile', filename
+        rel_path = os.path.relpath(filename, self.root_dir)
+        return 'X-Accel-Redirect', self.prefix + '/' + urllib.quote(
+            rel_path.replace(os.sep, '/')
+        )
+
+
+class FileMetadata(object):
+    """Metadata of a file on disk that is used for cache validation.
+
+    Attributes
+    ----------
+    filename : string
+        Path to file on disk
+    size : int
+        File size in bytes
+    last_modified : datetime.datetime
+        Time of last modification (UTC, truncated to seconds)
+    etag : string
+        Strong entity tag for the current file
+    """
+    def __init__(self, filename):
+        """Read the metadata for the given file.
+
+        Parameters
+        ----------
+        filename : string
+            Path to file on disk
+        """
+        stat = os.stat(filename)
+        self.filename = filename
+        self.size = stat.st_size
+        self.last_modified = datetime.datetime.utcfromtimestamp(
+            int(stat.st_mtime)
+        )
+        self.etag = hashlib.sha1(
+            '%s:%d:%r' % (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+        ).hexdigest()
+
+    def is_modified(self, req):
+        """Test whether the file has been modified with respect to the
+        validators in the given request. If-None-Match takes precedence over
+        If-Modified-Since.
+
+        Parameters
+        ----------
+        req : flask.Request
+            Download request
+
+        Returns
+        -------
+        bool
+        """
+        if req.if_none_match:
+            return not req.if_none_match.contains(self.etag)
+        if not req.if_modified_since is None:
+            return self.last_modified > req.if_modified_since.replace(tzinfo=None)
+        return True
+
+    def matches_if_range(self, req):
+        """Test whether the If-Range condition in the given request (if any)
+        matches the file.
+
+        Parameters
+        ----------
+        req : flask.Request
+            Download request
+
+        Returns
+        -------
+        bool
+        """
+        if_range = req.if_range
+        if not if_range.etag is None:
+            return if_range.etag == self.etag
+        if not if_range.date is None:
+            return self.last_modified <= if_range.date.replace(tzinfo=None)
+        return True
+
+
+def content_disposition(attachment_filename):
+    """Value of the Content-Disposition header for a file that is sent as
+    attachment. The file name is quoted. Names that contain non-ASCII
+    characters are encoded as in RFC 2231 (with an ASCII fallback), in the
+    same way as by flask.send_file().
+
+    Parameters
+    ----------
+    attachment_filename : string
+        Name of the downloaded file
+
+    Returns
+    -------
+    string
+    """
+    if not isinstance(attachment_filename, unicode):
+        attachment_filename = attachment_filename.decode('utf-8')
+    try:
+        filenames = {'filename' : attachment_filename.encode('ascii')}
+    except UnicodeEncodeError:
+        filenames = {
+            'filename' : unicodedata.normalize(
+                'NFKD',
+                attachment_filename
+            ).encode('ascii', 'ignore'),
+            'filename*' : 'UTF-8\'\'' + url_quote(attachment_filename, safe='')
+        }
+    return dump_options_header('attachment', filenames)
+
+
+def file_ranges(filename, ranges, parts=None):
+    """Generator for the content of a list of byte ranges in the given file.
+    For multipart responses the list of part headers contains the header for
+    each range.
+
+    Parameters
+    ----------
+    filename : string
+        Path to file on disk
+    ranges : list((int, int))
+        List of (start, stop) pairs (stop is exclusive)
+    parts : list(string), optional
+        Part headers for multipart responses
+    """
+    with open(filename, 'rb') as f:
+        for i, (start, stop) in enumerate(ranges):
+            if not parts is None:
+                yield parts[i]
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = f.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        if not parts is None:
+            yield parts[-1]
+
+
+def satisfiable_ranges(req, size):
+    """Get list of satisfiable byte ranges in the given request. The result
+    is None if the request does not contain a valid Range header or if it
+    contains too many ranges. The result is an empty list if none of the
+    requested ranges can be satisfied.
+
+    Parameters
+    ----------
+    req : flask.Request
+        Download request
+    size : int
+        File size in bytes
+
+    Returns
+    -------
+    list((int, int))
+        List of (start, stop) pairs (stop is exclusive)
+    """
+    rng = req.range
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) > MAX_RANGES:
+        return None
+    ranges = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            # Suffix range containing the last bytes of the file
+            start = max(size + start, 0)
+            stop = size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def send_download(filename, mimetype, attachment_filename, as_attachment=True, offload=None):
+    """Create response for a file download request. Validates the request
+    against the file metadata and answers range requests. If the download is
+    offloaded the response only contains the header for the front-end proxy.
+
+    Parameters
+    ----------
+    filename : string
+        Path to file on disk
+    mimetype : string
+        File Mime type
+    attachment_filename : string
+        Name of the downloaded file
+    as_attachment : bool, optional
+        Flag indicating whether to send the file as attachment or not
+    offload : DownloadOffload, optional
+        Configuration for offloading downloads to the front-end proxy
+
+    Returns
+    -------
+    flask.Response
+    """
+    if not offload is None:
+        header = offload.get_header(filename)
+        if not header is None:
+            response = Response(mimetype=mimetype)
+            response.headers[header[0]] = header[1]
+            if as_attachment:
+                response.headers['Content-Disposition'] = content_disposition(attachment_filename)
+            return response
+    metadata = FileMetadata(filename)
+    if not metadata.is_modified(request):
+        response = Response(status=304)
+    else:
+        ranges = None
+        if metadata.matches_if_range(request):
+            ranges = satisfiable_ranges(request, metadata.size)
+        if ranges is None:
+            # Send the complete file
+            response = send_file(
+                filename,
+                mimetype=mimetype,
+                as_attachment=as_attachment,
+                attachment_filename=attachment_filename,
+                add_etags=False,
+                conditional=False
+            )
+        elif len(ranges) == 0:
+            response = Response(status=416)
+            response.headers['Content-Range'] = 'bytes */' + str(metadata.size)
+        elif len(ranges) == 1:
+            start, stop = ranges[0]
+            response = Response(
+                file_ranges(filename, ranges),
+                status=206,
+                mimetype=mimetype,
+                direct_passthrough=True
+            )
+            response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                start,
+                stop - 1,
+                metadata.size
+            )
+            response.content_length = stop - start
+        else:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for start, stop in ranges:
+                parts.append(
+                    '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+                        boundary,
+                        mimetype,
+                        start,
+                        stop - 1,
+                        metadata.size
+                    )
+                )
+            parts.append('\r\n--%s--\r\n' % boundary)
+            response = Response(
+                file_ranges(filename, ranges, parts=parts),
+                status=206,
+                mimetype='multipart/byteranges; boundary=' + boundary,
+                direct_passthrough=True
+            )
+            response.content_length = sum(
+                [len(part) for part in parts]
+            ) + sum([stop - start for start, stop in ranges])
+        if not response.content_length is None:
+            DOWNLOAD_BYTES.inc(response.content_length)
+        if as_attachment and response.status_code == 206:
+            response.headers['Content-Disposition'] = content_disposition(attachment_filename)
+    response.set_etag(metadata.etag)
+    response.last_modified = metadata.last_modified
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
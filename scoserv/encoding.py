@@ -0,0 +1,459 @@
+"""Response encoding - Json and MessagePack serialization of API responses and
+request bodies, and compression of response bodies.
+
+Response bodies are serialized by a configurable Json encoder. The default
+encoder is the standard library json module. The simplejson and ujson
+libraries can be used as faster alternatives. Output is always compact (no
+indentation), independently of the debug mode. Encoders other than the
+standard library are only imported when they are selected.
+
+If the msgpack library is installed, clients can request MessagePack instead
+of Json responses (Accept: application/msgpack) and send MessagePack request
+bodies (Content-Type: application/msgpack). Both formats are generated from
+the same response objects.
+
+Responses are compressed with gzip or brotli if the client accepts the
+encoding (Accept-Encoding header) and the body is at least as large as the
+configured minimum size. Brotli requires the brotli library. File downloads,
+event streams, and responses that are already encoded are never compressed.
+"""
+
+import gzip
+import json
+import StringIO
+
+from flask import Response, request
+from werkzeug.exceptions import BadRequest
+
+
+"""Identifier for supported Json encoders."""
+ENCODER_JSON = 'json'
+ENCODER_SIMPLEJSON = 'simplejson'
+ENCODER_UJSON = 'ujson'
+
+ENCODERS = [ENCODER_JSON, ENCODER_SIMPLEJSON, ENCODER_UJSON]
+
+"""Content codings for compressed responses."""
+ENCODING_BROTLI = 'br'
+ENCODING_GZIP = 'gzip'
+
+ENCODINGS = [ENCODING_BROTLI, ENCODING_GZIP]
+
+"""Default minimum size (in bytes) of compressed response bodies. Smaller
+bodies are sent uncompressed."""
+DEFAULT_MIN_SIZE = 1024
+
+"""Default compression levels. Brotli's default quality (11) is too slow for
+dynamic content."""
+DEFAULT_BROTLI_QUALITY = 4
+DEFAULT_GZIP_LEVEL = 6
+
+"""Mime type for Json responses."""
+MIMETYPE_JSON = 'application/json'
+
+"""Mime types for MessagePack. The first type is used for responses."""
+MIMETYPE_MSGPACK = 'application/msgpack'
+MSGPACK_MIMETYPES = [MIMETYPE_MSGPACK, 'application/x-msgpack']
+
+"""Mime types of compressible responses. Includes all text/* types."""
+COMPRESSIBLE_TYPES = [MIMETYPE_JSON, 'application/javascript'] + MSGPACK_MIMETYPES
+
+
+class JsonEncoder(object):
+    """Json encoder for response bodies. Wraps the dumps() function of the
+    selected Json library.
+
+    Attributes
+    ----------
+    name : string
+        Encoder identifier
+    """
+    def __init__(self, name=ENCODER_JSON):
+        """Initialize the encoder. Raises ValueError if the encoder is unknown
+        or if the respective library is not installed.
+
+        Parameters
+        ----------
+        name : string, optional
+            Encoder identifier (default: json)
+        """
+        if not name in ENCODERS:
+            raise ValueError('unknown Json encoder: ' + str(name))
+        self.name = name
+        if name == ENCODER_JSON:
+            self.dumps = lambda obj: json.dumps(obj, separators=(',', ':'))
+        elif name == ENCODER_SIMPLEJSON:
+            try:
+                import simplejson
+            except ImportError:
+                raise ValueError('Json encoder requires package simplejson')
+            self.dumps = lambda obj: simplejson.dumps(obj, separators=(',', ':'))
+        elif name == ENCODER_UJSON:
+            try:
+                import ujson
+            except ImportError:
+                raise ValueError('Json encoder requires package ujson')
+            self.dumps = lambda obj: ujson.dumps(obj, escape_forward_slashes=False)
+
+
+class MessagePackEncoder(object):
+    """MessagePack encoder for response and request bodies. Strings are
+    encoded using the MessagePack string type.
+    """
+    def __init__(self):
+        """Initialize the encoder. Raises ValueError if the msgpack library is
+        not installed.
+        """
+        try:
+            import msgpack
+        except ImportError:
+            raise ValueError('MessagePack encoding requires package msgpack')
+        self.msgpack = msgpack
+
+    def dumps(self, obj):
+        """Serialize an object.
+
+        Parameters
+        ----------
+        obj : dict or list
+            Response object
+
+        Returns
+        -------
+        string
+        """
+        return self.msgpack.packb(obj, use_bin_type=False)
+
+    def loads(self, data):
+        """Deserialize an object. Strings are decoded as unicode (as they are
+        by the Json decoder).
+
+        Parameters
+        ----------
+        data : string
+            Serialized object
+
+        Returns
+        -------
+        dict or list
+        """
+        return self.msgpack.unpackb(data, raw=False)
+
+
+class MessagePackRequestMixin(object):
+    """Mixin for Flask requests that decodes MessagePack request bodies. The
+    decoded body is returned by request.json (and get_json()) as for Json
+    request bodies, i.e., request handlers do not need to distinguish between
+    the two formats. The MessagePack encoder is a class attribute. Requests
+    are only decoded if it is set.
+    """
+    msgpack = None
+
+    def get_json(self, force=False, silent=False, cache=True):
+        """Get the decoded request body. Raises BadRequest if the body cannot
+        be decoded (unless silent is True).
+
+        Returns
+        -------
+        dict or list
+            None if the body is neither Json nor MessagePack
+        """
+        if self.msgpack is None or not self.mimetype in MSGPACK_MIMETYPES:
+            return super(MessagePackRequestMixin, self).get_json(
+                force=force,
+                silent=silent,
+                cache=cache
+            )
+        if cache and hasattr(self, 'cached_msgpack'):
+            return self.cached_msgpack
+        try:
+            obj = self.msgpack.loads(self.get_data(cache=cache))
+        except Exception:
+            if silent:
+                return None
+            raise BadRequest('Failed to decode MessagePack object')
+        if cache:
+            self.cached_msgpack = obj
+        return obj
+
+
+class ResponseCompressor(object):
+    """Compress response bodies with the best content coding that is accepted
+    by the client.
+
+    Attributes
+    ----------
+    encodings : list(string)
+        Supported content codings in order of preference
+    min_size : int
+        Minimum size of compressed response bodies in bytes
+    brotli_quality : int
+        Brotli compression quality (0-11)
+    gzip_level : int
+        Gzip compression level (1-9)
+    """
+    def __init__(self, encodings=None, min_size=DEFAULT_MIN_SIZE, brotli_quality=DEFAULT_BROTLI_QUALITY, gzip_level=DEFAULT_GZIP_LEVEL):
+        """Initialize the content codings and compression parameters. By
+        default, brotli is preferred over gzip if the brotli library is
+        installed. Raises ValueError if a given content coding is unknown or
+        if brotli is requested but the library is not installed.
+
+        Parameters
+        ----------
+        encodings : list(string), optional
+            Supported content codings in order of preference
+        min_size : int, optional
+            Minimum size of compressed response bodies in bytes
+        brotli_quality : int, optional
+            Brotli compression quality (0-11)
+        gzip_level : int, optional
+            Gzip compression level (1-9)
+        """
+        self.brotli = None
+        try:
+            import brotli
+            self.brotli = brotli
+        except ImportError:
+            pass
+        if encodings is None:
+            encodings = ENCODINGS
+            if self.brotli is None:
+                encodings = [ENCODING_GZIP]
+        for encoding in encodings:
+            if not encoding in ENCODINGS:
+                raise ValueError('unknown content coding: ' + str(encoding))
+            if encoding == ENCODING_BROTLI and self.brotli is None:
+                raise ValueError('content coding br requires package brotli')
+        self.encodings = encodings
+        self.min_size = min_size
+        self.brotli_quality = brotli_quality
+        self.gzip_level = gzip_level
+
+    def compress(self, data, encoding):
+        """Compress data using the given content coding.
+
+        Parameters
+        ----------
+        data : string
+            Uncompressed data
+        encoding : string
+            Content coding (br or gzip)
+
+        Returns
+        -------
+        string
+        """
+        if encoding == ENCODING_BROTLI:
+            return self.brotli.compress(
+                data,
+                mode=self.brotli.MODE_TEXT,
+                quality=self.brotli_quality
+            )
+        buf = StringIO.StringIO()
+        f = gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=self.gzip_level)
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return buf.getvalue()
+
+    def compress_response(self, response, accept_encoding):
+        """Compress the body of a response if it is compressible and large
+        enough, and if the client accepts one of the supported content
+        codings. Modifies the given response.
+
+        Parameters
+        ----------
+        response : flask.Response
+            Response for a request
+        accept_encoding : string
+            Value of the request's Accept-Encoding header (or None)
+
+        Returns
+        -------
+        flask.Response
+        """
+        if not is_compressible(response):
+            return response
+        # The response varies with the accepted encodings even if it is not
+        # compressed because it is too small
+        response.vary.add('Accept-Encoding')
+        if response.content_length < self.min_size:
+            return response
+        encoding = self.negotiate(accept_encoding)
+        if encoding is None:
+            return response
+        response.set_data(self.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def negotiate(self, accept_encoding):
+        """Select the content coding for a response. Returns the first of the
+        supported codings with the highest quality value in the given
+        Accept-Encoding header.
+
+        Parameters
+        ----------
+        accept_encoding : string
+            Value of the Accept-Encoding header (or None)
+
+        Returns
+        -------
+        string
+            None if the client does not accept any of the supported codings
+        """
+        if accept_encoding is None:
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        result = None
+        best = 0.0
+        for encoding in self.encodings:
+            if encoding in accepted:
+                quality = accepted[encoding]
+            elif '*' in accepted:
+                quality = accepted['*']
+            else:
+                continue
+            if quality > best:
+                result = encoding
+                best = quality
+        return result
+
+
+class ResponseEncoder(object):
+    """Create responses in the format that is accepted by the client. Responses
+    are Json unless the client prefers MessagePack and MessagePack is enabled.
+
+    Attributes
+    ----------
+    json : JsonEncoder
+        Json encoder
+    msgpack : MessagePackEncoder
+        MessagePack encoder (None if disabled)
+    """
+    def __init__(self, json_encoder, msgpack_encoder=None):
+        """Initialize the encoders.
+
+        Parameters
+        ----------
+        json_encoder : JsonEncoder
+            Json encoder
+        msgpack_encoder : MessagePackEncoder, optional
+            MessagePack encoder (None if disabled)
+        """
+        self.json = json_encoder
+        self.msgpack = msgpack_encoder
+
+    def jsonify(self, obj):
+        """Create a response for a given object for the current request.
+        Replaces flask.jsonify.
+
+        Parameters
+        ----------
+        obj : dict or list
+            Response object
+
+        Returns
+        -------
+        flask.Response
+        """
+        if self.msgpack is None:
+            return Response(self.json.dumps(obj), mimetype=MIMETYPE_JSON)
+        mimetype = self.negotiate(request.accept_mimetypes)
+        if mimetype == MIMETYPE_JSON:
+            response = Response(self.json.dumps(obj), mimetype=MIMETYPE_JSON)
+        else:
+            response = Response(self.msgpack.dumps(obj), mimetype=mimetype)
+        response.vary.add('Accept')
+        return response
+
+    def negotiate(self, accept_mimetypes):
+        """Select the response format. Json is selected if the client accepts
+        both formats with the same quality.
+
+        Parameters
+        ----------
+        accept_mimetypes : werkzeug.datastructures.MIMEAccept
+            Accepted mime types of the request
+
+        Returns
+        -------
+        string
+            Response mime type
+        """
+        if self.msgpack is None:
+            return MIMETYPE_JSON
+        return accept_mimetypes.best_match(
+            [MIMETYPE_JSON] + MSGPACK_MIMETYPES,
+            default=MIMETYPE_JSON
+        )
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def is_compressible(response):
+    """Test if a response can be compressed. Only successful (2xx) responses
+    with a body are compressed. File downloads (and other responses that are
+    passed through directly), streamed responses, partial content, and
+    responses with a content coding are not compressed.
+
+    Parameters
+    ----------
+    response : flask.Response
+        Response for a request
+
+    Returns
+    -------
+    bool
+    """
+    if response.status_code < 200 or response.status_code >= 300:
+        return False
+    if response.status_code in [204, 206]:
+        return False
+    if response.direct_passthrough or response.is_streamed:
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    if 'Content-Range' in response.headers:
+        return False
+    mimetype = response.mimetype
+    if mimetype is None:
+        return False
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def parse_accept_encoding(accept_encoding):
+    """Parse the value of an Accept-Encoding header into a dictionary of
+    content codings and their quality values. Codings with quality value 0
+    are not acceptable.
+
+    Parameters
+    ----------
+    accept_encoding : string
+        Value of the Accept-Encoding header
+
+    Returns
+    -------
+    dict
+    """
+    result = {}
+    for item in accept_encoding.split(','):
+        tokens = item.strip().split(';')
+        coding = tokens[0].strip().lower()
+        if coding == '':
+            continue
+        quality = 1.0
+        for param in tokens[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        result[coding] = quality
+    return result
+
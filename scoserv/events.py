@@ -0,0 +1,429 @@
+"""Model run state change events - Publish/subscribe for state changes of
+model runs that are pushed to clients as Server-Sent Events.
+
+State changes are published to an event bus. Subscribers (i.e., open event
+streams) register for the events of a single model run or of all runs of an
+experiment. Each subscriber has a queue that is filled by the bus.
+
+The bus delivers events through a backend. The local backend delivers events
+to subscribers in the same process only. With multiple worker processes (or
+servers) the mongo backend is used instead: events are written to a MongoDB
+collection and every process receives them via a change stream on that
+collection (requires a MongoDB replica set).
+"""
+
+import datetime
+import json
+import logging
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+import pymongo
+
+from scodata.modelrun import STATE_FAILED, STATE_SUCCESS
+
+
+"""Event bus backends."""
+BACKEND_LOCAL = 'local'
+BACKEND_MONGO = 'mongo'
+
+BACKENDS = [BACKEND_LOCAL, BACKEND_MONGO]
+
+"""Seconds between keep-alive comments in event streams."""
+DEFAULT_KEEPALIVE = 15
+
+"""Seconds before an event stream is closed by the server. Clients are
+expected to reconnect."""
+DEFAULT_STREAM_TIMEOUT = 300
+
+"""Seconds events are kept in the events collection (mongo backend)."""
+EVENT_TTL = 3600
+
+"""Maximum number of undelivered events per subscriber. Events are dropped
+for subscribers that do not consume them."""
+MAX_QUEUE_SIZE = 1000
+
+"""Event type for model run state changes."""
+EVENT_STATE = 'state'
+
+
+# ------------------------------------------------------------------------------
+#
+# Event Bus
+#
+# ------------------------------------------------------------------------------
+
+class Subscription(object):
+    """Subscription for the events of a model run or an experiment.
+
+    Attributes
+    ----------
+    experiment_id : string
+        Unique experiment identifier
+    run_id : string
+        Unique model run identifier. None for subscriptions to all runs of
+        the experiment.
+    queue : Queue.Queue
+        Queue of undelivered events
+    """
+    def __init__(self, experiment_id, run_id=None):
+        """Initialize the subscription.
+
+        Parameters
+        ----------
+        experiment_id : string
+            Unique experiment identifier
+        run_id : string, optional
+            Unique model run identifier
+        """
+        self.experiment_id = experiment_id
+        self.run_id = run_id
+        self.queue = Queue(maxsize=MAX_QUEUE_SIZE)
+
+    def get(self, timeout):
+        """Get the next event. Blocks until an event is available or the
+        timeout expires.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait for an event
+
+        Returns
+        -------
+        dict
+            None if no event was received within the timeout
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def matches(self, event):
+        """Test whether the subscription matches the given event.
+
+        Parameters
+        ----------
+        event : dict
+            Event object
+
+        Returns
+        -------
+        bool
+        """
+        if event['experiment'] != self.experiment_id:
+            return False
+        return self.run_id is None or event['run'] == self.run_id
+
+
+class StreamLimitExceeded(Exception):
+    """Exception raised if a subscription would exceed the maximum number of
+    open event streams of the local process."""
+    pass
+
+
+class EventBus(object):
+    """Bus that delivers published events to matching subscriptions of the
+    local process.
+
+    Every subscription belongs to an open event stream, i.e., to a request
+    thread. The number of subscriptions can be limited to keep request
+    threads available for other requests.
+    """
+    def __init__(self, backend=None, max_subscriptions=None):
+        """Initialize the set of subscriptions and the delivery backend.
+
+        Parameters
+        ----------
+        backend : LocalBackend or MongoBackend, optional
+            Backend that delivers published events. Defaults to local
+            delivery.
+        max_subscriptions : int, optional
+            Maximum number of concurrent subscriptions (no limit if None)
+        """
+        self.subscriptions = set()
+        self.max_subscriptions = max_subscriptions
+        self.lock = threading.Lock()
+        self.backend = backend if not backend is None else LocalBackend()
+        self.backend.start(self.deliver)
+
+    def deliver(self, event):
+        """Add the given event to the queues of all matching subscriptions.
+
+        Parameters
+        ----------
+        event : dict
+            Event object
+        """
+        with self.lock:
+            subscriptions = [s for s in self.subscriptions if s.matches(event)]
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except Full:
+                # Drop events for subscribers that do not consume them
+                pass
+
+    def publish(self, event):
+        """Publish an event.
+
+        Parameters
+        ----------
+        event : dict
+            Event object
+        """
+        self.backend.publish(event)
+
+    def publish_state(self, model_run):
+        """Publish the current state of the given model run.
+
+        Parameters
+        ----------
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for model run
+        """
+        self.publish(state_event(model_run))
+
+    def subscribe(self, experiment_id, run_id=None):
+        """Create a subscription for the events of a model run or all runs of
+        an experiment.
+
+        Parameters
+        ----------
+        experiment_id : string
+            Unique experiment identifier
+        run_id : string, optional
+            Unique model run identifier
+
+        Raises StreamLimitExceeded if the maximum number of subscriptions has
+        been reached.
+
+        Returns
+        -------
+        Subscription
+        """
+        subscription = Subscription(experiment_id, run_id=run_id)
+        with self.lock:
+            if not self.max_subscriptions is None:
+                if len(self.subscriptions) >= self.max_subscriptions:
+                    raise StreamLimitExceeded('too many open event streams')
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove the given subscription.
+
+        Parameters
+        ----------
+        subscription : Subscription
+            Subscription that was returned by subscribe()
+        """
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+
+# ------------------------------------------------------------------------------
+#
+# Backends
+#
+# ------------------------------------------------------------------------------
+
+class LocalBackend(object):
+    """Backend that delivers events within the local process."""
+    def publish(self, event):
+        """Deliver the event to the local event bus.
+
+        Parameters
+        ----------
+        event : dict
+            Event object
+        """
+        self.deliver(event)
+
+    def start(self, deliver):
+        """Set the delivery function of the event bus.
+
+        Parameters
+        ----------
+        deliver : func
+            Function that delivers events to local subscriptions
+        """
+        self.deliver = deliver
+
+
+class MongoBackend(object):
+    """Backend that distributes events between processes via a MongoDB
+    collection. Published events are inserted into the collection. A
+    background thread watches the collection's change stream and delivers
+    inserted events to the local event bus.
+    """
+    def __init__(self, mongo):
+        """Initialize the MongoDB collection for events. Events are removed
+        by MongoDB after EVENT_TTL seconds.
+
+        Parameters
+        ----------
+        mongo : scodata.MongoDBFactory
+            MongoDB connector
+        """
+        self.collection = mongo.get_database().events
+        self.collection.create_index(
+            [('createdAt', pymongo.ASCENDING)],
+            expireAfterSeconds=EVENT_TTL
+        )
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def publish(self, event):
+        """Insert the event into the events collection.
+
+        Parameters
+        ----------
+        event : dict
+            Event object
+        """
+        doc = dict(event)
+        doc['createdAt'] = datetime.datetime.utcnow()
+        self.collection.insert_one(doc)
+
+    def run(self, deliver):
+        """Watch loop of the background thread. Reopens the change stream
+        after errors.
+
+        Parameters
+        ----------
+        deliver : func
+            Function that delivers events to local subscriptions
+        """
+        while True:
+            try:
+                with self.collection.watch(
+                    [{'$match' : {'operationType' : 'insert'}}]
+                ) as stream:
+                    for change in stream:
+                        event = change['fullDocument']
+                        del event['_id']
+                        del event['createdAt']
+                        deliver(event)
+            except Exception as ex:
+                self.logger.exception(ex)
+                time.sleep(1)
+
+    def start(self, deliver):
+        """Start the background thread that watches the events collection.
+
+        Parameters
+        ----------
+        deliver : func
+            Function that delivers events to local subscriptions
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, args=(deliver,))
+            self.thread.daemon = True
+            self.thread.start()
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def event_stream(bus, subscription, initial_events=None, keepalive=DEFAULT_KEEPALIVE, timeout=DEFAULT_STREAM_TIMEOUT, until_finished=False):
+    """Generator for a Server-Sent Events stream of the events for the given
+    subscription. Sends a keep-alive comment if there has been no event for
+    the keep-alive interval. The subscription is removed when the stream is
+    closed.
+
+    Parameters
+    ----------
+    bus : EventBus
+        Event bus that created the subscription
+    subscription : Subscription
+        Subscription for streamed events
+    initial_events : list(dict), optional
+        Events that are sent at the start of the stream
+    keepalive : float, optional
+        Seconds between keep-alive comments
+    timeout : float, optional
+        Seconds before the stream is closed
+    until_finished : bool, optional
+        Close the stream after an event for a finished (failed or successful)
+        model run has been sent
+    """
+    try:
+        if not initial_events is None:
+            for event in initial_events:
+                yield format_event(event)
+                if until_finished and is_finished(event):
+                    return
+        end = time.time() + timeout
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            event = subscription.get(min(keepalive, remaining))
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_event(event)
+                if until_finished and is_finished(event):
+                    return
+    finally:
+        bus.unsubscribe(subscription)
+
+
+def format_event(event):
+    """Serialize an event in Server-Sent Events format.
+
+    Parameters
+    ----------
+    event : dict
+        Event object
+
+    Returns
+    -------
+    string
+    """
+    return 'event: ' + event['type'] + '\ndata: ' + json.dumps(event) + '\n\n'
+
+
+def is_finished(event):
+    """Test whether the given event is a state event for a finished (failed
+    or successful) model run.
+
+    Parameters
+    ----------
+    event : dict
+        Event object
+
+    Returns
+    -------
+    bool
+    """
+    return event['type'] == EVENT_STATE and event['state'] in [STATE_FAILED, STATE_SUCCESS]
+
+
+def state_event(model_run):
+    """Create state change event for a model run.
+
+    Parameters
+    ----------
+    model_run : scodata.modelrun.ModelRunHandle
+        Handle for model run
+
+    Returns
+    -------
+    dict
+    """
+    event = {
+        'type' : EVENT_STATE,
+        'experiment' : model_run.experiment_id,
+        'run' : model_run.identifier,
+        'state' : str(model_run.state),
+        'timestamp' : datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')
+    }
+    if model_run.state.is_failed:
+        event['errors'] = model_run.state.errors
+    return event
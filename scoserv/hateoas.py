@@ -1,5 +1,8 @@
 """Collection of classes and methods to generate URL's for API resources."""
 
+import urllib
+import urlparse
+
 from scodata.datastore import PROPERTY_FILENAME
 from scodata.experiment import TYPE_EXPERIMENT
 from scodata.funcdata import TYPE_FUNCDATA
@@ -7,6 +10,7 @@ from scodata.image import TYPE_IMAGE, TYPE_IMAGE_GROUP, TYPE_PREDICTION_IMAGE_SE
 from scodata.modelrun import TYPE_MODEL_RUN
 from scodata.subject import TYPE_SUBJECT
 from scoengine.model import TYPE_MODEL
+from listing import ListingPage, COUNT_EXACT
 from widget import TYPE_WIDGET
 
 # ------------------------------------------------------------------------------
@@ -28,6 +32,16 @@ LIST_VALUE = 'href'
 # Object listing query parameter
 # ------------------------------------------------------------------------------
 
+# Cursor for keyset pagination of object listings
+QPARA_CURSOR = 'cursor'
+# Mode for counting the total number of objects in a listing
+QPARA_COUNT = 'count'
+# List of referenced objects to embed in composed resources
+QPARA_EXPAND = 'expand'
+# List of fields to include in composed resources
+QPARA_FIELDS = 'fields'
+# Mode for references in responses
+QPARA_LINKS = 'links'
 # List of attributes to include for each item in listings
 QPARA_PROPERTIES = 'properties'
 # Limit number of items in result
@@ -37,6 +51,19 @@ QPARA_OFFSET = 'offset'
 # Model run state filter
 QPARA_STATE = 'state'
 
+# ------------------------------------------------------------------------------
+# Reference modes
+# ------------------------------------------------------------------------------
+
+# Absolute Urls
+LINKS_FULL = 'full'
+# No references for objects and listings
+LINKS_NONE = 'none'
+# Urls relative to the server root (i.e., the path component only)
+LINKS_RELATIVE = 'relative'
+
+LINKS_MODES = [LINKS_FULL, LINKS_NONE, LINKS_RELATIVE]
+
 # ------------------------------------------------------------------------------
 # Reference list keys
 # ------------------------------------------------------------------------------
@@ -49,6 +76,8 @@ REF_KEY_DELETE = 'delete'
 REF_KEY_DOC = 'doc'
 # Download data file
 REF_KEY_DOWNLOAD = 'download'
+# Stream of model run state change events
+REF_KEY_EVENTS = 'events'
 # Model run listing's reference to it's experiment
 REF_KEY_EXPERIMENT = 'experiment'
 # Get experiments fMRI data
@@ -59,6 +88,10 @@ REF_KEY_FMRI_UPLOAD = 'fmri.upload'
 REF_KEY_IMAGE_GROUP = 'group'
 # List experiment predictions
 REF_KEY_PREDICTIONS_LIST = 'predictions.list'
+# Create batch of predictive model runs
+REF_KEY_PREDICTIONS_BATCH = 'predictions.batch'
+# Stream of state change events for experiment predictions
+REF_KEY_PREDICTIONS_EVENTS = 'predictions.events'
 # Create new predictive model runs
 REF_KEY_PREDICTIONS_RUN = 'predictions.run'
 # Self reference
@@ -71,6 +104,10 @@ REF_KEY_UPSERT_PROPERTY = 'properties'
 REF_KEY_UPDATE_STATE_ACTIVE = "state.active"
 REF_KEY_UPDATE_STATE_ERROR = "state.error"
 REF_KEY_UPDATE_STATE_SUCCESS = "state.success"
+# Upload chunk of file in upload session
+REF_KEY_UPLOAD_CHUNK = 'upload'
+# Finalize upload session
+REF_KEY_UPLOAD_FINALIZE = 'finalize'
 
 # Listing pagination navigators
 
@@ -105,6 +142,8 @@ REF_KEY_SERVICE_MODELS_LIST_ALL = 'models.list.all'
 REF_KEY_SERVICE_SUBJECTS_LIST = 'subjects.list'
 # Create new subject via upload
 REF_KEY_SERVICE_SUBJECTS_UPLOAD = 'subjects.upload'
+# Create resumable upload session
+REF_KEY_SERVICE_UPLOADS_CREATE = 'uploads.create'
 # List widgets
 REF_KEY_SERVICE_WIDGETS_LIST = 'widgets.list'
 
@@ -132,9 +171,17 @@ URL_KEY_PAGES = 'pages'
 URL_KEY_PREDICTIONS = 'predictions'
 # Url component for subjects
 URL_KEY_SUBJECTS = 'subjects'
+# Url component for upload sessions
+URL_KEY_UPLOADS = 'uploads'
 # Url component for widgets
 URL_KEY_WIDGETS = 'widgets'
 
+# Url suffix to create batches of model runs
+URL_SUFFIX_BATCH = 'batch'
+# Url suffix for streams of model run state change events
+URL_SUFFIX_EVENTS = 'events'
+# Url suffix to finalize upload sessions
+URL_SUFFIX_FINALIZE = 'finalize'
 #Url suffix for images in an image group
 URL_SUFFIX_IMAGES = 'images'
 #Url suffix for references to update object options
@@ -149,6 +196,19 @@ URL_SUFFIX_STATE_ACTIVE = 'active'
 URL_SUFFIX_STATE_ERROR = 'error'
 URL_SUFFIX_STATE_SUCCESS = 'success'
 
+# ------------------------------------------------------------------------------
+# Link template fields
+# ------------------------------------------------------------------------------
+
+# Object identifier
+FIELD_ID = 'id'
+# Identifier of the experiment a model run or fMRI data object belongs to
+FIELD_EXPERIMENT = 'experiment'
+# Name of the downloadable object file
+FIELD_FILENAME = 'filename'
+
+TEMPLATE_FIELDS = [FIELD_ID, FIELD_EXPERIMENT, FIELD_FILENAME]
+
 # ------------------------------------------------------------------------------
 #
 # Navigation references factory for object listing pagination
@@ -156,8 +216,13 @@ URL_SUFFIX_STATE_SUCCESS = 'success'
 # ------------------------------------------------------------------------------
 
 class PaginationReferenceFactory(object):
-    """Factory for navigation references for object listings."""
-    def __init__(self, object_listing, properties, url):
+    """Factory for navigation references for object listings. Listings that
+    were retrieved using a cursor are navigated using cursors. All other
+    listings are navigated using offsets. The reference to the next page does
+    not depend on the total number of objects in the listing, i.e., it is also
+    available for listings where the objects were not counted.
+    """
+    def __init__(self, object_listing, properties, url, links=LINKS_FULL):
         """Initialize object listing properties that are used for pagination Url
         generation.
 
@@ -170,32 +235,55 @@ class PaginationReferenceFactory(object):
             List of additional properties to be included in object listing.
         url : string
             Base Url for object listing
+        links : string, optional
+            Reference mode of the listing. Navigation Urls keep modes other
+            than the default.
         """
         self.url = url
+        self.links = links
         self.offset = object_listing.offset
         self.limit = object_listing.limit
         self.total_count = object_listing.total_count
         self.properties = ','.join(properties) if not properties is None else None
+        if isinstance(object_listing, ListingPage):
+            self.is_cursor_listing = object_listing.is_cursor_listing
+            self.next_cursor = object_listing.next_cursor
+            self.has_more = object_listing.has_more
+            self.count_mode = object_listing.count_mode
+        else:
+            self.is_cursor_listing = False
+            self.next_cursor = None
+            self.has_more = self.offset >= 0 and self.limit > 0 and (self.offset + self.limit) < self.total_count
+            self.count_mode = COUNT_EXACT
 
-    def decorate_listing_url(self, offset):
-        """Get decorated URL to navigate object listing. Only the offset value
-        changes for different navigation Url's.
+    def decorate_listing_url(self, offset=None, cursor=None):
+        """Get decorated URL to navigate object listing. Only the offset or
+        cursor value changes for different navigation Url's.
 
         Parameters
         ----------
-        offset : int
+        offset : int, optional
             Index of first element of the page that is to be displayed.
+        cursor : string, optional
+            Cursor for the page that is to be displayed.
 
         Returns
         -------
         string
             Decorated object listing Url.
         """
-        query = QPARA_OFFSET + '=' + str(offset)
+        if not cursor is None:
+            query = QPARA_CURSOR + '=' + urllib.quote(cursor, safe='')
+        else:
+            query = QPARA_OFFSET + '=' + str(offset)
         if self.limit >= 0:
             query += '&' + QPARA_LIMIT + '=' + str(self.limit)
         if not self.properties is None:
             query += '&' + QPARA_PROPERTIES + '=' + self.properties
+        if self.count_mode != COUNT_EXACT:
+            query += '&' + QPARA_COUNT + '=' + self.count_mode
+        if self.links != LINKS_FULL:
+            query += '&' + QPARA_LINKS + '=' + self.links
         return self.url + '?' + query
 
     def navigation_references(self, links=None):
@@ -214,13 +302,24 @@ class PaginationReferenceFactory(object):
         """
         # Include listing self reference
         nav = {REF_KEY_SELF : self.url}
+        if self.is_cursor_listing:
+            # Cursor listings can only be navigated forward from the first
+            # page
+            nav[REF_KEY_PAGE_FIRST] = self.decorate_listing_url(cursor='')
+            if not self.next_cursor is None:
+                nav[REF_KEY_PAGE_NEXT] = self.decorate_listing_url(
+                    cursor=self.next_cursor
+                )
+            return to_references(merge_references(nav, links))
         # Navigate to first page
         nav[REF_KEY_PAGE_FIRST] = self.decorate_listing_url(0)
-        # Navigate to last page
-        if self.limit > 0 and (self.total_count - self.limit) > 0:
-            nav[REF_KEY_PAGE_LAST] = self.decorate_listing_url(self.total_count - self.limit)
+        # Navigate to last page (only if the objects in the listing have been
+        # counted)
+        if not self.total_count is None:
+            if self.limit > 0 and (self.total_count - self.limit) > 0:
+                nav[REF_KEY_PAGE_LAST] = self.decorate_listing_url(self.total_count - self.limit)
         # Navigate to next page
-        if self.offset >= 0 and self.limit > 0 and (self.offset + self.limit) < self.total_count:
+        if self.offset >= 0 and self.limit > 0 and self.has_more:
             nav[REF_KEY_PAGE_NEXT] = self.decorate_listing_url(self.offset + self.limit)
         # Navigate to previous page
         if self.offset > 0 and self.limit > 0:
@@ -229,11 +328,96 @@ class PaginationReferenceFactory(object):
             else:
                 nav[REF_KEY_PAGE_PREVIOUS] = self.decorate_listing_url(0)
         # Merge navigation references with optional likns disctionary if given
-        if not links is None:
-            for rel in links:
-                nav[rel] = links[rel]
-        # Return list of references
-        return to_references(nav)
+        # and return list of references
+        return to_references(merge_references(nav, links))
+
+
+# ------------------------------------------------------------------------------
+#
+# Link templates for object references
+#
+# ------------------------------------------------------------------------------
+
+class LinkTemplate(object):
+    """Compiled set of object references. Each reference Url is split into a
+    root and a constant suffix. The root is the Url prefix up to the last
+    template field (object identifier, experiment identifier, or file name).
+    References of an object share few distinct roots (e.g., the self
+    reference), i.e., only the roots are formatted for each object.
+
+    Attributes
+    ----------
+    links : list((string, int, string))
+        List of reference type, index of the Url root, and Url suffix
+    roots : list(string)
+        Format strings with named template fields for Url roots
+    """
+    def __init__(self, references):
+        """Compile the given reference dictionary for a placeholder object
+        (see TemplateObject).
+
+        Parameters
+        ----------
+        references : dict
+            Dictionary of references for a placeholder object
+        """
+        self.links = []
+        self.roots = []
+        for rel in references:
+            url = references[rel]
+            # Split the Url after the last placeholder
+            pos = 0
+            for field in TEMPLATE_FIELDS:
+                marker = placeholder(field)
+                index = url.rfind(marker)
+                if index >= 0:
+                    pos = max(pos, index + len(marker))
+            root = url[:pos].replace('%', '%%')
+            for field in TEMPLATE_FIELDS:
+                root = root.replace(placeholder(field), '%(' + field + ')s')
+            if not root in self.roots:
+                self.roots.append(root)
+            self.links.append((rel, self.roots.index(root), url[pos:]))
+
+    def fill(self, values):
+        """Get the reference list for an object.
+
+        Parameters
+        ----------
+        values : dict
+            Values for the template fields
+
+        Returns
+        -------
+        List
+            List of reference objects, i.e., [{rel:..., href:...}]
+        """
+        roots = [root % values for root in self.roots]
+        return [
+            {LIST_KEY : rel, LIST_VALUE : roots[index] + suffix}
+                for rel, index, suffix in self.links
+        ]
+
+
+class TemplateObject(object):
+    """Placeholder object that is used to compile the link template for the
+    type (and state) of a given object. Identifiers and the file name are
+    replaced by placeholders for the template fields.
+    """
+    def __init__(self, obj):
+        """Initialize the placeholder from the given object.
+
+        Parameters
+        ----------
+        obj : (sub-class of)ObjectHandle
+            Handle for database object
+        """
+        self.type = obj.type
+        self.identifier = placeholder(FIELD_ID)
+        self.experiment_id = placeholder(FIELD_EXPERIMENT)
+        self.properties = {PROPERTY_FILENAME : placeholder(FIELD_FILENAME)}
+        self.fmri_data_id = getattr(obj, 'fmri_data_id', None)
+        self.state = getattr(obj, 'state', None)
 
 
 # ------------------------------------------------------------------------------
@@ -251,8 +435,12 @@ class HATEOASReferenceFactory:
     -----------
     base_url : string
         Base Url for all resource references
+    links : string
+        Reference mode (full, relative, or none). Relative references only
+        contain the path of the base Url. With mode none, objects and
+        listings are serialized without references.
     """
-    def __init__(self, base_url, doc_url):
+    def __init__(self, base_url, doc_url, links=LINKS_FULL):
         """Initialize the factory object by providing the base Url for
         generating resource references.
 
@@ -262,12 +450,19 @@ class HATEOASReferenceFactory:
             Base Url for all resource references'
         doc_url : string
             Url for API documentation
+        links : string, optional
+            Reference mode
         """
+        if links == LINKS_RELATIVE:
+            base_url = urlparse.urlparse(base_url).path
+        self.links = links
         self.base_url = base_url
         # Remove trailing '/'
         while self.base_url.endswith('/'):
             self.base_url = self.base_url[:-1]
         self.doc_url = doc_url
+        # Compiled link templates by object type (and model run state)
+        self.templates = {}
 
     def experiment_reference(self, experiment_id):
         """Self reference to experiment object.
@@ -526,8 +721,11 @@ class HATEOASReferenceFactory:
         """List of references for given object. Object type will determine the
         references in the returned listing.
 
-        Raises ValueError for objects of unknown types. For each new data type
-        that is supported by the SCO data store this method should be extended.
+        References are generated from link templates. The template for an
+        object type (and model run state) is compiled from the reference
+        dictionary of a placeholder object when it is first used.
+
+        Raises ValueError for objects of unknown types.
 
         Parameters
         ----------
@@ -539,6 +737,37 @@ class HATEOASReferenceFactory:
         List
             List of reference objects, i.e., [{rel:..., href:...}]
         """
+        key = template_key(obj)
+        try:
+            template = self.templates[key]
+        except KeyError:
+            template = LinkTemplate(
+                self.reference_dictionary(TemplateObject(obj))
+            )
+            self.templates[key] = template
+        return template.fill({
+            FIELD_ID : obj.identifier,
+            FIELD_EXPERIMENT : getattr(obj, 'experiment_id', None),
+            FIELD_FILENAME : obj.properties.get(PROPERTY_FILENAME)
+        })
+
+    def reference_dictionary(self, obj):
+        """Dictionary of references for given object. Object type will
+        determine the references in the returned dictionary.
+
+        Raises ValueError for objects of unknown types. For each new data type
+        that is supported by the SCO data store this method should be extended.
+
+        Parameters
+        ----------
+        obj : (sub-class of)ObjectHandle
+            Handle for database object
+
+        Returns
+        -------
+        dict
+            Dictionary of references
+        """
         if obj.type == TYPE_EXPERIMENT:
             # Get base references.
             self_ref = self.experiment_reference(obj.identifier)
@@ -547,13 +776,14 @@ class HATEOASReferenceFactory:
             prediction_url = self.experiments_predictions_reference(obj.identifier)
             refs[REF_KEY_PREDICTIONS_LIST] = prediction_url
             refs[REF_KEY_PREDICTIONS_RUN] = prediction_url
+            refs[REF_KEY_PREDICTIONS_BATCH] = prediction_url + '/' + URL_SUFFIX_BATCH
+            refs[REF_KEY_PREDICTIONS_EVENTS] = prediction_url + '/' + URL_SUFFIX_EVENTS
             # Add reference to fMRI data (if present) and to upload fMRI
             fmri_url = self.experiments_fmri_reference(obj.identifier)
             refs[REF_KEY_FMRI_UPLOAD] = fmri_url
             if not obj.fmri_data_id is None:
                 refs[REF_KEY_FMRI_GET] = fmri_url
-            # Return reference list
-            return to_references(refs)
+            return refs
         elif obj.type == TYPE_FUNCDATA:
             # fMRI data objecs have the basic reference set
             refs = base_reference_set(
@@ -561,7 +791,7 @@ class HATEOASReferenceFactory:
                 filename=obj.properties[PROPERTY_FILENAME]
             )
             refs['experiment'] = self.experiment_reference(obj.experiment_id)
-            return to_references(refs)
+            return refs
         elif obj.type == TYPE_MODEL_RUN:
             # Get base references.
             if obj.state.is_success:
@@ -580,6 +810,11 @@ class HATEOASReferenceFactory:
                 refs[REF_KEY_SELF],
                 URL_KEY_ATTACHMENTS
             ])
+            # Add stream of state change events for all model runs
+            refs[REF_KEY_EVENTS] = '/'.join([
+                refs[REF_KEY_SELF],
+                URL_SUFFIX_EVENTS
+            ])
             if not obj.state.is_success:
                 if obj.state.is_idle:
                     # Add update state link
@@ -599,16 +834,13 @@ class HATEOASReferenceFactory:
                         URL_SUFFIX_UPDATE_STATE,
                         URL_SUFFIX_STATE_SUCCESS
                     ])
-            # Return reference list
-            return to_references(refs)
+            return refs
         elif obj.type == TYPE_IMAGE:
             # Image files have the basic reference set
             self_ref = self.image_file_reference(obj.identifier)
-            return to_references(
-                base_reference_set(
-                    self_ref,
-                    filename=obj.properties[PROPERTY_FILENAME]
-                )
+            return base_reference_set(
+                self_ref,
+                filename=obj.properties[PROPERTY_FILENAME]
             )
         elif obj.type == TYPE_IMAGE_GROUP:
             # Get basic reference set
@@ -619,32 +851,23 @@ class HATEOASReferenceFactory:
             )
             # Add reference to update image group options
             refs[REF_KEY_UPDATE_OPTIONS] = self_ref + '/' + URL_SUFFIX_OPTIONS
-            # Return reference list
-            return to_references(refs)
+            return refs
         elif obj.type == TYPE_PREDICTION_IMAGE_SET:
-            return to_references(
-                base_reference_set(self.image_group_reference(obj.identifier))
-            )
+            return base_reference_set(self.image_group_reference(obj.identifier))
         elif obj.type == TYPE_SUBJECT:
             # Subjects have the basic reference set
             self_ref = self.subject_reference(obj.identifier)
-            return to_references(
-                base_reference_set(
-                    self_ref,
-                    filename=obj.properties[PROPERTY_FILENAME]
-                )
+            return base_reference_set(
+                self_ref,
+                filename=obj.properties[PROPERTY_FILENAME]
             )
         elif obj.type == TYPE_MODEL:
-            # Return reference list
-            return to_references({
-                REF_KEY_SELF : self.model_reference(obj.identifier)
-            })
+            return {REF_KEY_SELF : self.model_reference(obj.identifier)}
         elif obj.type == TYPE_WIDGET:
             # Get base references.
             self_ref = self.widget_reference(obj.identifier)
             refs = base_reference_set(self_ref)
-            # Return reference list
-            return to_references(refs)
+            return refs
         else:
             raise ValueError('unknown object type')
 
@@ -688,6 +911,7 @@ class HATEOASReferenceFactory:
             REF_KEY_SERVICE_MODELS_LIST_ALL : self.models_reference() + '?' + QPARA_LIMIT + '=-1',
             REF_KEY_SERVICE_SUBJECTS_LIST : self.subjects_reference(),
             REF_KEY_SERVICE_SUBJECTS_UPLOAD : self.subjects_reference(),
+            REF_KEY_SERVICE_UPLOADS_CREATE : self.uploads_reference(),
             REF_KEY_SERVICE_WIDGETS_LIST : self.widgets_reference()
         })
 
@@ -716,6 +940,51 @@ class HATEOASReferenceFactory:
         """
         return self.base_url + '/' + URL_KEY_SUBJECTS
 
+    def upload_session_reference(self, session_id):
+        """Self reference for upload session.
+
+        Parameters
+        ----------
+        session_id : string
+            Unique upload session identifier
+
+        Returns
+        -------
+        string
+        """
+        return self.uploads_reference() + '/' + session_id
+
+    def upload_session_references(self, session_id):
+        """Reference set for upload session. Contains references to get the
+        session status, upload chunks, finalize, and delete the session.
+
+        Parameters
+        ----------
+        session_id : string
+            Unique upload session identifier
+
+        Returns
+        -------
+        List
+            List of reference objects, i.e., [{rel:..., href:...}]
+        """
+        self_ref = self.upload_session_reference(session_id)
+        return to_references({
+            REF_KEY_SELF : self_ref,
+            REF_KEY_DELETE : self_ref,
+            REF_KEY_UPLOAD_CHUNK : self_ref,
+            REF_KEY_UPLOAD_FINALIZE : self_ref + '/' + URL_SUFFIX_FINALIZE
+        })
+
+    def uploads_reference(self):
+        """Base Url for upload sessions.
+
+        Returns
+        -------
+        string
+        """
+        return self.base_url + '/' + URL_KEY_UPLOADS
+
     def widget_reference(self, widget_id):
         """Self reference for visualization widget.
 
@@ -773,6 +1042,44 @@ def base_reference_set(self_ref, filename=None):
     return refs
 
 
+def merge_references(refs, links):
+    """Merge optional dictionary of references into a given reference
+    dictionary.
+
+    Parameters
+    ----------
+    refs : Dictionary
+        Dictionary of references
+    links : Dictionary
+        Optional dictionary of additional references or None
+
+    Returns
+    -------
+    Dictionary
+        Dictionary of references
+    """
+    if not links is None:
+        for rel in links:
+            refs[rel] = links[rel]
+    return refs
+
+
+def placeholder(field):
+    """Placeholder for a link template field in the references of a
+    placeholder object.
+
+    Parameters
+    ----------
+    field : string
+        Template field name
+
+    Returns
+    -------
+    string
+    """
+    return '\x00' + field + '\x00'
+
+
 def self_reference_set(self_ref):
     """Reference list containing as single element a self-reference to a
     Web resource.
@@ -790,6 +1097,29 @@ def self_reference_set(self_ref):
     return to_references({REF_KEY_SELF: self_ref})
 
 
+def template_key(obj):
+    """Key of the link template for an object. The references depend on the
+    object type, the state of model runs, and on whether an experiment has
+    fMRI data.
+
+    Parameters
+    ----------
+    obj : (sub-class of)ObjectHandle
+        Handle for database object
+
+    Returns
+    -------
+    tuple
+    """
+    object_type = obj.type
+    if object_type == TYPE_MODEL_RUN:
+        state = obj.state
+        return (object_type, state.is_idle, state.is_failed, state.is_success)
+    elif object_type == TYPE_EXPERIMENT:
+        return (object_type, obj.fmri_data_id is None)
+    return (object_type,)
+
+
 def to_references(dictionary):
     """Generate a HATEOAS reference listing from a dictionary. Keys in the
     dictionary define relationships ('rel') and associated values are
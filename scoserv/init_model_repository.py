@@ -9,6 +9,8 @@ import sys
 from scodata.mongo import MongoDBFactory
 from scoengine import init_registry_from_json
 
+from modelcache import increment_version
+
 
 if __name__ == '__main__':
     # Expect the configuration file as first and the model definition file as
@@ -34,3 +36,5 @@ if __name__ == '__main__':
         sys.argv[2],
         clear_collection=clear_collection
     )
+    # Notify the model caches of running servers
+    increment_version(mongo.get_database().versions)
@@ -0,0 +1,521 @@
+"""Object listings that are retrieved directly from the collections of the
+data store.
+
+The data store implements object listings using offset and limit, i.e., the
+cost of retrieving a page grows linearly with the offset, and it always counts
+the total number of objects in the listing. Listings that are retrieved using
+the list_objects() method of this module support keyset pagination and allow
+to skip the count query.
+
+Keyset pagination uses a cursor that identifies the last object on the
+previous page. Objects in listings are ordered by decreasing timestamp (ties
+are broken by decreasing object identifier). The cursor encodes the timestamp
+and identifier of the last object on a page. The next page contains the objects
+that precede this object in listing order. Given an index on (active,
+timestamp, _id) the cost for retrieving a page is independent of its position
+in the listing. Cursors are opaque to clients. They are contained in the
+navigation references of listings that were retrieved using a cursor. An empty
+cursor value refers to the first page in a listing.
+
+The total number of objects in a listing is either counted exactly, estimated
+from the collection metadata, or not counted at all. Estimates are only
+available for listings that are not filtered by a query. Deleted objects that
+are still kept in the collection are subtracted from the estimate. They are
+counted using the listing index, i.e., the cost depends on the number of
+deleted objects only.
+
+Listings only contain the identifier, name, timestamp, and references for
+each object, together with an optional set of requested object properties.
+Instead of full object handles, listing pages contain object summaries that
+are created from documents where all other fields have been removed by a
+MongoDB projection.
+"""
+
+import base64
+import datetime
+import json
+
+import pymongo
+
+from scodata.datastore import ObjectHandle, ObjectListing
+from scodata.datastore import PROPERTY_FILENAME, PROPERTY_NAME
+from scodata.experiment import TYPE_EXPERIMENT, PROPERTY_RUN_COUNT
+from scodata.image import TYPE_IMAGE, TYPE_IMAGE_GROUP, PROPERTY_GROUPSIZE
+from scodata.modelrun import TYPE_MODEL_RUN
+from scodata.modelrun import STATE_FAILED, STATE_IDLE, STATE_RUNNING, STATE_SUCCESS
+from scodata.subject import TYPE_SUBJECT
+from widget import TYPE_WIDGET
+
+
+"""Modes for counting the total number of objects in a listing."""
+COUNT_ESTIMATED = 'estimated'
+COUNT_EXACT = 'exact'
+COUNT_NONE = 'none'
+
+COUNT_MODES = [COUNT_ESTIMATED, COUNT_EXACT, COUNT_NONE]
+
+"""Document fields (in addition to identifier, timestamp, and name) that are
+required to generate the references for objects of the different types."""
+SUMMARY_FIELDS = {
+    TYPE_EXPERIMENT : ['fmri'],
+    TYPE_IMAGE : ['properties.' + PROPERTY_FILENAME],
+    TYPE_IMAGE_GROUP : ['properties.' + PROPERTY_FILENAME],
+    TYPE_MODEL_RUN : ['experiment', 'state.type'],
+    TYPE_SUBJECT : ['properties.' + PROPERTY_FILENAME],
+    TYPE_WIDGET : []
+}
+
+
+# ------------------------------------------------------------------------------
+#
+# Object Listings
+#
+# ------------------------------------------------------------------------------
+
+
+class ListingPage(ObjectListing):
+    """Page of an object listing. In addition to the default object listing it
+    contains the cursor for the listing page and information whether there are
+    more objects in the listing.
+
+    Attributes
+    ----------
+    cursor : string
+        Cursor for the listing page (empty string for the first page) or None
+        if the page was retrieved using an offset
+    next_cursor : string
+        Cursor for the next page in the listing or None if this is the last
+        page in the listing.
+    has_more : bool
+        True, if there are objects in the listing following this page
+    count_mode : string
+        Mode that was used to count the total number of objects in the listing
+        (may differ from the requested mode for filtered listings)
+    """
+    def __init__(self, items, offset, limit, total_count, count_mode, has_more, cursor=None, next_cursor=None):
+        """Initialize the object listing.
+
+        Parameters
+        ----------
+        items : List(ObjectHandle)
+            List of objects that are subclass of ObjectHandle.
+        offset : int
+            Offset in list (-1 for pages that were retrieved using a cursor)
+        limit : int
+            Result has been limited to not include all items (or -1 for all)
+        total_count : int
+            Total number of object's in the listing (None if not counted).
+        count_mode : string
+            Mode that was used to count the total number of objects
+        has_more : bool
+            True, if there are objects in the listing following this page
+        cursor : string, optional
+            Cursor for the listing page
+        next_cursor : string, optional
+            Cursor for the next page in the listing
+        """
+        super(ListingPage, self).__init__(items, offset, limit, total_count)
+        self.count_mode = count_mode
+        self.has_more = has_more
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def is_cursor_listing(self):
+        """Flag indicating whether the page was retrieved using a cursor.
+
+        Returns
+        -------
+        bool
+        """
+        return not self.cursor is None
+
+
+class ObjectSummary(ObjectHandle):
+    """Summary of a database object in an object listing. Contains the
+    identifier, timestamp, and (a subset of the) object properties together
+    with the type specific attributes that are required to generate the
+    object references.
+
+    Attributes
+    ----------
+    experiment_id : string
+        Identifier of the experiment a model run belongs to (model runs only)
+    fmri_data_id : string
+        Identifier of the experiment fMRI data (experiments only)
+    state : RunStateSummary
+        Model run state (model runs only)
+    """
+    def __init__(self, identifier, timestamp, properties, object_type, experiment_id=None, fmri_data_id=None, state=None):
+        """Initialize the object summary.
+
+        Parameters
+        ----------
+        identifier : string
+            Unique object identifier
+        timestamp : datetime
+            Time stamp of object creation (UTC time)
+        properties : dict
+            Subset of object properties (contains at least the object name)
+        object_type : string
+            Type of the summarized object
+        experiment_id : string, optional
+            Identifier of the experiment a model run belongs to
+        fmri_data_id : string, optional
+            Identifier of the experiment fMRI data
+        state : RunStateSummary, optional
+            Model run state
+        """
+        super(ObjectSummary, self).__init__(identifier, timestamp, properties)
+        self.object_type = object_type
+        self.experiment_id = experiment_id
+        self.fmri_data_id = fmri_data_id
+        self.state = state
+
+    @property
+    def type(self):
+        """Type of the summarized object.
+
+        Returns
+        -------
+        string
+        """
+        return self.object_type
+
+
+class RunStateSummary(object):
+    """State of a model run in an object listing. Provides the state flags of
+    the model run state objects without the model output or error messages.
+    """
+    def __init__(self, state_type):
+        """Initialize the state type.
+
+        Parameters
+        ----------
+        state_type : string
+            Text representation of the model run state
+        """
+        self.state_type = state_type
+
+    @property
+    def is_failed(self):
+        """True, if model run is in failed state."""
+        return self.state_type == STATE_FAILED
+
+    @property
+    def is_idle(self):
+        """True, if model run is in idle state."""
+        return self.state_type == STATE_IDLE
+
+    @property
+    def is_running(self):
+        """True, if model run is in running state."""
+        return self.state_type == STATE_RUNNING
+
+    @property
+    def is_success(self):
+        """True, if model run is in success state."""
+        return self.state_type == STATE_SUCCESS
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def count_objects(store, query, count_mode):
+    """Count the total number of objects in a listing. Estimates are based
+    on the collection metadata, i.e., the query is ignored apart from the
+    active flag. Inactive objects are subtracted from the collection size.
+
+    Parameters
+    ----------
+    store : scodata.datastore.MongoDBStore
+        Object store
+    query : dict
+        Query for objects in the listing
+    count_mode : string
+        Mode for counting the objects
+
+    Returns
+    -------
+    int
+        None if the count mode is COUNT_NONE
+    """
+    if count_mode == COUNT_NONE:
+        return None
+    elif count_mode == COUNT_ESTIMATED:
+        collection = store.collection
+        if hasattr(collection, 'estimated_document_count'):
+            total = collection.estimated_document_count()
+        else:
+            # Older versions of pymongo use the collection metadata when
+            # counting without query
+            total = collection.count()
+        # Deleted objects remain in the collection with the active flag set to
+        # False. The metadata may be stale, i.e., the estimate is not allowed
+        # to become negative.
+        return max(0, total - collection.count({'active' : False}))
+    return store.collection.count(query)
+
+
+def decode_cursor(cursor):
+    """Get timestamp and object identifier that are encoded in a listing
+    cursor. Raises ValueError if the given value is not a valid cursor.
+
+    Parameters
+    ----------
+    cursor : string
+        Listing cursor
+
+    Returns
+    -------
+    (string, string)
+    """
+    try:
+        value = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor: ' + cursor)
+    # The cursor values are used in a database query, i.e., anything but a
+    # pair of strings (e.g., query operator documents) has to be rejected.
+    if not isinstance(value, list) or len(value) != 2:
+        raise ValueError('invalid cursor: ' + cursor)
+    for element in value:
+        if not isinstance(element, basestring):
+            raise ValueError('invalid cursor: ' + cursor)
+    timestamp, identifier = value
+    return timestamp, identifier
+
+
+def encode_cursor(document):
+    """Get cursor for the given object document.
+
+    Parameters
+    ----------
+    document : dict
+        Database document for object
+
+    Returns
+    -------
+    string
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps([document['timestamp'], document['_id']])
+    )
+
+
+def ensure_listing_index(store, query_keys=None):
+    """Create index that supports keyset pagination of listings for objects
+    in the given object store. Has no effect if the index exists.
+
+    Parameters
+    ----------
+    store : scodata.datastore.MongoDBStore
+        Object store
+    query_keys : list(string), optional
+        Additional keys that are used in listing queries for the store
+    """
+    keys = []
+    if not query_keys is None:
+        keys.extend([(key, pymongo.ASCENDING) for key in query_keys])
+    keys.extend([
+        ('active', pymongo.ASCENDING),
+        ('timestamp', pymongo.DESCENDING),
+        ('_id', pymongo.DESCENDING)
+    ])
+    store.collection.create_index(keys)
+
+
+def list_objects(store, object_type, limit=-1, offset=0, cursor=None, query=None, properties=None, count_mode=COUNT_EXACT):
+    """Get a page in the object listing for the given object store. The page
+    either starts at the given offset or after the object identified by the
+    cursor (if given). The page contains summaries for objects that only
+    include the requested properties.
+
+    Raises ValueError if the cursor is invalid.
+
+    Parameters
+    ----------
+    store : scodata.datastore.MongoDBStore
+        Object store
+    object_type : string
+        Type of objects in the object store
+    limit : int, optional
+        Limit number of items in the result set
+    offset : int, optional
+        Set offset in list. Ignored if cursor is given.
+    cursor : string, optional
+        Listing cursor or empty string for first page
+    query : dict, optional
+        Filter objects by property-value pairs defined by dictionary.
+    properties : list(string), optional
+        List of object properties to include in object summaries
+    count_mode : string, optional
+        Mode for counting the total number of objects in the listing
+
+    Returns
+    -------
+    ListingPage
+    """
+    # Build the document query for all objects in the listing
+    doc = {'active' : True}
+    if not query is None:
+        for key in query:
+            doc[key] = query[key]
+        # Collection metadata cannot be used to estimate the size of filtered
+        # listings. Fall back to counting the objects in the listing.
+        if count_mode == COUNT_ESTIMATED:
+            count_mode = COUNT_EXACT
+    total_count = count_objects(store, doc, count_mode)
+    # Restrict the query to objects following the object identified by the
+    # cursor (if given)
+    if not cursor is None:
+        offset = -1
+        if cursor != '':
+            timestamp, identifier = decode_cursor(cursor)
+            doc['$or'] = [
+                {'timestamp' : {'$lt' : timestamp}},
+                {'timestamp' : timestamp, '_id' : {'$lt' : identifier}}
+            ]
+    coll = store.collection.find(
+        doc,
+        summary_projection(object_type, properties)
+    ).sort([
+        ('timestamp', pymongo.DESCENDING),
+        ('_id', pymongo.DESCENDING)
+    ])
+    if offset > 0:
+        coll = coll.skip(offset)
+    # Retrieve one more document than requested to know whether there is a
+    # next page.
+    if limit >= 0:
+        coll = coll.limit(limit + 1)
+    documents = list(coll)
+    has_more = False
+    if limit >= 0 and len(documents) > limit:
+        documents = documents[:limit]
+        has_more = True
+    next_cursor = None
+    if not cursor is None and has_more and limit > 0:
+        next_cursor = encode_cursor(documents[-1])
+    return ListingPage(
+        [to_object_summary(document, object_type) for document in documents],
+        offset,
+        limit,
+        total_count,
+        count_mode,
+        has_more,
+        cursor=cursor,
+        next_cursor=next_cursor
+    )
+
+
+def parse_timestamp(value):
+    """Parse object timestamp in a database document.
+
+    Parameters
+    ----------
+    value : string
+        ISO representation of UTC timestamp
+
+    Returns
+    -------
+    datetime.datetime
+    """
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def set_run_counts(predictions, experiments):
+    """Set the run count property for the experiments in a listing page. Uses
+    a single aggregation on the model run collection that is restricted to the
+    experiments on the page.
+
+    Parameters
+    ----------
+    predictions : scodata.datastore.MongoDBStore
+        Model run store
+    experiments : list(ObjectSummary)
+        Experiment summaries in the listing page
+    """
+    pipeline = [
+        {'$match' : {
+            'active' : True,
+            'experiment' : {'$in' : [e.identifier for e in experiments]}
+        }},
+        {'$group' : {'_id' : '$experiment', 'count' : {'$sum' : 1}}}
+    ]
+    counts = {}
+    for doc in predictions.collection.aggregate(pipeline):
+        counts[doc['_id']] = doc['count']
+    for experiment in experiments:
+        if experiment.identifier in counts:
+            experiment.properties[PROPERTY_RUN_COUNT] = counts[experiment.identifier]
+        else:
+            experiment.properties[PROPERTY_RUN_COUNT] = 0
+
+
+def summary_projection(object_type, properties=None):
+    """Projection for database documents that contains the fields for object
+    summaries of the given type.
+
+    Parameters
+    ----------
+    object_type : string
+        Type of objects in the listing
+    properties : list(string), optional
+        List of object properties to include in object summaries
+
+    Returns
+    -------
+    dict
+    """
+    projection = {
+        '_id' : True,
+        'timestamp' : True,
+        'properties.' + PROPERTY_NAME : True
+    }
+    for field in SUMMARY_FIELDS[object_type]:
+        projection[field] = True
+    if not properties is None:
+        for prop in properties:
+            # Ignore property names that would be interpreted as paths or
+            # operators
+            if prop == '' or '.' in prop or prop.startswith('$'):
+                continue
+            projection['properties.' + prop] = True
+        # The size of image groups is derived from the list of group images
+        if object_type == TYPE_IMAGE_GROUP and PROPERTY_GROUPSIZE in properties:
+            projection['images.identifier'] = True
+    return projection
+
+
+def to_object_summary(document, object_type):
+    """Create an object summary from a projected database document.
+
+    Parameters
+    ----------
+    document : dict
+        Database document with the fields in the summary projection
+    object_type : string
+        Type of the summarized object
+
+    Returns
+    -------
+    ObjectSummary
+    """
+    properties = document['properties']
+    if 'images' in document:
+        properties[PROPERTY_GROUPSIZE] = len(document['images'])
+    state = None
+    if 'state' in document:
+        state = RunStateSummary(document['state']['type'])
+    return ObjectSummary(
+        str(document['_id']),
+        parse_timestamp(document['timestamp']),
+        properties,
+        object_type,
+        experiment_id=document['experiment'] if 'experiment' in document else None,
+        fmri_data_id=document['fmri'] if 'fmri' in document else None,
+        state=state
+    )
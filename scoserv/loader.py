@@ -0,0 +1,266 @@
+"""Composed resource loader - Fetches an object together with the objects it
+references in a single MongoDB round trip.
+
+Experiments reference a subject, an image group, and an optional functional
+data object. Model runs in addition reference their experiment. Instead of
+retrieving each of these objects separately from the data store, the loader
+joins the referenced documents using an aggregation pipeline ($lookup). Object
+handles are created from the retrieved documents using the respective data
+store managers. Requires MongoDB 3.4 or above.
+
+Callers can restrict the referenced objects that are joined. Objects that are
+not joined are None in the composed experiment.
+"""
+
+from scodata.funcdata import FMRIDataHandle
+
+
+"""Names of the experiment fields that reference other objects."""
+REF_FMRI = 'fmri'
+REF_IMAGES = 'images'
+REF_SUBJECT = 'subject'
+
+EXPERIMENT_REFS = [REF_SUBJECT, REF_IMAGES, REF_FMRI]
+
+
+class ComposedExperiment(object):
+    """Experiment handle together with the handles of the objects that are
+    referenced by the experiment. Subject and image group are None if the
+    referenced objects have been deleted or were not loaded. The functional
+    data object is None if the experiment has no fMRI data associated with it
+    or if it was not loaded.
+
+    Attributes
+    ----------
+    experiment : scodata.experiment.ExperimentHandle
+        Experiment handle
+    subject : scodata.subject.SubjectHandle
+        Handle for experiment subject
+    image_group : scodata.image.ImageGroupHandle
+        Handle for experiment image group
+    fmri : scodata.funcdata.FMRIDataHandle
+        Handle for experiment fMRI data
+    """
+    def __init__(self, experiment, subject, image_group, fmri):
+        """Initialize the object handles.
+
+        Parameters
+        ----------
+        experiment : scodata.experiment.ExperimentHandle
+            Experiment handle
+        subject : scodata.subject.SubjectHandle
+            Handle for experiment subject
+        image_group : scodata.image.ImageGroupHandle
+            Handle for experiment image group
+        fmri : scodata.funcdata.FMRIDataHandle
+            Handle for experiment fMRI data
+        """
+        self.experiment = experiment
+        self.subject = subject
+        self.image_group = image_group
+        self.fmri = fmri
+
+
+class ComposedResourceLoader(object):
+    """Loader for experiments and model runs including the objects that they
+    reference. Uses the collections and document parsers of the data store
+    managers.
+    """
+    def __init__(self, db):
+        """Initialize the data store.
+
+        Parameters
+        ----------
+        db : scodata.SCODataStore
+            SCO data store
+        """
+        self.db = db
+
+    def get_experiment(self, experiment_id, refs=None):
+        """Get experiment with given identifier together with its subject,
+        image group and fMRI data.
+
+        Parameters
+        ----------
+        experiment_id : string
+            Unique experiment identifier
+        refs : list(string), optional
+            Referenced objects that are loaded (default: all)
+
+        Returns
+        -------
+        ComposedExperiment
+            None if the experiment does not exist
+        """
+        pipeline = [{'$match' : {'_id' : experiment_id, 'active' : True}}]
+        pipeline.extend(self.experiment_lookups('', refs=refs))
+        for document in self.db.experiments.collection.aggregate(pipeline):
+            return self.to_composed_experiment(document)
+        return None
+
+    def get_model_run(self, experiment_id, run_id, refs=None):
+        """Get model run with given identifier together with the composed
+        experiment that it belongs to. The experiment document is always
+        joined to ensure that the experiment has not been deleted.
+
+        Parameters
+        ----------
+        experiment_id : string
+            Unique experiment identifier
+        run_id : string
+            Unique model run identifier
+        refs : list(string), optional
+            Objects referenced by the experiment that are loaded (default: all)
+
+        Returns
+        -------
+        (scodata.modelrun.ModelRunHandle, ComposedExperiment)
+            None if the model run does not exist or is not associated with the
+            given experiment.
+        """
+        pipeline = [
+            {'$match' : {
+                '_id' : run_id,
+                'experiment' : experiment_id,
+                'active' : True
+            }},
+            lookup(self.db.experiments, 'experiment', '_experiment')
+        ]
+        pipeline.extend(self.experiment_lookups('_experiment.', refs=refs))
+        for document in self.db.predictions.collection.aggregate(pipeline):
+            experiments = active_documents(document['_experiment'])
+            if len(experiments) == 0:
+                return None
+            model_run = self.db.predictions.from_dict(document)
+            # The experiment document is expected to be the only element in
+            # the joined list. Move joined documents into experiment document
+            # to be able to use the same conversion as for experiments.
+            experiment_doc = experiments[0]
+            for key in ['_subject', '_images', '_fmri']:
+                if key in document:
+                    experiment_doc[key] = document[key]
+            return model_run, self.to_composed_experiment(experiment_doc)
+        return None
+
+    def experiment_lookups(self, prefix, refs=None):
+        """List of pipeline stages that join the documents referenced by an
+        experiment.
+
+        Parameters
+        ----------
+        prefix : string
+            Path prefix for the experiment document in the pipeline
+        refs : list(string), optional
+            Referenced objects that are joined (default: all)
+
+        Returns
+        -------
+        list(dict)
+        """
+        stores = {
+            REF_SUBJECT : self.db.subjects,
+            REF_IMAGES : self.db.image_groups,
+            REF_FMRI : self.db.funcdata
+        }
+        return [
+            lookup(stores[ref], prefix + ref, '_' + ref)
+                for ref in EXPERIMENT_REFS
+                    if refs is None or ref in refs
+        ]
+
+    def to_composed_experiment(self, document):
+        """Create composed experiment from an experiment document that contains
+        the joined documents.
+
+        Parameters
+        ----------
+        document : dict
+            Experiment document with joined subject, image group, and fMRI
+            documents. Documents that were not joined are missing.
+
+        Returns
+        -------
+        ComposedExperiment
+        """
+        experiment = self.db.experiments.from_dict(document)
+        subject = None
+        for doc in joined_documents(document, REF_SUBJECT):
+            subject = self.db.subjects.from_dict(doc)
+        image_group = None
+        for doc in joined_documents(document, REF_IMAGES):
+            image_group = self.db.image_groups.from_dict(doc)
+        fmri = None
+        if not experiment.fmri_data_id is None:
+            for doc in joined_documents(document, REF_FMRI):
+                fmri = FMRIDataHandle(
+                    self.db.funcdata.from_dict(doc),
+                    experiment.identifier
+                )
+        return ComposedExperiment(experiment, subject, image_group, fmri)
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def active_documents(documents):
+    """Filter list of joined documents to include only active documents.
+
+    Parameters
+    ----------
+    documents : list(dict)
+        List of documents
+
+    Returns
+    -------
+    list(dict)
+    """
+    return [doc for doc in documents if doc['active']]
+
+
+def joined_documents(document, ref):
+    """Get the active documents that were joined for the given reference.
+    The result is empty if the referenced documents were not joined.
+
+    Parameters
+    ----------
+    document : dict
+        Experiment document
+    ref : string
+        Name of the reference field
+
+    Returns
+    -------
+    list(dict)
+    """
+    key = '_' + ref
+    if not key in document:
+        return []
+    return active_documents(document[key])
+
+
+def lookup(store, local_field, target):
+    """Pipeline stage that joins documents in the collection of the given
+    object store on their identifier.
+
+    Parameters
+    ----------
+    store : scodata.datastore.MongoDBStore
+        Object store for joined documents
+    local_field : string
+        Path to field in the input document that contains the identifier
+    target : string
+        Name of the array field for the joined documents
+
+    Returns
+    -------
+    dict
+    """
+    return {'$lookup' : {
+        'from' : store.collection.name,
+        'localField' : local_field,
+        'foreignField' : '_id',
+        'as' : target
+    }}
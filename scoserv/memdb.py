@@ -0,0 +1,50 @@
+"""In-memory MongoDB - Database connector for a MongoDB database that is kept
+in memory (using the mongomock library).
+
+The in-memory database is used by the benchmark suite and for local
+development without a MongoDB server. All components that are created with
+the same connector share the database. The data is lost when the process
+terminates and it is not shared between worker processes. The connector does
+not support change streams, i.e., it cannot be used with the mongo event
+backend. MongoDB command metrics are not recorded for the in-memory database.
+
+mongomock is not required by the server otherwise. It is only imported when
+the connector is created.
+"""
+
+
+class InMemoryMongoDBFactory(object):
+    """Replacement for scodata.mongo.MongoDBFactory that returns a database
+    of a single in-memory client.
+
+    Attributes
+    ----------
+    client : mongomock.MongoClient
+        In-memory MongoDB client
+    db_name : string
+        Name of the database
+    """
+    def __init__(self, db_name='scoserv'):
+        """Initialize the in-memory client and the database name. Raises
+        ValueError if the mongomock library is not installed.
+
+        Parameters
+        ----------
+        db_name : string, optional
+            Name of the database (default: scoserv)
+        """
+        try:
+            import mongomock
+        except ImportError:
+            raise ValueError('in-memory database requires package mongomock')
+        self.client = mongomock.MongoClient()
+        self.db_name = db_name
+
+    def get_database(self):
+        """Get the in-memory database.
+
+        Returns
+        -------
+        mongomock.Database
+        """
+        return self.client[self.db_name]
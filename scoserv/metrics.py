@@ -0,0 +1,219 @@
+"""Server metrics - Request, transfer, MongoDB, engine, and model cache metrics
+that are exported in the Prometheus text format.
+
+Metrics are collected with the Prometheus client library. When the server
+runs under a pool of worker processes (module wsgi) each worker writes its
+metrics to files in a shared directory and the metrics of all workers are
+aggregated when the metrics are exported. The directory is given by the
+environment variable PROMETHEUS_MULTIPROC_DIR. The variable has to be set
+before the Prometheus client library is imported by a worker process.
+Without the variable, metrics of the current process are exported.
+
+Request metrics are labeled with the Url rule of the route (e.g.,
+/experiments/<string:experiment_id>) instead of the request path to keep the
+number of label values bounded. Request durations and response sizes of
+streamed responses only cover the time until the response is returned by the
+request handler.
+"""
+
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import generate_latest, multiprocess, REGISTRY
+from prometheus_client import CONTENT_TYPE_LATEST
+from pymongo import monitoring
+
+
+"""Environment variables for the metrics directory of worker pools. Older
+versions of the Prometheus client library only read the lower case name."""
+ENV_MULTIPROC_DIR = ['PROMETHEUS_MULTIPROC_DIR', 'prometheus_multiproc_dir']
+
+"""Label for requests that do not match any route."""
+ROUTE_UNMATCHED = 'unmatched'
+
+
+# ------------------------------------------------------------------------------
+#
+# Metrics
+#
+# ------------------------------------------------------------------------------
+
+REQUEST_COUNT = Counter(
+    'sco_http_requests_total',
+    'Number of HTTP requests',
+    ['method', 'route', 'status']
+)
+
+REQUEST_LATENCY = Histogram(
+    'sco_http_request_duration_seconds',
+    'HTTP request duration in seconds',
+    ['method', 'route'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+RESPONSE_SIZE = Histogram(
+    'sco_http_response_size_bytes',
+    'HTTP response body size in bytes',
+    ['method', 'route'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000, 100000000, 1000000000)
+)
+
+REQUESTS_IN_PROGRESS = Gauge(
+    'sco_http_requests_in_progress',
+    'Number of HTTP requests in progress',
+    multiprocess_mode='livesum'
+)
+
+UPLOAD_BYTES = Counter(
+    'sco_upload_bytes_total',
+    'Number of bytes in uploaded files and upload session chunks'
+)
+
+DOWNLOAD_BYTES = Counter(
+    'sco_download_bytes_total',
+    'Number of bytes in file downloads sent by the server (excludes '
+    'downloads that are offloaded to the front-end proxy)'
+)
+
+MONGO_LATENCY = Histogram(
+    'sco_mongo_command_duration_seconds',
+    'MongoDB command duration in seconds',
+    ['command', 'status'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+)
+
+ENGINE_LATENCY = Histogram(
+    'sco_engine_call_duration_seconds',
+    'SCO engine call duration in seconds',
+    ['operation']
+)
+
+MODEL_CACHE_LOOKUPS = Counter(
+    'sco_model_cache_lookups_total',
+    'Number of model definition cache lookups',
+    ['result']
+)
+
+MODEL_CACHE_INVALIDATIONS = Counter(
+    'sco_model_cache_invalidations_total',
+    'Number of times the model definition cache was cleared after a model '
+    'was modified on this (local) or another (remote) node',
+    ['origin']
+)
+
+
+# ------------------------------------------------------------------------------
+#
+# MongoDB Command Listener
+#
+# ------------------------------------------------------------------------------
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Command listener that records the duration of MongoDB commands."""
+    def started(self, event):
+        """Ignore command started events.
+
+        Parameters
+        ----------
+        event : pymongo.monitoring.CommandStartedEvent
+        """
+        pass
+
+    def succeeded(self, event):
+        """Record duration of successful command.
+
+        Parameters
+        ----------
+        event : pymongo.monitoring.CommandSucceededEvent
+        """
+        MONGO_LATENCY.labels(event.command_name, 'success').observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event):
+        """Record duration of failed command.
+
+        Parameters
+        ----------
+        event : pymongo.monitoring.CommandFailedEvent
+        """
+        MONGO_LATENCY.labels(event.command_name, 'failed').observe(
+            event.duration_micros / 1e6
+        )
+
+
+# Flag to ensure that the command listener is registered only once
+_registered = False
+
+
+def register_mongo_metrics():
+    """Register the MongoDB command listener. Has to be called before any
+    MongoDB client is created. Has no effect if the listener has been
+    registered before.
+    """
+    global _registered
+    if not _registered:
+        monitoring.register(MongoCommandMetrics())
+        _registered = True
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def export_metrics():
+    """Get current metrics in Prometheus text format. Aggregates the metrics
+    of all worker processes if a metrics directory is set.
+
+    Returns
+    -------
+    (string, string)
+        Metrics text and content type
+    """
+    if not get_multiproc_dir() is None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def get_multiproc_dir():
+    """Get the metrics directory for worker pools from the environment.
+
+    Returns
+    -------
+    string
+        None if the variable is not set
+    """
+    for var in ENV_MULTIPROC_DIR:
+        if var in os.environ:
+            return os.environ[var]
+    return None
+
+
+def observe_request(method, route, status, duration, size):
+    """Record metrics for a finished request.
+
+    Parameters
+    ----------
+    method : string
+        HTTP method
+    route : string
+        Url rule of the route that handled the request (None if no route
+        matched the request)
+    status : int
+        Response status code
+    duration : float
+        Request duration in seconds
+    size : int
+        Response body size in bytes (None if unknown)
+    """
+    if route is None:
+        route = ROUTE_UNMATCHED
+    REQUEST_COUNT.labels(method, route, str(status)).inc()
+    REQUEST_LATENCY.labels(method, route).observe(duration)
+    if not size is None:
+        RESPONSE_SIZE.labels(method, route).observe(size)
@@ -0,0 +1,168 @@
+"""Model definition cache - Keep the handles of registered models in memory.
+
+Model definitions are needed whenever a model run is created or retrieved,
+when attachments are uploaded, and when a model is retrieved via the API.
+They change rarely (only when a model is registered, deleted, or updated).
+The cache keeps the model handles that have been read from the model registry
+in memory. The cache is cleared whenever a model is modified via the API.
+
+Models can also be modified by other worker processes or servers. Every
+modification increments a version counter in the database. The cache compares
+its version with the counter in the database at most once per check interval
+and is cleared if the counter has changed, i.e., modifications on other nodes
+become visible after at most the check interval. Modifications that bypass the
+API have to increment the counter explicitly (see increment_version()).
+
+Cache lookups (hit or miss) and cache invalidations (local or remote) are
+recorded in the server metrics.
+"""
+
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+from metrics import MODEL_CACHE_INVALIDATIONS, MODEL_CACHE_LOOKUPS
+
+
+"""Default number of seconds between checks of the version counter."""
+DEFAULT_CHECK_INTERVAL = 5
+
+"""Identifier of the version counter document."""
+VERSION_ID = 'models'
+
+"""Labels for cache metrics."""
+LOOKUP_HIT = 'hit'
+LOOKUP_MISS = 'miss'
+ORIGIN_LOCAL = 'local'
+ORIGIN_REMOTE = 'remote'
+
+
+class ModelCache(object):
+    """Cache for model handles that are read from the model registry. Unknown
+    models are not cached.
+
+    Attributes
+    ----------
+    check_interval : float
+        Seconds between checks of the version counter
+    collection : pymongo.Collection
+        Collection containing the version counter
+    engine : scoengine.SCOEngine
+        Engine that manages the model registry
+    models : dict(scoengine.model.ModelHandle)
+        Cached model handles by identifier
+    version : int
+        Version of the cached models
+    """
+    def __init__(self, engine, mongo, check_interval=DEFAULT_CHECK_INTERVAL):
+        """Initialize the engine and the version counter collection.
+
+        Parameters
+        ----------
+        engine : scoengine.SCOEngine
+            Engine that manages the model registry
+        mongo : scodata.MongoDBFactory
+            MongoDB connector
+        check_interval : float, optional
+            Seconds between checks of the version counter (0 to check on
+            every lookup)
+        """
+        self.engine = engine
+        self.collection = mongo.get_database().versions
+        self.check_interval = check_interval
+        self.models = {}
+        self.version = None
+        self.checked_at = None
+        # Lock for changes to the cached models and the version
+        self.lock = threading.Lock()
+
+    def get_model(self, model_id):
+        """Get handle for the model with the given identifier. Reads the model
+        from the model registry if it is not cached.
+
+        Parameters
+        ----------
+        model_id : string
+            Unique model identifier
+
+        Returns
+        -------
+        scoengine.model.ModelHandle
+            None if the model does not exist
+        """
+        self.validate()
+        with self.lock:
+            model = self.models[model_id] if model_id in self.models else None
+            version = self.version
+        if not model is None:
+            MODEL_CACHE_LOOKUPS.labels(LOOKUP_HIT).inc()
+            return model
+        MODEL_CACHE_LOOKUPS.labels(LOOKUP_MISS).inc()
+        model = self.engine.get_model(model_id)
+        if not model is None:
+            # Do not cache the model if the cache was cleared while the model
+            # was read. The model may be outdated in this case.
+            with self.lock:
+                if self.version == version:
+                    self.models[model_id] = model
+        return model
+
+    def invalidate(self):
+        """Clear the cache after a model has been modified. Increments the
+        version counter to notify the caches on other nodes.
+        """
+        version = increment_version(self.collection)
+        with self.lock:
+            self.models = {}
+            self.version = version
+            self.checked_at = time.time()
+        MODEL_CACHE_INVALIDATIONS.labels(ORIGIN_LOCAL).inc()
+
+    def validate(self):
+        """Clear the cache if the version counter in the database has changed.
+        The counter is read at most once per check interval.
+        """
+        now = time.time()
+        if not self.checked_at is None:
+            if now - self.checked_at < self.check_interval:
+                return
+        doc = self.collection.find_one({'_id' : VERSION_ID})
+        version = doc['version'] if not doc is None else 0
+        with self.lock:
+            if version != self.version:
+                # The cache is empty when the version is read for the first
+                # time. Count only invalidations of a filled cache.
+                if not self.version is None:
+                    MODEL_CACHE_INVALIDATIONS.labels(ORIGIN_REMOTE).inc()
+                self.models = {}
+                self.version = version
+            self.checked_at = now
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def increment_version(collection):
+    """Increment the model version counter.
+
+    Parameters
+    ----------
+    collection : pymongo.Collection
+        Collection containing the version counter
+
+    Returns
+    -------
+    int
+        New version
+    """
+    doc = collection.find_one_and_update(
+        {'_id' : VERSION_ID},
+        {'$inc' : {'version' : 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc['version']
@@ -0,0 +1,319 @@
+"""Monitoring of database round trips - Counts the number of commands that are
+sent to MongoDB by the current thread and the time spent waiting for them. The
+counter is reset at the start of each request, i.e., it reports the number of
+MongoDB round trips per request.
+
+The counter is a pymongo command listener. Listeners are only attached to
+clients that are created after the listener has been registered. Thus,
+register_query_counter() has to be called before any MongoDB client is
+created.
+
+In addition, calls to the components that are used by the server API (data
+store, engine, widget registry, resource loader) are counted and timed per
+request. The components are wrapped in proxies that record every method call
+in the per-thread request statistics. Calls to the object stores of the data
+store (e.g., db.experiments.exists_object) are recorded by nested proxies.
+Calls that bypass the proxies (e.g., direct access to a store's MongoDB
+collection) are only visible in the MongoDB command counts. A single API call
+(e.g., get experiment) may result in multiple component calls and each
+component call in multiple MongoDB commands.
+"""
+
+import threading
+import time
+
+from pymongo import monitoring
+
+
+class QueryCounter(monitoring.CommandListener):
+    """Command listener that counts MongoDB commands per thread. Commands are
+    issued and their events are published in the thread that handles the
+    request.
+    """
+    def __init__(self):
+        """Initialize the thread-local counter."""
+        self._local = threading.local()
+
+    @property
+    def duration(self):
+        """Time (in seconds) spent on commands that were issued by the current
+        thread since the last reset.
+
+        Returns
+        -------
+        float
+        """
+        return getattr(self._local, 'duration', 0.0)
+
+    @property
+    def count(self):
+        """Number of commands issued by the current thread since the last
+        reset.
+
+        Returns
+        -------
+        int
+        """
+        return getattr(self._local, 'count', 0)
+
+    def reset(self):
+        """Reset the counter for the current thread."""
+        self._local.count = 0
+        self._local.duration = 0.0
+
+    def started(self, event):
+        """Increment counter when a command is started.
+
+        Parameters
+        ----------
+        event : pymongo.monitoring.CommandStartedEvent
+        """
+        self._local.count = self.count + 1
+
+    def succeeded(self, event):
+        """Add duration of successful command.
+
+        Parameters
+        ----------
+        event : pymongo.monitoring.CommandSucceededEvent
+        """
+        self._local.duration = self.duration + event.duration_micros / 1e6
+
+    def failed(self, event):
+        """Add duration of failed command.
+
+        Parameters
+        ----------
+        event : pymongo.monitoring.CommandFailedEvent
+        """
+        self._local.duration = self.duration + event.duration_micros / 1e6
+
+
+class CallStatistics(object):
+    """Per-thread statistics of component calls. Calls are recorded by
+    component and method name.
+    """
+    def __init__(self):
+        """Initialize the thread-local statistics."""
+        self._local = threading.local()
+
+    @property
+    def calls(self):
+        """Dictionary of recorded calls for the current thread since the last
+        reset. Maps component.method to a [count, duration] pair.
+
+        Returns
+        -------
+        dict
+        """
+        calls = getattr(self._local, 'calls', None)
+        if calls is None:
+            calls = dict()
+            self._local.calls = calls
+        return calls
+
+    def components(self):
+        """Get number of calls and total duration (in seconds) per component
+        for the current thread.
+
+        Returns
+        -------
+        dict
+            Maps component name to a (count, duration) pair
+        """
+        result = dict()
+        for key, (count, duration) in self.calls.items():
+            component = key.split('.', 1)[0]
+            total = result.get(component, (0, 0.0))
+            result[component] = (total[0] + count, total[1] + duration)
+        return result
+
+    def record(self, component, method, duration):
+        """Record a call for the current thread.
+
+        Parameters
+        ----------
+        component : string
+            Component name
+        method : string
+            Name of the called method
+        duration : float
+            Call duration in seconds
+        """
+        key = component + '.' + method
+        stats = self.calls.get(key)
+        if stats is None:
+            self.calls[key] = [1, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+
+    def reset(self):
+        """Reset the statistics for the current thread."""
+        self._local.calls = dict()
+
+
+class InstrumentedProxy(object):
+    """Proxy for a server component that records calls of the component's
+    public methods. Attributes that are listed as nested are wrapped in
+    proxies as well. Their calls are recorded with the attribute name as
+    prefix (e.g., experiments.exists_object). Other attributes are returned
+    unchanged, i.e., calls on objects that are accessed via these attributes
+    are not recorded. The duration of each call can also be recorded in a
+    Prometheus histogram that is labeled with the method name.
+    """
+    def __init__(self, component, target, stats, latency=None, nested=None, prefix=''):
+        """Initialize the proxied component.
+
+        Parameters
+        ----------
+        component : string
+            Component name
+        target : object
+            Proxied component
+        stats : CallStatistics
+            Statistics that calls are recorded in
+        latency : prometheus_client.Histogram, optional
+            Histogram with a single label for the method name
+        nested : list(string), optional
+            Names of attributes whose method calls are recorded as well
+        prefix : string, optional
+            Prefix for recorded method names (used by nested proxies)
+        """
+        self._component = component
+        self._target = target
+        self._stats = stats
+        self._latency = latency
+        self._nested = nested if not nested is None else []
+        self._prefix = prefix
+        self._methods = dict()
+
+    def __getattr__(self, name):
+        """Get attribute of the proxied component. Public methods are wrapped
+        to record their calls.
+
+        Parameters
+        ----------
+        name : string
+            Attribute name
+
+        Returns
+        -------
+        any
+        """
+        method = self._methods.get(name)
+        if not method is None:
+            return method
+        attr = getattr(self._target, name)
+        if name in self._nested:
+            proxy = InstrumentedProxy(
+                self._component,
+                attr,
+                self._stats,
+                latency=self._latency,
+                prefix=self._prefix + name + '.'
+            )
+            self._methods[name] = proxy
+            return proxy
+        if name.startswith('_') or not callable(attr):
+            return attr
+        component = self._component
+        stats = self._stats
+        latency = self._latency
+        label = self._prefix + name
+        def method(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                duration = time.time() - start
+                stats.record(component, label, duration)
+                if not latency is None:
+                    latency.labels(label).observe(duration)
+        self._methods[name] = method
+        return method
+
+
+"""Global query counter that is shared by all MongoDB clients."""
+query_counter = QueryCounter()
+
+"""Global statistics of component calls."""
+call_stats = CallStatistics()
+
+# Flag to ensure that the query counter is registered only once
+_registered = False
+
+
+def register_query_counter():
+    """Register the global query counter as pymongo command listener. Has no
+    effect if the counter has been registered before.
+    """
+    global _registered
+    if not _registered:
+        monitoring.register(query_counter)
+        _registered = True
+
+
+def request_summary(method, path, route, status, duration):
+    """Get summary of the current request including the MongoDB commands and
+    component calls that were issued by the current thread. Used for the
+    slow-request log.
+
+    Parameters
+    ----------
+    method : string
+        HTTP method
+    path : string
+        Request path
+    route : string
+        Url rule of the route that handled the request (None if no route
+        matched the request)
+    status : int
+        Response status code
+    duration : float
+        Request duration in seconds
+
+    Returns
+    -------
+    dict
+    """
+    calls = call_stats.calls
+    return {
+        'method' : method,
+        'path' : path,
+        'route' : route,
+        'status' : status,
+        'durationMs' : round(duration * 1000, 3),
+        'queries' : query_counter.count,
+        'queryMs' : round(query_counter.duration * 1000, 3),
+        'calls' : {
+            key : {
+                'count' : calls[key][0],
+                'durationMs' : round(calls[key][1] * 1000, 3)
+            } for key in calls
+        }
+    }
+
+
+def server_timing():
+    """Get value for the Server-Timing response header that contains the
+    time spent on MongoDB commands and on calls of each component for the
+    current thread.
+
+    Returns
+    -------
+    string
+    """
+    metrics = [
+        'mongo;dur=%.3f;desc="%d queries"' % (
+            query_counter.duration * 1000,
+            query_counter.count
+        )
+    ]
+    components = call_stats.components()
+    for component in sorted(components):
+        count, duration = components[component]
+        metrics.append(
+            '%s;dur=%.3f;desc="%d calls"' % (component, duration * 1000, count)
+        )
+    return ', '.join(metrics)
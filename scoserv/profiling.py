@@ -0,0 +1,389 @@
+"""Live request profiling - Opt-in WSGI middleware that profiles a sample of
+requests with cProfile.
+
+A request is profiled if it is selected by the configured sample rate or if
+it carries a valid profiling token in the X-SCO-Profile header. Tokens have
+the form <expires>:<signature> where expires is a Unix timestamp and the
+signature is the HMAC-SHA256 of the expiry time using the configured secret.
+Tokens are created with create_token().
+
+Profiles are stored on disk in one sub-folder per endpoint (i.e., the name of
+the view function that handles the request). Only the most recent profiles
+are kept for each endpoint. The profiles for an endpoint are aggregated when
+they are retrieved. Only the code that is run by the view function is
+profiled. For streamed responses the time to produce the response body is not
+included.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import os
+import pstats
+import random
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from StringIO import StringIO
+
+from werkzeug.exceptions import HTTPException
+
+
+"""Request header for profiling tokens."""
+HEADER_PROFILE = 'X-SCO-Profile'
+
+"""WSGI environment key for the profiling token."""
+ENVIRON_PROFILE = 'HTTP_X_SCO_PROFILE'
+
+"""Default number of profiles that are kept per endpoint."""
+DEFAULT_KEEP = 100
+
+"""File suffix for stored profiles."""
+PROFILE_SUFFIX = '.prof'
+
+"""Endpoint name for requests that do not match any route."""
+ENDPOINT_UNMATCHED = 'unmatched'
+
+# Valid endpoint names
+RE_ENDPOINT = re.compile('^\w+$')
+
+
+class ProfileStore(object):
+    """Directory of request profiles. Profiles are grouped by endpoint.
+
+    Attributes
+    ----------
+    directory : string
+        Base directory for profiles
+    keep : int
+        Number of profiles that are kept per endpoint
+    """
+    def __init__(self, directory, keep=DEFAULT_KEEP):
+        """Initialize the profile directory. Creates the directory if it does
+        not exist.
+
+        Parameters
+        ----------
+        directory : string
+            Base directory for profiles
+        keep : int, optional
+            Number of profiles that are kept per endpoint
+        """
+        self.directory = os.path.abspath(directory)
+        self.keep = keep
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def add(self, endpoint, profile):
+        """Store profile for a request. Removes the oldest profiles if more
+        than the maximum number of profiles exist for the endpoint.
+
+        Parameters
+        ----------
+        endpoint : string
+            Endpoint that handled the request
+        profile : cProfile.Profile
+            Request profile
+        """
+        directory = os.path.join(self.directory, endpoint)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Directory created by another worker in the meantime
+                pass
+        filename = os.path.join(
+            directory,
+            '%.6f-%s%s' % (time.time(), uuid.uuid4().hex, PROFILE_SUFFIX)
+        )
+        # Write to a temporary file first to never expose partial profiles
+        profile.dump_stats(filename + '.tmp')
+        os.rename(filename + '.tmp', filename)
+        files = self.list_files(endpoint)
+        for outdated in files[:max(len(files) - self.keep, 0)]:
+            try:
+                os.remove(outdated)
+            except OSError:
+                pass
+
+    def aggregate(self, endpoint):
+        """Get aggregated statistics for all stored profiles of an endpoint.
+
+        Parameters
+        ----------
+        endpoint : string
+            Endpoint name
+
+        Returns
+        -------
+        pstats.Stats
+            None if no profiles exist for the endpoint
+        """
+        files = self.list_files(endpoint)
+        if len(files) == 0:
+            return None
+        stats = pstats.Stats(files[0], stream=StringIO())
+        for filename in files[1:]:
+            stats.add(filename)
+        return stats
+
+    def endpoints(self):
+        """List endpoints that have stored profiles.
+
+        Returns
+        -------
+        list(dict)
+            Endpoint name, number of profiles, and time of latest profile
+        """
+        result = []
+        for endpoint in sorted(os.listdir(self.directory)):
+            files = self.list_files(endpoint)
+            if len(files) > 0:
+                result.append({
+                    'endpoint' : endpoint,
+                    'count' : len(files),
+                    'latest' : os.path.basename(files[-1]).split('-')[0]
+                })
+        return result
+
+    def list_files(self, endpoint):
+        """Get profile files for an endpoint sorted by time. The result is
+        empty if the endpoint name is invalid.
+
+        Parameters
+        ----------
+        endpoint : string
+            Endpoint name
+
+        Returns
+        -------
+        list(string)
+        """
+        if not RE_ENDPOINT.match(endpoint):
+            return []
+        directory = os.path.join(self.directory, endpoint)
+        if not os.path.isdir(directory):
+            return []
+        return [
+            os.path.join(directory, f) for f in sorted(os.listdir(directory))
+                if f.endswith(PROFILE_SUFFIX)
+        ]
+
+    def write_aggregate(self, endpoint):
+        """Get aggregated profile for an endpoint in the binary format that
+        is read by pstats (e.g., for snakeviz or gprof2dot).
+
+        Parameters
+        ----------
+        endpoint : string
+            Endpoint name
+
+        Returns
+        -------
+        string
+            None if no profiles exist for the endpoint
+        """
+        stats = self.aggregate(endpoint)
+        if stats is None:
+            return None
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_dir, endpoint + PROFILE_SUFFIX)
+            stats.dump_stats(filename)
+            with open(filename, 'rb') as f:
+                return f.read()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def write_report(self, endpoint, sort='cumulative', limit=50):
+        """Get text report for the aggregated profile of an endpoint.
+
+        Parameters
+        ----------
+        endpoint : string
+            Endpoint name
+        sort : string, optional
+            Sort key (see pstats.Stats.sort_stats)
+        limit : int, optional
+            Number of functions in the report
+
+        Returns
+        -------
+        string
+            None if no profiles exist for the endpoint
+        """
+        stats = self.aggregate(endpoint)
+        if stats is None:
+            return None
+        stream = StringIO()
+        stats.stream = stream
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+class ProfilingMiddleware(object):
+    """WSGI middleware that profiles sampled requests."""
+    def __init__(self, app, url_map, store, rate=0.0, secret=None):
+        """Initialize the wrapped application and the sampling parameters.
+
+        Parameters
+        ----------
+        app : WSGI application
+            Wrapped application
+        url_map : werkzeug.routing.Map
+            Url map of the application. Used to determine the endpoint for
+            a request.
+        store : ProfileStore
+            Store for request profiles
+        rate : float, optional
+            Fraction of requests that are profiled
+        secret : string, optional
+            Secret for profiling tokens. Tokens are not accepted if None.
+        """
+        self.app = app
+        self.url_map = url_map
+        self.store = store
+        self.rate = rate
+        self.secret = secret
+
+    def __call__(self, environ, start_response):
+        """Call the wrapped application. Profiles the call if the request is
+        sampled.
+
+        Parameters
+        ----------
+        environ : dict
+            WSGI environment
+        start_response : func
+            WSGI start response function
+
+        Returns
+        -------
+        iterable
+        """
+        if not self.is_sampled(environ):
+            return self.app(environ, start_response)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return self.app(environ, start_response)
+        finally:
+            profile.disable()
+            self.store.add(self.get_endpoint(environ), profile)
+
+    def get_endpoint(self, environ):
+        """Get endpoint for the request.
+
+        Parameters
+        ----------
+        environ : dict
+            WSGI environment
+
+        Returns
+        -------
+        string
+        """
+        try:
+            endpoint, _ = self.url_map.bind_to_environ(environ).match()
+            return endpoint
+        except HTTPException:
+            return ENDPOINT_UNMATCHED
+
+    def is_sampled(self, environ):
+        """Test whether the request is profiled.
+
+        Parameters
+        ----------
+        environ : dict
+            WSGI environment
+
+        Returns
+        -------
+        bool
+        """
+        if ENVIRON_PROFILE in environ and not self.secret is None:
+            if verify_token(self.secret, environ[ENVIRON_PROFILE]):
+                return True
+        return self.rate > 0 and random.random() < self.rate
+
+
+def create_token(secret, ttl=300):
+    """Create profiling token that is valid for the given number of seconds.
+
+    Parameters
+    ----------
+    secret : string
+        Profiling secret
+    ttl : int, optional
+        Seconds the token is valid
+
+    Returns
+    -------
+    string
+    """
+    expires = str(int(time.time()) + ttl)
+    return expires + ':' + sign(secret, expires)
+
+
+def sign(secret, value):
+    """Compute HMAC-SHA256 signature for the given value.
+
+    Parameters
+    ----------
+    secret : string
+        Profiling secret
+    value : string
+        Signed value
+
+    Returns
+    -------
+    string
+    """
+    return hmac.new(str(secret), str(value), hashlib.sha256).hexdigest()
+
+
+def verify_token(secret, token):
+    """Test whether the given profiling token is valid and has not expired.
+
+    Parameters
+    ----------
+    secret : string
+        Profiling secret
+    token : string
+        Profiling token
+
+    Returns
+    -------
+    bool
+    """
+    pos = token.find(':')
+    if pos < 0:
+        return False
+    expires, signature = token[:pos], token[pos+1:]
+    try:
+        if int(expires) < time.time():
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(str(sign(secret, expires)), str(signature))
+
+
+# ------------------------------------------------------------------------------
+#
+# Main
+#
+# ------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    # Print profiling token for the secret in the server configuration.
+    # Usage: python profiling.py [<ttl>]
+    import sys
+    from config import read_config
+    config = read_config()
+    if not 'profiling.secret' in config:
+        print 'no profiling secret in server configuration'
+        sys.exit(1)
+    ttl = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    print create_token(config['profiling.secret'], ttl=ttl)
@@ -0,0 +1,228 @@
+"""Model run result cache - Reuse the results of model runs with identical
+inputs.
+
+The inputs of a model run are the model, the subject, image group, and fMRI
+data of the experiment, and the run arguments. Arguments that are not given
+are replaced by the default value of the respective model parameter. The model
+is identified by its parameters, its connector, and its registration time,
+i.e., runs are not reused after a model has been
+re-registered or its connector has been updated. A
+fingerprint (SHA-256) of the canonical Json serialization of the inputs is
+recorded for each model run that is created while the cache is enabled. The
+entry is marked as successful when the run finishes successfully and removed
+when the run fails or is deleted.
+
+When a new model run has the same fingerprint as a successful run, the new
+run is set to success immediately. It references the functional data object
+of the existing run and its attachment files are hard links to the files of
+the existing run. The run is not dispatched to the workers.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import pymongo
+
+from scodata.modelrun import ModelRunSuccess
+
+
+class RunCache(object):
+    """Collection of fingerprints for model runs. The identifier of a cache
+    entry is the identifier of the model run.
+    """
+    def __init__(self, mongo):
+        """Initialize the MongoDB collection for cache entries.
+
+        Parameters
+        ----------
+        mongo : scodata.MongoDBFactory
+            MongoDB connector
+        """
+        self.collection = mongo.get_database().runcache
+        self.collection.create_index([
+            ('fingerprint', pymongo.ASCENDING),
+            ('success', pymongo.ASCENDING)
+        ])
+
+    def add(self, model_run, fingerprint, success=False):
+        """Record the fingerprint for a new model run.
+
+        Parameters
+        ----------
+        model_run : scodata.modelrun.ModelRunHandle
+            Handle for model run
+        fingerprint : string
+            Fingerprint of model run inputs
+        success : bool, optional
+            Flag indicating whether the run has finished successfully
+        """
+        self.collection.replace_one(
+            {'_id' : model_run.identifier},
+            {
+                'fingerprint' : fingerprint,
+                'experiment' : model_run.experiment_id,
+                'success' : success,
+                'createdAt' : datetime.datetime.utcnow()
+            },
+            upsert=True
+        )
+
+    def delete(self, run_id):
+        """Remove the cache entry for a model run (if it exists).
+
+        Parameters
+        ----------
+        run_id : string
+            Unique model run identifier
+        """
+        self.collection.delete_one({'_id' : run_id})
+
+    def find(self, db, fingerprint):
+        """Get a successful model run with the given fingerprint. Entries for
+        runs that have been deleted or that are no longer in success state are
+        removed.
+
+        Parameters
+        ----------
+        db : scodata.SCODataStore
+            SCO data store
+        fingerprint : string
+            Fingerprint of model run inputs
+
+        Returns
+        -------
+        scodata.modelrun.ModelRunHandle
+            None if no successful run with the fingerprint exists
+        """
+        entries = self.collection.find(
+            {'fingerprint' : fingerprint, 'success' : True}
+        ).sort('createdAt', pymongo.ASCENDING)
+        for entry in entries:
+            model_run = db.experiments_predictions_get(
+                entry['experiment'],
+                entry['_id']
+            )
+            if not model_run is None and model_run.state.is_success:
+                return model_run
+            self.delete(entry['_id'])
+        return None
+
+    def set_success(self, run_id):
+        """Mark the cache entry for a model run as successful.
+
+        Parameters
+        ----------
+        run_id : string
+            Unique model run identifier
+        """
+        self.collection.update_one(
+            {'_id' : run_id},
+            {'$set' : {'success' : True}}
+        )
+
+
+def copy_result(db, source, target):
+    """Set the target model run to success using the result and attachments
+    of the source run. Attachment files are hard linked (copied if the link
+    cannot be created).
+
+    Parameters
+    ----------
+    db : scodata.SCODataStore
+        SCO data store
+    source : scodata.modelrun.ModelRunHandle
+        Handle for successful model run
+    target : scodata.modelrun.ModelRunHandle
+        Handle for idle model run
+
+    Returns
+    -------
+    scodata.modelrun.ModelRunHandle
+        Handle for updated target model run
+    """
+    db.experiments_predictions_update_state_active(
+        target.experiment_id,
+        target.identifier
+    )
+    model_run = db.predictions.update_state(
+        target.identifier,
+        ModelRunSuccess(source.state.model_output)
+    )
+    if len(source.attachments) > 0:
+        for resource_id in source.attachments:
+            src_dir = os.path.join(source.directory, resource_id)
+            if os.path.isdir(src_dir):
+                link_tree(src_dir, os.path.join(model_run.directory, resource_id))
+            model_run.attachments[resource_id] = source.attachments[resource_id]
+        db.predictions.replace_object(model_run)
+    return model_run
+
+
+def fingerprint(model, experiment, arguments):
+    """Compute the fingerprint of the inputs of a model run.
+
+    Parameters
+    ----------
+    model : scoengine.model.ModelHandle
+        Handle for the model that is run
+    experiment : scodata.experiment.ExperimentHandle
+        Handle for the experiment of the model run
+    arguments : dict(scodata.attribute.Attribute)
+        Model run arguments
+
+    Returns
+    -------
+    string
+    """
+    values = {}
+    for para in model.parameters:
+        if not para.default is None:
+            values[para.identifier] = para.default
+    for name in arguments:
+        values[name] = arguments[name].value
+    inputs = {
+        'model' : model.identifier,
+        # Outputs and parameters can only change by re-registering the model
+        # (i.e., with a new registration time). The connector can be updated.
+        'definition' : {
+            'registered' : str(model.timestamp),
+            'parameters' : [para.to_dict() for para in model.parameters],
+            'connector' : model.connector
+        },
+        'subject' : experiment.subject_id,
+        'images' : experiment.image_group_id,
+        'fmri' : experiment.fmri_data_id,
+        'arguments' : sorted([[name, values[name]] for name in values])
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+    ).hexdigest()
+
+
+def link_tree(src_dir, dst_dir):
+    """Replicate a directory using hard links for all files. Files are copied
+    if they cannot be linked (e.g., across file systems).
+
+    Parameters
+    ----------
+    src_dir : string
+        Source directory
+    dst_dir : string
+        Target directory. Will be replaced if it exists.
+    """
+    if os.path.exists(dst_dir):
+        shutil.rmtree(dst_dir)
+    for root, dirs, files in os.walk(src_dir):
+        target = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for filename in files:
+            src = os.path.join(root, filename)
+            dst = os.path.join(target, filename)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
@@ -1,16 +1,36 @@
 #!venv/bin/python
+import hmac
+import logging
 import os
+import json
 import shutil
 import tempfile
-import urllib2
-import yaml
+import time
 
-from flask import Flask, jsonify, make_response, request, send_file
+from flask import Flask, Response, g, make_response, request
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-
-from api import SCOServerAPI
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
+from werkzeug.http import parse_content_range_header
+from werkzeug.wsgi import DispatcherMiddleware
+
+from api import SCOServerAPI, EXPERIMENT_EXPAND, EXPERIMENT_FIELDS
+from api import PREDICTION_EXPAND, PREDICTION_FIELDS
+from batch import ModelRunSpec, expand_grid
+from config import read_config, ENV_PREFORK
+from download import DownloadOffload, OFFLOAD_NONE, send_download
+from download import content_disposition
+from encoding import JsonEncoder, MessagePackEncoder, MessagePackRequestMixin
+from encoding import ResponseCompressor, ResponseEncoder, ENCODER_JSON
+from encoding import DEFAULT_BROTLI_QUALITY, DEFAULT_GZIP_LEVEL, DEFAULT_MIN_SIZE
+from events import event_stream, StreamLimitExceeded, DEFAULT_KEEPALIVE
+from events import DEFAULT_STREAM_TIMEOUT
 import hateoas
+from listing import decode_cursor, COUNT_EXACT, COUNT_MODES
+from metrics import REQUESTS_IN_PROGRESS, export_metrics, observe_request
+from monitor import call_stats, query_counter, request_summary, server_timing
+from profiling import ProfileStore, ProfilingMiddleware, verify_token, DEFAULT_KEEP, HEADER_PROFILE
+from upload import StreamingUploadRequest, UploadConflictError, HEADER_CHECKSUM
+from upload import save_upload_file, set_upload_directory
 
 # ------------------------------------------------------------------------------
 #
@@ -18,17 +38,20 @@ import hateoas
 #
 # ------------------------------------------------------------------------------
 
-"""Environment Variable containing path to config file. If not set will try
-file config.yaml in working directory.
-"""
-ENV_CONFIG = 'SCOSERVER_CONFIG'
-
-"""Url to default configuration file on GitHub."""
-WEB_CONFIG_FILE_URI = 'https://raw.githubusercontent.com/heikomuller/sco-server/master/config/config.yaml'
-
 """Number of elements in object listings if limit is not specified in request"""
 DEFAULT_LISTING_SIZE = 10
 
+"""Response header containing the number of MongoDB round trips (debug mode)."""
+HEADER_QUERY_COUNT = 'X-SCO-Query-Count'
+
+"""Response header containing the time spent on MongoDB commands in
+milliseconds (debug mode)."""
+HEADER_QUERY_TIME = 'X-SCO-Query-Time'
+
+"""Default threshold in seconds for requests that are written to the
+slow-request log."""
+DEFAULT_SLOW_REQUEST_THRESHOLD = 1.0
+
 
 # -----------------------------------------------------------------------------
 #
@@ -45,6 +68,13 @@ DEFAULT_LISTING_SIZE = 10
 # server.port: Port the server is running on
 # server.datadir : Path to base directory for data store
 # server.logfile : Path to server log file
+# server.slowlog : Path to slow-request log file (optional, default:
+#                  <server.logfile without extension>.slow.log)
+# server.slowrequest : Requests that take at least this many seconds are
+#                      written to the slow-request log (optional, default: 1.0)
+# server.uploaddir : Directory for streamed file uploads. Should be on the same
+#                    file system as the data store (optional, default:
+#                    <server.datadir>/uploads)
 #
 # app.name : Application name for the service description
 # app.title : Application title for service description (used a page title in UI)
@@ -55,23 +85,86 @@ DEFAULT_LISTING_SIZE = 10
 # home.content : Html snippet containing the Web UI homepage content
 #
 # doc.pages: List of content pages for the information menu
+# pages.ttl: Seconds a cached content page body is considered fresh (optional,
+#            default: 300)
+# uploads.ttl: Seconds a resumable upload session without activity is kept
+#              (optional, default: 86400)
+# engine.dispatch: Dispatch model runs asynchronously via the outbox (outbox)
+#                  or within the request (sync) (optional, default: outbox)
+# engine.dispatch.interval: Seconds between outbox polls (optional, default: 5)
+# engine.dispatch.attempts: Number of publish attempts before a model run is
+#                           set to failed (optional, default: 5)
+# engine.broker: Set to inprocess to keep dispatched runs in memory instead of
+#                publishing them to the engine (optional, for testing only)
+# events.backend: Deliver model run state events within the worker process
+#                 (local) or between processes via a MongoDB change stream
+#                 (mongo, requires a replica set) (optional, default: local)
+# events.keepalive: Seconds between keep-alive comments in event streams
+#                   (optional, default: 15)
+# events.timeout: Seconds before an event stream is closed by the server
+#                 (optional, default: 300)
+# events.maxstreams: Maximum number of open event streams per process. Further
+#                    streams are rejected with 503 (optional, default: half of
+#                    server.threads under the worker pool, unlimited otherwise)
+# engine.dedup: Reuse results of successful model runs with identical inputs
+#               instead of dispatching new runs (optional, default: false)
+# downloads.offload: Offload file downloads to the front-end proxy. One of
+#                    none, x-accel-redirect, or x-sendfile (optional,
+#                    default: none)
+# downloads.prefix: Internal proxy location that is mapped to server.datadir
+#                   (x-accel-redirect only, optional, default: /)
+# profiling.rate: Fraction of requests that are profiled (optional, default: 0)
+# profiling.secret: Secret for signed profiling tokens. Requests with a valid
+#                   token in header X-SCO-Profile are always profiled. The
+#                   token is also required for the profile admin endpoints
+#                   (optional, default: none)
+# profiling.dir: Directory for request profiles. Should be outside of
+#                server.datadir (optional, default:
+#                <tmp>/sco-profiles-<server.port>)
+# profiling.keep: Number of profiles kept per endpoint (optional,
+#                 default: 100)
+# models.cache.interval: Seconds between checks for model changes on other
+#                        nodes. Cached model definitions are cleared if models
+#                        were changed (optional, default: 5)
+# mongo.inmemory: Keep the database in memory instead of using the MongoDB
+#                 server. Requires mongomock. For benchmarks and local
+#                 development with a single worker only (optional,
+#                 default: false)
+# json.encoder: Json library for response bodies. One of json, simplejson, or
+#               ujson (optional, default: json)
+# msgpack.enabled: Accept MessagePack request bodies and return MessagePack
+#                  responses to clients that request them. Requires package
+#                  msgpack (optional, default: true if msgpack is installed)
+# compression.enabled: Compress response bodies if the client accepts gzip or
+#                      brotli encoding (optional, default: true)
+# compression.encodings: Comma-separated list of content codings in order of
+#                        preference (br requires package brotli) (optional,
+#                        default: br,gzip if brotli is installed, else gzip)
+# compression.minsize: Minimum size in bytes of compressed response bodies
+#                      (optional, default: 1024)
+# compression.gziplevel: Gzip compression level 1-9 (optional, default: 6)
+# compression.brotliquality: Brotli compression quality 0-11 (optional,
+#                            default: 4)
+# metrics.token: Bearer token that is required to access the metrics endpoint
+#                (optional, default: none, i.e., the endpoint is public and
+#                has to be protected by the firewall or front-end proxy)
+#
+# The following parameters are only used when the server is run by the
+# production entry point in module wsgi (all optional):
+#
+# server.errorlog : Path to the Gunicorn error log file (default:
+#                   <server.logfile without extension>.gunicorn.log)
+# server.workers : Number of worker processes (default: 2 * #CPUs + 1)
+# server.threads : Number of request threads per worker process (default: 8)
+# server.timeout : Seconds before a silent worker is killed and restarted
+#                  (default: 30)
+# metrics.dir : Directory for the metrics of the worker processes (default:
+#               <tmp>/sco-metrics-<server.port>)
 #
 # The file is expected to contain a Json object with a single element
 # 'properties' that is an array of key, value pair objects representing the
-# configuration parameters.
-LOCAL_CONFIG_FILE = os.getenv(ENV_CONFIG)
-if not LOCAL_CONFIG_FILE is None and os.path.isfile(LOCAL_CONFIG_FILE):
-    with open(LOCAL_CONFIG_FILE, 'r') as f:
-        obj = yaml.load(f.read())
-elif os.path.isfile('./config.yaml'):
-    with open('./config.yaml', 'r') as f:
-        obj = yaml.load(f.read())
-elif os.path.isfile('/var/sco/config/config.yaml'):
-    with open('/var/sco/config/config.yaml', 'r') as f:
-        obj = yaml.load(f.read())
-else:
-    obj = yaml.load(urllib2.urlopen(WEB_CONFIG_FILE_URI).read())
-config = {item['key']:item['value'] for item in obj['properties']}
+# configuration parameters (see config.read_config() for the lookup order).
+config = read_config()
 
 # App Path and Url
 APP_PATH = config['server.apppath']
@@ -87,6 +180,61 @@ DEBUG = config['app.debug']
 # Log file
 LOG_FILE = os.path.abspath(config['server.logfile'])
 
+# Slow-request log file and threshold
+if 'server.slowlog' in config:
+    SLOW_REQUEST_LOG_FILE = os.path.abspath(config['server.slowlog'])
+else:
+    SLOW_REQUEST_LOG_FILE = os.path.splitext(LOG_FILE)[0] + '.slow.log'
+if 'server.slowrequest' in config:
+    SLOW_REQUEST_THRESHOLD = config['server.slowrequest']
+else:
+    SLOW_REQUEST_THRESHOLD = DEFAULT_SLOW_REQUEST_THRESHOLD
+
+# Offload file downloads to the front-end proxy
+DOWNLOAD_OFFLOAD = DownloadOffload(
+    config['downloads.offload'] if 'downloads.offload' in config else OFFLOAD_NONE,
+    config['server.datadir'],
+    prefix=config['downloads.prefix'] if 'downloads.prefix' in config else '/'
+)
+
+# Access token for the metrics endpoint
+METRICS_TOKEN = config['metrics.token'] if 'metrics.token' in config else None
+
+# Request profiling is enabled if a sample rate or a secret is given
+PROFILING_RATE = config['profiling.rate'] if 'profiling.rate' in config else 0.0
+PROFILING_SECRET = config['profiling.secret'] if 'profiling.secret' in config else None
+PROFILING_ENABLED = PROFILING_RATE > 0 or not PROFILING_SECRET is None
+
+# Encoders for response bodies. Responses are MessagePack if requested by the
+# client and enabled, otherwise Json.
+JSON_ENCODER = JsonEncoder(
+    config['json.encoder'] if 'json.encoder' in config else ENCODER_JSON
+)
+if 'msgpack.enabled' in config:
+    MSGPACK_ENCODER = MessagePackEncoder() if config['msgpack.enabled'] else None
+else:
+    try:
+        MSGPACK_ENCODER = MessagePackEncoder()
+    except ValueError:
+        MSGPACK_ENCODER = None
+RESPONSE_ENCODER = ResponseEncoder(JSON_ENCODER, msgpack_encoder=MSGPACK_ENCODER)
+jsonify = RESPONSE_ENCODER.jsonify
+
+# Compression of response bodies. Responses are not compressed if disabled.
+if 'compression.enabled' in config and not config['compression.enabled']:
+    COMPRESSOR = None
+else:
+    COMPRESSOR = ResponseCompressor(
+        encodings=config['compression.encodings'].split(',') if 'compression.encodings' in config else None,
+        min_size=config['compression.minsize'] if 'compression.minsize' in config else DEFAULT_MIN_SIZE,
+        brotli_quality=config['compression.brotliquality'] if 'compression.brotliquality' in config else DEFAULT_BROTLI_QUALITY,
+        gzip_level=config['compression.gziplevel'] if 'compression.gziplevel' in config else DEFAULT_GZIP_LEVEL
+    )
+
+# Keep-alive interval and maximum duration of event streams
+EVENTS_KEEPALIVE = config['events.keepalive'] if 'events.keepalive' in config else DEFAULT_KEEPALIVE
+EVENTS_TIMEOUT = config['events.timeout'] if 'events.timeout' in config else DEFAULT_STREAM_TIMEOUT
+
 # ------------------------------------------------------------------------------
 # Initialization
 # ------------------------------------------------------------------------------
@@ -94,12 +242,94 @@ LOG_FILE = os.path.abspath(config['server.logfile'])
 # Initialize the server API
 api = SCOServerAPI(config, BASE_URL)
 
+# Start the outbox dispatcher thread. The app is loaded by each worker process
+# after it has been forked (see module wsgi), i.e., every worker dispatches
+# outbox entries of earlier runs even if it does not create new model runs.
+if not api.dispatcher is None:
+    api.dispatcher.start()
+
 # Create the app and enable cross-origin resource sharing
 app = Flask(__name__)
 app.config['APPLICATION_ROOT'] = APP_PATH
 app.config['DEBUG'] = DEBUG
 CORS(app)
 
+# Stream uploaded files directly into the upload directory and decode
+# MessagePack request bodies
+class SCORequest(MessagePackRequestMixin, StreamingUploadRequest):
+    """Flask request for the app. Request bodies in MessagePack format are
+    decoded if MessagePack is enabled.
+    """
+    msgpack = MSGPACK_ENCODER
+
+app.request_class = SCORequest
+set_upload_directory(api.upload_dir)
+
+# Switch logging on if not in debug mode. If the server is run by a pool of
+# worker processes (module wsgi) all workers append to the same log file. The
+# workers cannot rotate the shared file. They reopen the file if it has been
+# moved, i.e., the log has to be rotated externally (e.g., logrotate).
+if app.debug is not True:
+    if os.environ.get(ENV_PREFORK) == 'true':
+        file_handler = WatchedFileHandler(LOG_FILE)
+    else:
+        file_handler = RotatingFileHandler(
+            LOG_FILE,
+            maxBytes=1024 * 1024 * 100,
+            backupCount=20
+        )
+    file_handler.setLevel(logging.ERROR)
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    file_handler.setFormatter(formatter)
+    app.logger.addHandler(file_handler)
+
+# Requests that take longer than the threshold are logged as Json objects
+# (one per line) in the slow-request log. The log file is shared by all worker
+# processes. Workers only append to the file and reopen it if it has been
+# moved, i.e., the log has to be rotated externally (e.g., logrotate).
+slow_request_logger = logging.getLogger('scoserv.slowrequests')
+slow_request_logger.setLevel(logging.WARNING)
+slow_request_logger.propagate = False
+slow_request_handler = WatchedFileHandler(SLOW_REQUEST_LOG_FILE)
+slow_request_handler.setFormatter(
+    logging.Formatter('{"timestamp": "%(asctime)s", "request": %(message)s}')
+)
+slow_request_logger.addHandler(slow_request_handler)
+
+# Profile sampled requests
+if PROFILING_ENABLED:
+    if 'profiling.dir' in config:
+        profiling_dir = config['profiling.dir']
+    else:
+        profiling_dir = os.path.join(
+            tempfile.gettempdir(),
+            'sco-profiles-' + str(SERVER_PORT)
+        )
+    profiles = ProfileStore(
+        profiling_dir,
+        keep=config['profiling.keep'] if 'profiling.keep' in config else DEFAULT_KEEP
+    )
+    app.wsgi_app = ProfilingMiddleware(
+        app.wsgi_app,
+        app.url_map,
+        profiles,
+        rate=PROFILING_RATE,
+        secret=PROFILING_SECRET
+    )
+else:
+    profiles = None
+
+# WSGI application that serves the app at APPLICATION_ROOT. Loads a dummy app
+# at the root URL to give 404 errors.
+# Relevant documents:
+# http://werkzeug.pocoo.org/docs/middlewares/
+# http://flask.pocoo.org/docs/patterns/appdispatch/
+application = DispatcherMiddleware(Flask('dummy_app'), {
+    app.config['APPLICATION_ROOT']: app,
+})
+
 
 # ------------------------------------------------------------------------------
 #
@@ -119,6 +349,23 @@ def index():
     return jsonify(api.service_description())
 
 
+@app.route('/metrics')
+def metrics():
+    """Metrics (GET) - Server metrics in Prometheus text format. Includes the
+    metrics of all worker processes. Requires the metrics token (if
+    configured) in the Authorization header.
+    """
+    if not METRICS_TOKEN is None:
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(
+            str(authorization),
+            'Bearer ' + str(METRICS_TOKEN)
+        ):
+            raise AccessDenied('missing or invalid metrics token')
+    data, content_type = export_metrics()
+    return Response(data, content_type=content_type)
+
+
 # ------------------------------------------------------------------------------
 # Experiments
 # ------------------------------------------------------------------------------
@@ -133,7 +380,13 @@ def experiments_list():
     offset, limit, prop_set = get_listing_arguments(request)
     # Decorate experiment listing and return Json object
     return jsonify(
-        api.experiments_list(limit=limit, offset=offset, properties=prop_set)
+        api.experiments_list(
+            limit=limit,
+            offset=offset,
+            properties=prop_set,
+            cursor=get_listing_cursor(request),
+            count_mode=get_listing_count(request)
+        )
     )
 
 
@@ -166,9 +419,19 @@ def experiments_create():
 def experiments_get(experiment_id):
     """Get experiment (GET) - Retrieve an experiment object from the database.
     """
+    # Get the selected fields and expanded references.
+    fields, expand = get_composition_arguments(
+        request,
+        EXPERIMENT_FIELDS,
+        EXPERIMENT_EXPAND
+    )
     # Get experiment object from database. Raise exception if experiment does
     # not exist.
-    experiment = api.experiments_get(experiment_id)
+    experiment = api.experiments_get(
+        experiment_id,
+        fields=fields,
+        expand=expand
+    )
     if experiment is None:
         raise ResourceNotFound(experiment_id)
     else:
@@ -358,15 +621,20 @@ def experiments_predictions_list(experiment_id):
     # Get listing arguments. Method raises exception if argument values are
     # of invalid type
     offset, limit, prop_set = get_listing_arguments(request)
-    # Decorate prediction listing and return Json object
-    return jsonify(
-        api.experiments_predictions_list(
-            experiment_id,
-            limit=limit,
-            offset=offset,
-            properties=prop_set
-        )
+    # Get prediction listing. Return 404 if result is None, i.e., experiment
+    # is unknown
+    listing = api.experiments_predictions_list(
+        experiment_id,
+        limit=limit,
+        offset=offset,
+        properties=prop_set,
+        cursor=get_listing_cursor(request),
+        count_mode=get_listing_count(request)
     )
+    if listing is None:
+        raise ResourceNotFound(experiment_id)
+    # Return decorated prediction listing as Json object
+    return jsonify(listing)
 
 
 @app.route('/experiments/<string:experiment_id>/predictions', methods=['POST'])
@@ -401,20 +669,129 @@ def experiments_predictions_create(experiment_id):
         # The result is None if experiment does not exists
         if result is None:
             raise ResourceNotFound(experiment_id)
-        # Return result including list of references for new model run.
-        return jsonify(result), 201
+        # Return result including list of references for new model run. The
+        # run is accepted but has not been dispatched yet in outbox mode.
+        if api.dispatcher is None:
+            return jsonify(result), 201
+        return jsonify(result), 202
     except ValueError as ex:
         raise InvalidRequest(str(ex))
 
 
+@app.route('/experiments/<string:experiment_id>/predictions/batch', methods=['POST'])
+def experiments_predictions_create_batch(experiment_id):
+    """Create model runs (POST) - Start a batch of model runs for an experiment.
+    The batch is either given as a list of runs (element 'runs') or as a
+    parameter grid (elements 'name', 'grid', and optional 'arguments').
+    """
+    # Make sure that the post request has a json part
+    if not request.json:
+        raise InvalidRequest('not a valid Json object in request body')
+    json_obj = request.json
+    if not 'model' in json_obj:
+        raise InvalidRequest('missing element in Json body: model')
+    # Get dictionary of properties for all runs if present in request
+    if 'properties' in json_obj:
+        properties = get_properties_list(json_obj['properties'], False)
+    else:
+        properties = None
+    try:
+        if 'runs' in json_obj:
+            if not isinstance(json_obj['runs'], list):
+                raise InvalidRequest('invalid element in Json body: runs')
+            runs = []
+            for run in json_obj['runs']:
+                if not isinstance(run, dict):
+                    raise InvalidRequest('invalid element in runs: not a Json object')
+                for key in ['name', 'arguments']:
+                    if not key in run:
+                        raise InvalidRequest('missing element in run: ' + key)
+                run_properties = properties
+                if 'properties' in run:
+                    run_properties = dict(properties) if not properties is None else {}
+                    run_properties.update(
+                        get_properties_list(run['properties'], False)
+                    )
+                runs.append(
+                    ModelRunSpec(run['name'], run['arguments'], run_properties)
+                )
+        elif 'grid' in json_obj:
+            if not 'name' in json_obj:
+                raise InvalidRequest('missing element in Json body: name')
+            runs = expand_grid(
+                json_obj['name'],
+                json_obj['grid'],
+                arguments=json_obj['arguments'] if 'arguments' in json_obj else None,
+                properties=properties
+            )
+        else:
+            raise InvalidRequest('missing element in Json body: runs or grid')
+        result = api.experiments_predictions_create_batch(
+            experiment_id,
+            json_obj['model'],
+            runs
+        )
+        # The result is None if experiment does not exists
+        if result is None:
+            raise ResourceNotFound(experiment_id)
+        if api.dispatcher is None:
+            return jsonify(result), 201
+        return jsonify(result), 202
+    except ValueError as ex:
+        # Messages may contain non-ASCII parameter names or values
+        raise InvalidRequest(unicode(ex))
+
+
+@app.route('/experiments/<string:experiment_id>/predictions/events')
+def experiments_predictions_events(experiment_id):
+    """Model run events (GET) - Stream of state changes for all model runs of
+    an experiment (Server-Sent Events).
+    """
+    try:
+        result = api.experiments_predictions_subscribe(experiment_id)
+    except StreamLimitExceeded as ex:
+        raise ServiceUnavailable(str(ex))
+    if result is None:
+        raise ResourceNotFound(experiment_id)
+    subscription, initial_events = result
+    return get_event_stream_response(subscription, initial_events, False)
+
+
+@app.route('/experiments/<string:experiment_id>/predictions/<string:run_id>/events')
+def experiments_predictions_run_events(experiment_id, run_id):
+    """Model run events (GET) - Stream of state changes for a model run
+    (Server-Sent Events). The first event contains the current state. The
+    stream is closed after the run has finished.
+    """
+    try:
+        result = api.experiments_predictions_subscribe(experiment_id, run_id=run_id)
+    except StreamLimitExceeded as ex:
+        raise ServiceUnavailable(str(ex))
+    if result is None:
+        raise ResourceNotFound(experiment_id + ':' + run_id)
+    subscription, initial_events = result
+    return get_event_stream_response(subscription, initial_events, True)
+
+
 @app.route('/experiments/<string:experiment_id>/predictions/<string:run_id>', methods=['GET'])
 def experiments_predictions_get(experiment_id, run_id):
     """Get prediction (GET) - Retrieve a model run and its prediction result
     for a given experiment.
     """
+    # Get the selected fields and expanded references.
+    fields, expand = get_composition_arguments(
+        request,
+        PREDICTION_FIELDS,
+        PREDICTION_EXPAND
+    )
     # Get prediction object from database. Raise exception if prediction does
     # not exist.
-    prediction = api.experiments_predictions_get(experiment_id, run_id)
+    prediction = api.experiments_predictions_get(
+        experiment_id,
+        run_id,
+        fields=fields,
+        expand=expand
+    )
     if prediction is None:
         raise ResourceNotFound(experiment_id + ':' + run_id)
     else:
@@ -580,7 +957,13 @@ def image_files_list():
     offset, limit, prop_set = get_listing_arguments(request)
     # Decorate image file listing and return Json object
     return jsonify(
-        api.image_files_list(limit=limit, offset=offset, properties=prop_set)
+        api.image_files_list(
+            limit=limit,
+            offset=offset,
+            properties=prop_set,
+            cursor=get_listing_cursor(request),
+            count_mode=get_listing_count(request)
+        )
     )
 
 
@@ -653,7 +1036,13 @@ def image_groups_list():
     offset, limit, prop_set = get_listing_arguments(request)
     # Decorate image group listing and return Json object
     return jsonify(
-        api.image_groups_list(limit=limit, offset=offset, properties=prop_set)
+        api.image_groups_list(
+            limit=limit,
+            offset=offset,
+            properties=prop_set,
+            cursor=get_listing_cursor(request),
+            count_mode=get_listing_count(request)
+        )
     )
 
 
@@ -926,7 +1315,13 @@ def subjects_list():
     offset, limit, prop_set = get_listing_arguments(request)
     # Decorate subject listing and return Json object
     return jsonify(
-        api.subjects_list(limit=limit, offset=offset, properties=prop_set)
+        api.subjects_list(
+            limit=limit,
+            offset=offset,
+            properties=prop_set,
+            cursor=get_listing_cursor(request),
+            count_mode=get_listing_count(request)
+        )
     )
 
 
@@ -1005,6 +1400,105 @@ def subjects_upsert_property(subject_id):
         raise InvalidRequest(str(ex))
 
 
+# ------------------------------------------------------------------------------
+# Uploads
+# ------------------------------------------------------------------------------
+
+@app.route('/uploads', methods=['POST'])
+def uploads_create():
+    """Create upload session (POST) - Create a resumable upload session for a
+    subject archive, an image file or archive, or an experiment fMRI data file.
+    """
+    # Make sure that the post request has a json part
+    if not request.json:
+        raise InvalidRequest('not a valid Json object in request body')
+    json_obj = request.json
+    # Make sure that all required keys are present in the given Json object
+    for key in ['type', 'filename', 'size']:
+        if not key in json_obj:
+            raise InvalidRequest('missing element in Json body: ' + key)
+    experiment_id = json_obj['experiment'] if 'experiment' in json_obj else None
+    try:
+        result = api.uploads_create(
+            json_obj['type'],
+            json_obj['filename'],
+            int(json_obj['size']),
+            experiment_id=experiment_id
+        )
+    except (TypeError, ValueError) as ex:
+        raise InvalidRequest(str(ex))
+    # Result is None if the experiment for an fMRI upload does not exist
+    if result is None:
+        raise ResourceNotFound(experiment_id)
+    return jsonify(result), 201
+
+
+@app.route('/uploads/<string:session_id>', methods=['GET'])
+def uploads_get(session_id):
+    """Get upload session (GET) - Get status of an upload session including
+    the list of byte ranges that have been received.
+    """
+    result = api.uploads_get(session_id)
+    if result is None:
+        raise ResourceNotFound(session_id)
+    return jsonify(result)
+
+
+@app.route('/uploads/<string:session_id>', methods=['PUT'])
+def uploads_write(session_id):
+    """Upload chunk (PUT) - Upload a byte range of the file. The range is
+    given in the Content-Range header. The request body contains the bytes in
+    the range. Chunks can be uploaded in any order.
+    """
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes':
+        raise InvalidRequest('missing or invalid Content-Range header')
+    try:
+        result = api.uploads_write(
+            session_id,
+            content_range.start,
+            content_range.stop - 1,
+            request.stream
+        )
+    except UploadConflictError as ex:
+        raise ResourceConflict(str(ex))
+    except ValueError as ex:
+        raise InvalidRequest(str(ex))
+    if result is None:
+        raise ResourceNotFound(session_id)
+    return jsonify(result)
+
+
+@app.route('/uploads/<string:session_id>', methods=['DELETE'])
+def uploads_delete(session_id):
+    """Delete upload session (DELETE) - Abort upload and delete all chunks
+    that have been received.
+    """
+    if not api.uploads_delete(session_id):
+        raise ResourceNotFound(session_id)
+    return '', 204
+
+
+@app.route('/uploads/<string:session_id>/finalize', methods=['POST'])
+def uploads_finalize(session_id):
+    """Finalize upload (POST) - Create subject, image, or fMRI data object
+    from the file in a complete upload session. If the request contains a
+    checksum header the checksum of the uploaded file is verified.
+    """
+    try:
+        result = api.uploads_finalize(
+            session_id,
+            checksum=request.headers.get(HEADER_CHECKSUM)
+        )
+    except UploadConflictError as ex:
+        raise ResourceConflict(str(ex))
+    except ValueError as ex:
+        raise InvalidRequest(str(ex))
+    if result is None:
+        raise ResourceNotFound(session_id)
+    return jsonify(result), 201
+
+
 # ------------------------------------------------------------------------------
 # Widgets
 # ------------------------------------------------------------------------------
@@ -1018,7 +1512,13 @@ def widgets_list():
     offset, limit, prop_set = get_listing_arguments(request)
     # Decorate subject listing and return Json object
     return jsonify(
-        api.widgets_list(limit=limit, offset=offset, properties=prop_set)
+        api.widgets_list(
+            limit=limit,
+            offset=offset,
+            properties=prop_set,
+            cursor=get_listing_cursor(request),
+            count_mode=get_listing_count(request)
+        )
     )
 
 
@@ -1136,6 +1636,44 @@ def widgets_upsert_property(widget_id):
         raise InvalidRequest(str(ex))
 
 
+# ------------------------------------------------------------------------------
+# Profiles
+# ------------------------------------------------------------------------------
+
+@app.route('/admin/profiles')
+def profiles_list():
+    """List profiles (GET) - List endpoints with stored request profiles."""
+    validate_profiling_access(request)
+    return jsonify({'endpoints' : profiles.endpoints()})
+
+
+@app.route('/admin/profiles/<string:endpoint>')
+def profiles_get(endpoint):
+    """Get profile (GET) - Aggregated profile of all stored requests for an
+    endpoint. Returns a text report by default. With format=pstats the
+    aggregated profile is returned in the binary format of module pstats.
+    """
+    validate_profiling_access(request)
+    profile_format = request.args.get('format', 'text')
+    if profile_format == 'pstats':
+        data = profiles.write_aggregate(endpoint)
+        if data is None:
+            raise ResourceNotFound(endpoint)
+        response = Response(data, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = content_disposition(endpoint + '.prof')
+        return response
+    elif profile_format == 'text':
+        sort_key = request.args.get('sort', 'cumulative')
+        try:
+            report = profiles.write_report(endpoint, sort=sort_key)
+        except KeyError:
+            raise InvalidRequest('unknown sort key: ' + sort_key)
+        if report is None:
+            raise ResourceNotFound(endpoint)
+        return Response(report, mimetype='text/plain')
+    raise InvalidRequest('unknown profile format: ' + profile_format)
+
+
 # ------------------------------------------------------------------------------
 #
 # API Request Exceptions
@@ -1181,6 +1719,21 @@ class InvalidRequest(APIRequestException):
         super(InvalidRequest, self).__init__(message, 400)
 
 
+class AccessDenied(APIRequestException):
+    """Exception for requests without valid credentials that have status
+    code 403.
+    """
+    def __init__(self, message):
+        """Initialize the message and status code (403) of super class.
+
+        Parameters
+        ----------
+        message : string
+            Error message
+        """
+        super(AccessDenied, self).__init__(message, 403)
+
+
 class ResourceNotFound(APIRequestException):
     """Exception for file not found situations that have status code 404."""
     def __init__(self, object_id):
@@ -1197,6 +1750,34 @@ class ResourceNotFound(APIRequestException):
         super(ResourceNotFound, self).__init__(message, 404)
 
 
+class ResourceConflict(APIRequestException):
+    """Exception for requests that conflict with the current state of a
+    resource that have status code 409."""
+    def __init__(self, message):
+        """Initialize the message and status code (409) of super class.
+
+        Parameters
+        ----------
+        message : string
+            Error message
+        """
+        super(ResourceConflict, self).__init__(message, 409)
+
+
+class ServiceUnavailable(APIRequestException):
+    """Exception for requests that cannot be served at the moment that have
+    status code 503."""
+    def __init__(self, message):
+        """Initialize the message and status code (503) of super class.
+
+        Parameters
+        ----------
+        message : string
+            Error message
+        """
+        super(ServiceUnavailable, self).__init__(message, 503)
+
+
 # ------------------------------------------------------------------------------
 #
 # Helper Methods
@@ -1209,7 +1790,9 @@ class ResourceNotFound(APIRequestException):
 
 def download_file(file_info, identifier, as_attachment=True, filename=None):
     """Send content of a given file that is associated associated with a data
-    store resource.
+    store resource. Supports conditional requests (ETag, Last-Modified) and
+    byte range requests. Downloads are offloaded to the front-end proxy if
+    configured.
 
     Parameters
     ----------
@@ -1235,14 +1818,73 @@ def download_file(file_info, identifier, as_attachment=True, filename=None):
         if file_info.name != filename:
             raise ResourceNotFound(filename)
     # Send file in the object's upload folder
-    return send_file(
+    return send_download(
         file_info.file,
-        mimetype=file_info.mime_type,
+        file_info.mime_type,
+        file_info.name,
         as_attachment=as_attachment,
-        attachment_filename=file_info.name
+        offload=DOWNLOAD_OFFLOAD
     )
 
 
+def get_composition_arguments(request, valid_fields, valid_expand):
+    """Extract the selected fields and the expanded references for a composed
+    resource from the given request. Returns None for parameters that are not
+    present in the request (i.e., all fields are included and all references
+    are expanded).
+
+    Parameters
+    ----------
+    request : flask.request
+        Flask request object
+    valid_fields : list(string)
+        Fields that can be selected for the resource
+    valid_expand : list(string)
+        References that can be expanded for the resource
+
+    Returns
+    -------
+    (list(string), list(string))
+        Tuple of fields, expand
+    """
+    result = []
+    for para, valid_values in [
+        (hateoas.QPARA_FIELDS, valid_fields),
+        (hateoas.QPARA_EXPAND, valid_expand)
+    ]:
+        values = None
+        if para in request.args:
+            # An empty parameter value selects the empty list
+            values = [v for v in request.args[para].split(',') if v != '']
+            for value in values:
+                if not value in valid_values:
+                    raise InvalidRequest('invalid ' + para + ': ' + value)
+        result.append(values)
+    return tuple(result)
+
+
+def get_links_mode(request):
+    """Extract the reference mode for the response from the given request.
+
+    Parameters
+    ----------
+    request : flask.request
+        Flask request object
+
+    Returns
+    -------
+    string
+        Reference mode (full, relative, or none). Responses contain absolute
+        references if the request does not specify the mode.
+    """
+    if not hateoas.QPARA_LINKS in request.args:
+        return hateoas.LINKS_FULL
+    links_mode = request.args[hateoas.QPARA_LINKS]
+    if not links_mode in hateoas.LINKS_MODES:
+        raise InvalidRequest('invalid links mode: ' + links_mode)
+    return links_mode
+
+
 def get_listing_arguments(request, default_limit=DEFAULT_LISTING_SIZE):
     """Extract listing arguments from given request. Returns default values
     for parameters not present in the request.
@@ -1272,6 +1914,88 @@ def get_listing_arguments(request, default_limit=DEFAULT_LISTING_SIZE):
     return offset, limit, prop_set
 
 
+def get_listing_count(request):
+    """Extract the mode for counting the total number of objects in a listing
+    from the given request.
+
+    Parameters
+    ----------
+    request : flask.request
+        Flask request object
+
+    Returns
+    -------
+    string
+        Count mode (exact, estimated, or none). Objects are counted exactly if
+        the request does not specify the count mode.
+    """
+    if not hateoas.QPARA_COUNT in request.args:
+        return COUNT_EXACT
+    count_mode = request.args[hateoas.QPARA_COUNT]
+    if not count_mode in COUNT_MODES:
+        raise InvalidRequest('invalid count mode: ' + count_mode)
+    return count_mode
+
+
+def get_listing_cursor(request):
+    """Extract the listing cursor for keyset pagination from the given request.
+
+    Parameters
+    ----------
+    request : flask.request
+        Flask request object
+
+    Returns
+    -------
+    string
+        Listing cursor or None if the request does not contain a cursor
+    """
+    if not hateoas.QPARA_CURSOR in request.args:
+        return None
+    cursor = request.args[hateoas.QPARA_CURSOR]
+    # Raise InvalidRequest if the given value is not a valid cursor. An empty
+    # cursor refers to the first page in a listing.
+    if cursor != '':
+        try:
+            decode_cursor(cursor)
+        except ValueError as ex:
+            raise InvalidRequest(str(ex))
+    return cursor
+
+
+def get_event_stream_response(subscription, initial_events, until_finished):
+    """Create Server-Sent Events response for the given event subscription.
+
+    Parameters
+    ----------
+    subscription : events.Subscription
+        Subscription for streamed events
+    initial_events : list(dict)
+        Events that are sent at the start of the stream
+    until_finished : bool
+        Close the stream after the model run has finished
+
+    Returns
+    -------
+    flask.Response
+    """
+    response = Response(
+        event_stream(
+            api.events,
+            subscription,
+            initial_events=initial_events,
+            keepalive=EVENTS_KEEPALIVE,
+            timeout=EVENTS_TIMEOUT,
+            until_finished=until_finished
+        ),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    # Disable response buffering in nginx
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def get_properties_list(json_array, is_mandatory_value):
     """Convert an Json Array of key,value pairs into a dictionary.
 
@@ -1307,6 +2031,9 @@ def get_upload_file(request):
     not contain an uploded file.
 
     Creates a temporal directory and saves the uploaded file in that directory.
+    Files that have been streamed into the upload directory are moved instead
+    of copied. If the request contains a checksum header the checksum of the
+    uploaded file is verified.
 
     Parameters
     ----------
@@ -1326,12 +2053,15 @@ def get_upload_file(request):
     # A browser may submit a empty part without filename
     if file.filename == '':
         raise InvalidRequest('empty file name')
-    # Save uploaded file to temp directory
-    temp_dir = tempfile.mkdtemp()
-    filename = secure_filename(file.filename)
-    upload_file = os.path.join(temp_dir, filename)
-    file.save(upload_file)
-    return temp_dir, upload_file
+    # Save uploaded file to temp directory. Raises ValueError if the checksum
+    # does not match.
+    try:
+        return save_upload_file(
+            file,
+            expected_checksum=request.headers.get(HEADER_CHECKSUM)
+        )
+    except ValueError as ex:
+        raise InvalidRequest(str(ex))
 
 
 def get_upsert_properties(request):
@@ -1357,6 +2087,168 @@ def get_upsert_properties(request):
     return get_properties_list(request.json['properties'], False)
 
 
+def validate_profiling_access(request):
+    """Ensure that the request may access the stored profiles. Raise
+    ResourceNotFound if profiling is disabled. If a profiling secret is
+    configured the request has to contain a valid profiling token. Otherwise,
+    profiles are only accessible in debug mode.
+
+    Parameters
+    ----------
+    request : flask.request
+        Flask request object
+    """
+    if profiles is None:
+        raise ResourceNotFound('profiles')
+    if not PROFILING_SECRET is None:
+        token = request.headers.get(HEADER_PROFILE)
+        if token is None or not verify_token(PROFILING_SECRET, token):
+            raise AccessDenied('missing or invalid profiling token')
+    elif not app.debug:
+        raise AccessDenied('profiling secret required')
+
+
+# ------------------------------------------------------------------------------
+# Request Hooks
+# ------------------------------------------------------------------------------
+
+@app.before_request
+def reset_query_counter():
+    """Reset the MongoDB round trip counter and the component call statistics
+    at the start of each request.
+    """
+    query_counter.reset()
+    call_stats.reset()
+
+
+@app.before_request
+def start_request_metrics():
+    """Record the start time and count the request as in progress."""
+    g.request_start = time.time()
+    REQUESTS_IN_PROGRESS.inc()
+
+
+@app.before_request
+def set_links_mode():
+    """Set the reference mode for the response to the request (query
+    parameter links).
+    """
+    api.set_links_mode(get_links_mode(request))
+
+
+@app.after_request
+def add_query_count(response):
+    """Add the number and duration of MongoDB round trips and component calls
+    for the request as response headers in debug mode.
+
+    Parameters
+    ----------
+    response : flask.Response
+        Response for the request
+
+    Returns
+    -------
+    flask.Response
+    """
+    if app.debug:
+        response.headers[HEADER_QUERY_COUNT] = str(query_counter.count)
+        response.headers[HEADER_QUERY_TIME] = '%.3f' % (query_counter.duration * 1000)
+        response.headers['Server-Timing'] = server_timing()
+    return response
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Record count, duration, and response size for the request.
+
+    Parameters
+    ----------
+    response : flask.Response
+        Response for the request
+
+    Returns
+    -------
+    flask.Response
+    """
+    if 'request_start' in g:
+        observe_request(
+            request.method,
+            request.url_rule.rule if not request.url_rule is None else None,
+            response.status_code,
+            time.time() - g.request_start,
+            response.content_length
+        )
+    return response
+
+
+@app.after_request
+def log_slow_request(response):
+    """Write requests that took longer than the threshold to the slow-request
+    log.
+
+    Parameters
+    ----------
+    response : flask.Response
+        Response for the request
+
+    Returns
+    -------
+    flask.Response
+    """
+    if 'request_start' in g:
+        duration = time.time() - g.request_start
+        if duration >= SLOW_REQUEST_THRESHOLD:
+            slow_request_logger.warning(
+                json.dumps(
+                    request_summary(
+                        request.method,
+                        request.path,
+                        request.url_rule.rule if not request.url_rule is None else None,
+                        response.status_code,
+                        duration
+                    ),
+                    sort_keys=True
+                )
+            )
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress the response body if the client accepts a supported content
+    coding. Registered last to run before the other after-request handlers,
+    i.e., metrics record the size of the compressed body.
+
+    Parameters
+    ----------
+    response : flask.Response
+        Response for the request
+
+    Returns
+    -------
+    flask.Response
+    """
+    if COMPRESSOR is None:
+        return response
+    return COMPRESSOR.compress_response(
+        response,
+        request.headers.get('Accept-Encoding')
+    )
+
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    """Remove the request from the requests in progress.
+
+    Parameters
+    ----------
+    exception : Exception
+        Unhandled exception (if any)
+    """
+    if 'request_start' in g:
+        REQUESTS_IN_PROGRESS.dec()
+
+
 # ------------------------------------------------------------------------------
 # Error Handler
 # ------------------------------------------------------------------------------
@@ -1394,29 +2286,7 @@ def internal_error(exception):
 # ------------------------------------------------------------------------------
 
 if __name__ == '__main__':
-    # Relevant documents:
-    # http://werkzeug.pocoo.org/docs/middlewares/
-    # http://flask.pocoo.org/docs/patterns/appdispatch/
+    # Run the development server. Use module wsgi to run the server with a
+    # pool of worker processes in production.
     from werkzeug.serving import run_simple
-    from werkzeug.wsgi import DispatcherMiddleware
-    # Switch logging on if not in debug mode
-    if app.debug is not True:
-        import logging
-        from logging.handlers import RotatingFileHandler
-        file_handler = RotatingFileHandler(
-            LOG_FILE,
-            maxBytes=1024 * 1024 * 100,
-            backupCount=20
-        )
-        file_handler.setLevel(logging.ERROR)
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
-        file_handler.setFormatter(formatter)
-        app.logger.addHandler(file_handler)
-    # Load a dummy app at the root URL to give 404 errors.
-    # Serve app at APPLICATION_ROOT for localhost development.
-    application = DispatcherMiddleware(Flask('dummy_app'), {
-        app.config['APPLICATION_ROOT']: app,
-    })
     run_simple('0.0.0.0', SERVER_PORT, application, use_reloader=app.config['DEBUG'])
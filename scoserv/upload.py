@@ -0,0 +1,800 @@
+"""Streaming file uploads - Writes uploaded files directly into an upload
+directory that is located on the same file system as the data store.
+
+By default, Werkzeug spools uploaded files into a temporary file (outside of
+the data store) and the server saves a second copy of the file before it is
+passed to the data store. The request class in this module replaces the
+default stream factory. The request body of each uploaded file is written
+exactly once, into a partial file in the upload directory. The checksum of the
+file is computed incrementally while the request is streamed. Once the upload
+is complete the partial file is renamed (atomically) to the uploaded file name
+and passed to the data store.
+
+Clients may send the SHA-256 digest of the uploaded file in the request header
+X-SCO-Content-SHA256. Uploads with a different checksum are rejected. Partial
+files that are not claimed by the request handler are removed when the
+request is closed.
+
+Large files can also be uploaded in chunks as part of a resumable upload
+session. A session is created for a file of known size. Chunks are uploaded
+as byte ranges in any order (and in parallel). The session status lists the
+byte ranges that have been received so far, i.e., a client can resume an
+interrupted upload by sending only the missing ranges. Once all bytes have
+been received the session is finalized and the assembled file is passed to
+the data store. Sessions are kept in the upload directory (one directory per
+session) so that they are shared by all server processes. Sessions without
+activity for longer than their time to live are removed. Expired sessions are
+removed whenever sessions are accessed (at most once per cleanup interval).
+A session is deleted only after the object for the uploaded file has been
+created, i.e., finalizing can be repeated if creating the object fails.
+
+A session is claimed before it is finalized by creating a lock file in the
+session directory (exclusive create). The claim is visible to all server
+processes. Concurrent requests to finalize the same session are rejected
+(UploadConflictError), as are chunks that are uploaded while the session is
+being finalized. Chunks that are being written are marked in the session
+directory as well, and a session is not finalized while chunks are in flight.
+The claim is released if creating the object fails.
+"""
+
+import datetime
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from flask import Request
+from werkzeug.utils import secure_filename
+
+from metrics import UPLOAD_BYTES
+
+
+"""Request header containing the hex digest of the uploaded file."""
+HEADER_CHECKSUM = 'X-SCO-Content-SHA256'
+
+"""Suffix for files that are being uploaded."""
+PARTIAL_FILE_SUFFIX = '.part'
+
+"""Default number of seconds an upload session without activity is kept."""
+DEFAULT_SESSION_TTL = 24 * 60 * 60
+
+"""Minimum number of seconds between removals of expired sessions."""
+CLEANUP_INTERVAL = 60
+
+"""Seconds after which the marker of a chunk that is being written (and that
+has not been updated since) is considered stale."""
+WRITE_TIMEOUT = 5 * 60
+
+"""Types of files that can be uploaded using upload sessions."""
+UPLOAD_TYPE_FMRI = 'fmri'
+UPLOAD_TYPE_IMAGE = 'image'
+UPLOAD_TYPE_SUBJECT = 'subject'
+
+UPLOAD_TYPES = [UPLOAD_TYPE_FMRI, UPLOAD_TYPE_IMAGE, UPLOAD_TYPE_SUBJECT]
+
+# Names of files and directories in an upload session directory
+SESSION_DATA_FILE = 'data'
+SESSION_DESCRIPTOR_FILE = 'session.json'
+SESSION_LOCK_FILE = 'finalize.lock'
+SESSION_RANGES_DIR = 'ranges'
+# Prefix for markers of chunks that are being written (in the ranges directory)
+WRITE_MARKER_PREFIX = 'writing.'
+# Name of the directory that contains upload session directories
+SESSIONS_DIR = 'sessions'
+
+# Size of blocks that are copied from the request stream
+BLOCK_SIZE = 1024 * 1024
+
+
+class ChecksumFile(object):
+    """Wrapper around a writable file that updates the checksum of the file
+    content with every write. All other file operations are delegated to the
+    wrapped file.
+
+    Attributes
+    ----------
+    filename : string
+        Path to the file on disk
+    is_claimed : bool
+        Flag indicating whether the file has been moved to its final location
+    """
+    def __init__(self, fp, filename):
+        """Initialize the wrapped file and the checksum.
+
+        Parameters
+        ----------
+        fp : file
+            File object that is open for writing
+        filename : string
+            Path to the file on disk
+        """
+        self.fp = fp
+        self.filename = filename
+        self.is_claimed = False
+        self.sha256 = hashlib.sha256()
+
+    def __getattr__(self, name):
+        """Delegate all other file operations to the wrapped file."""
+        return getattr(self.fp, name)
+
+    def __iter__(self):
+        """Iterate over the lines of the wrapped file."""
+        return iter(self.fp)
+
+    @property
+    def checksum(self):
+        """Hex digest of the content that has been written to the file.
+
+        Returns
+        -------
+        string
+        """
+        return self.sha256.hexdigest()
+
+    def write(self, data):
+        """Write data to the file and update the checksum.
+
+        Parameters
+        ----------
+        data : string
+            Chunk of the uploaded file
+        """
+        self.sha256.update(data)
+        return self.fp.write(data)
+
+
+class StreamingUploadRequest(Request):
+    """Flask request that streams uploaded files into the upload directory.
+    The upload directory is a class attribute that has to be set before the
+    first request is handled (by calling set_upload_directory()). If the
+    upload directory is None the default Werkzeug behaviour is used.
+    """
+    upload_dir = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        """Create partial file in the upload directory for an uploaded file.
+
+        Returns
+        -------
+        ChecksumFile
+        """
+        if StreamingUploadRequest.upload_dir is None:
+            return super(StreamingUploadRequest, self)._get_file_stream(
+                total_content_length,
+                content_type,
+                filename=filename,
+                content_length=content_length
+            )
+        fd, part_file = tempfile.mkstemp(
+            suffix=PARTIAL_FILE_SUFFIX,
+            dir=StreamingUploadRequest.upload_dir
+        )
+        stream = ChecksumFile(os.fdopen(fd, 'w+b'), part_file)
+        if not hasattr(self, 'streamed_files'):
+            self.streamed_files = []
+        self.streamed_files.append(stream)
+        return stream
+
+    def close(self):
+        """Close the request and remove partial files that have not been
+        claimed by the request handler.
+        """
+        super(StreamingUploadRequest, self).close()
+        for stream in getattr(self, 'streamed_files', []):
+            if not stream.is_claimed and os.path.isfile(stream.filename):
+                os.remove(stream.filename)
+
+
+class UploadConflictError(Exception):
+    """Exception raised if an upload session is being finalized by another
+    request."""
+    pass
+
+
+class UploadSession(object):
+    """Resumable upload session for a single file. The uploaded file is
+    assembled in a data file that is pre-allocated with the expected file
+    size. For each received chunk an (empty) marker file is created that
+    contains the byte range of the chunk in its name.
+
+    Attributes
+    ----------
+    identifier : string
+        Unique session identifier
+    directory : string
+        Session directory
+    upload_type : string
+        Type of the uploaded file (fmri, image, or subject)
+    filename : string
+        Name of the uploaded file
+    size : int
+        File size in bytes
+    experiment_id : string
+        Identifier of the experiment the uploaded fMRI data belongs to (None
+        for all other types of uploads)
+    created_at : datetime.datetime
+        Time of session creation (UTC)
+    """
+    def __init__(self, identifier, directory, upload_type, filename, size, experiment_id=None, created_at=None):
+        """Initialize the session properties.
+
+        Parameters
+        ----------
+        identifier : string
+            Unique session identifier
+        directory : string
+            Session directory
+        upload_type : string
+            Type of the uploaded file (fmri, image, or subject)
+        filename : string
+            Name of the uploaded file
+        size : int
+            File size in bytes
+        experiment_id : string, optional
+            Identifier of the experiment the uploaded fMRI data belongs to
+        created_at : datetime.datetime, optional
+            Time of session creation (UTC)
+        """
+        self.identifier = identifier
+        self.directory = directory
+        self.upload_type = upload_type
+        self.filename = filename
+        self.size = size
+        self.experiment_id = experiment_id
+        self.created_at = created_at or datetime.datetime.utcnow()
+
+    @property
+    def bytes_received(self):
+        """Number of bytes that have been received.
+
+        Returns
+        -------
+        int
+        """
+        return sum([end - start + 1 for start, end in self.ranges])
+
+    @property
+    def data_file(self):
+        """Path to the file that the uploaded file is assembled in.
+
+        Returns
+        -------
+        string
+        """
+        return os.path.join(self.directory, SESSION_DATA_FILE)
+
+    @property
+    def is_complete(self):
+        """Flag indicating whether all bytes of the file have been received.
+
+        Returns
+        -------
+        bool
+        """
+        return self.bytes_received == self.size
+
+    @property
+    def is_finalizing(self):
+        """Flag indicating whether the session has been claimed by a request
+        that finalizes the session.
+
+        Returns
+        -------
+        bool
+        """
+        return os.path.isfile(self.lock_file)
+
+    @property
+    def last_activity(self):
+        """Time of last activity (creation of the session or receipt of a
+        chunk) as seconds since the epoch.
+
+        Returns
+        -------
+        float
+        """
+        return max(
+            os.path.getmtime(self.directory),
+            os.path.getmtime(self.data_file),
+            os.path.getmtime(os.path.join(self.directory, SESSION_RANGES_DIR))
+        )
+
+    @property
+    def lock_file(self):
+        """Path to the file that marks the session as being finalized.
+
+        Returns
+        -------
+        string
+        """
+        return os.path.join(self.directory, SESSION_LOCK_FILE)
+
+    @property
+    def ranges(self):
+        """Sorted list of disjoint byte ranges that have been received.
+        Adjacent and overlapping chunks are merged.
+
+        Returns
+        -------
+        list((int, int))
+            List of (first byte, last byte) pairs
+        """
+        chunks = []
+        for name in os.listdir(os.path.join(self.directory, SESSION_RANGES_DIR)):
+            if name.startswith(WRITE_MARKER_PREFIX):
+                continue
+            start, end = name.split('-')
+            chunks.append((int(start), int(end)))
+        ranges = []
+        for start, end in sorted(chunks):
+            if len(ranges) > 0 and start <= ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    @property
+    def writes_in_flight(self):
+        """Flag indicating whether chunks are being written. In-flight markers
+        that have not been updated for longer than WRITE_TIMEOUT seconds are
+        left over by requests that did not finish (e.g., killed workers) and
+        are removed.
+
+        Returns
+        -------
+        bool
+        """
+        ranges_dir = os.path.join(self.directory, SESSION_RANGES_DIR)
+        stale = time.time() - WRITE_TIMEOUT
+        in_flight = False
+        for name in os.listdir(ranges_dir):
+            if name.startswith(WRITE_MARKER_PREFIX):
+                filename = os.path.join(ranges_dir, name)
+                try:
+                    if os.path.getmtime(filename) < stale:
+                        os.remove(filename)
+                    else:
+                        in_flight = True
+                except OSError:
+                    # The write has finished in the meantime
+                    pass
+        return in_flight
+
+    def to_dict(self):
+        """Dictionary serialization of the session descriptor.
+
+        Returns
+        -------
+        dict
+        """
+        obj = {
+            'id' : self.identifier,
+            'type' : self.upload_type,
+            'filename' : self.filename,
+            'size' : self.size,
+            'createdAt' : self.created_at.strftime('%Y-%m-%dT%H:%M:%S.%f')
+        }
+        if not self.experiment_id is None:
+            obj['experiment'] = self.experiment_id
+        return obj
+
+    def write_chunk(self, start, end, stream):
+        """Write byte range of the uploaded file. Reads end - start + 1 bytes
+        from the given stream. Raises ValueError if the range is invalid or if
+        the stream contains less data than expected. Raises
+        UploadConflictError if the session is being finalized or has been
+        deleted.
+
+        The chunk is marked as being written (in-flight marker) while it is
+        streamed. A session cannot be claimed for finalizing while there are
+        chunks in flight.
+
+        Parameters
+        ----------
+        start : int
+            Position of first byte in the chunk
+        end : int
+            Position of last byte in the chunk
+        stream : file
+            Stream containing the chunk data
+        """
+        if start < 0 or end < start or end >= self.size:
+            raise ValueError('invalid byte range: ' + str(start) + '-' + str(end))
+        ranges_dir = os.path.join(self.directory, SESSION_RANGES_DIR)
+        write_marker = os.path.join(ranges_dir, WRITE_MARKER_PREFIX + uuid.uuid4().hex)
+        try:
+            os.close(os.open(write_marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError as ex:
+            if ex.errno == errno.ENOENT:
+                raise UploadConflictError('upload session has been deleted')
+            raise
+        try:
+            # The session is checked after the in-flight marker has been
+            # created. A claim that is made after this check sees the marker.
+            if self.is_finalizing:
+                raise UploadConflictError('upload is being finalized')
+            remaining = end - start + 1
+            with open(self.data_file, 'r+b') as f:
+                f.seek(start)
+                while remaining > 0:
+                    data = stream.read(min(BLOCK_SIZE, remaining))
+                    if not data:
+                        break
+                    f.write(data)
+                    remaining -= len(data)
+                    # Keep the in-flight marker fresh for long chunks
+                    os.utime(write_marker, None)
+            if remaining > 0:
+                raise ValueError('incomplete chunk: missing ' + str(remaining) + ' bytes')
+            UPLOAD_BYTES.inc(end - start + 1)
+            # Record the received range only after the chunk has been written
+            # and only if the session has not been claimed in the meantime.
+            if self.is_finalizing:
+                raise UploadConflictError('upload is being finalized')
+            open(os.path.join(ranges_dir, str(start) + '-' + str(end)), 'w').close()
+        except (IOError, OSError) as ex:
+            if ex.errno == errno.ENOENT:
+                raise UploadConflictError('upload session has been deleted')
+            raise
+        finally:
+            try:
+                os.remove(write_marker)
+            except OSError:
+                pass
+
+
+class UploadSessionManager(object):
+    """Manager for resumable upload sessions. Sessions are maintained in a
+    sub-folder of the upload directory.
+
+    Attributes
+    ----------
+    directory : string
+        Directory containing the session directories
+    upload_dir : string
+        Upload directory. Finalized files are moved into temporary
+        directories in the upload directory.
+    ttl : int
+        Number of seconds a session without activity is kept
+    last_cleanup : float
+        Time of the last removal of expired sessions
+    """
+    def __init__(self, upload_dir, ttl=DEFAULT_SESSION_TTL):
+        """Initialize the session directory. Creates the directory if it does
+        not exist.
+
+        Parameters
+        ----------
+        upload_dir : string
+            Upload directory
+        ttl : int, optional
+            Number of seconds a session without activity is kept
+        """
+        self.upload_dir = upload_dir
+        self.directory = os.path.join(upload_dir, SESSIONS_DIR)
+        self.ttl = ttl
+        self.last_cleanup = 0
+        create_directory(self.directory)
+
+    def create_session(self, upload_type, filename, size, experiment_id=None):
+        """Create a new upload session. Removes expired sessions. Raises
+        ValueError if the session arguments are invalid.
+
+        Parameters
+        ----------
+        upload_type : string
+            Type of the uploaded file (fmri, image, or subject)
+        filename : string
+            Name of the uploaded file
+        size : int
+            File size in bytes
+        experiment_id : string, optional
+            Identifier of the experiment the uploaded fMRI data belongs to
+
+        Returns
+        -------
+        UploadSession
+        """
+        if not upload_type in UPLOAD_TYPES:
+            raise ValueError('unknown upload type: ' + str(upload_type))
+        if upload_type == UPLOAD_TYPE_FMRI and experiment_id is None:
+            raise ValueError('missing experiment for fMRI upload')
+        if secure_filename(filename) == '':
+            raise ValueError('invalid file name: ' + filename)
+        if size <= 0:
+            raise ValueError('invalid file size: ' + str(size))
+        self.delete_expired_sessions(force=False)
+        identifier = uuid.uuid4().hex
+        session = UploadSession(
+            identifier,
+            os.path.join(self.directory, identifier),
+            upload_type,
+            secure_filename(filename),
+            size,
+            experiment_id=experiment_id
+        )
+        os.makedirs(os.path.join(session.directory, SESSION_RANGES_DIR))
+        # Pre-allocate the data file (sparse file on most file systems)
+        with open(session.data_file, 'wb') as f:
+            f.truncate(size)
+        with open(os.path.join(session.directory, SESSION_DESCRIPTOR_FILE), 'w') as f:
+            json.dump(session.to_dict(), f)
+        return session
+
+    def delete_expired_sessions(self, force=True):
+        """Delete all sessions that have been inactive for longer than the
+        session time to live.
+
+        Parameters
+        ----------
+        force : bool, optional
+            If False, sessions are only checked if the last check is longer
+            ago than the cleanup interval
+        """
+        now = time.time()
+        if not force and now - self.last_cleanup < CLEANUP_INTERVAL:
+            return
+        self.last_cleanup = now
+        expired = now - self.ttl
+        for identifier in os.listdir(self.directory):
+            session = self.read_session(identifier)
+            try:
+                if not session is None and session.last_activity < expired:
+                    shutil.rmtree(session.directory)
+            except OSError:
+                # The session may have been deleted by another process
+                pass
+
+    def delete_session(self, identifier):
+        """Delete upload session with given identifier.
+
+        Parameters
+        ----------
+        identifier : string
+            Unique session identifier
+
+        Returns
+        -------
+        bool
+            True, if the session existed
+        """
+        session = self.read_session(identifier)
+        if session is None:
+            return False
+        shutil.rmtree(session.directory, ignore_errors=True)
+        return True
+
+    def finalize_session(self, identifier, expected_checksum=None):
+        """Finalize the upload session with the given identifier. Claims the
+        session and copies the assembled file into a new temporary directory.
+        The session is not deleted. The caller deletes it once the object for
+        the uploaded file has been created or releases the claim otherwise.
+        Raises UploadConflictError if the session is being finalized by
+        another request or if chunks are being written. Raises ValueError if
+        the upload is incomplete or if the checksum of the assembled file does
+        not match the expected checksum.
+
+        Parameters
+        ----------
+        identifier : string
+            Unique session identifier
+        expected_checksum : string, optional
+            Expected SHA-256 hex digest of the uploaded file
+
+        Returns
+        -------
+        UploadSession, string, string
+            Session descriptor, path to temporary directory and to uploaded
+            file. None if the session does not exist.
+        """
+        session = self.get_session(identifier)
+        if session is None:
+            return None
+        # Claim the session. Only one of several concurrent requests can
+        # create the lock file. The session directory does not exist anymore
+        # if the session has been finalized (and deleted) in the meantime.
+        try:
+            os.close(os.open(session.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError as ex:
+            if ex.errno == errno.EEXIST:
+                raise UploadConflictError('upload is being finalized')
+            elif ex.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            # Chunks that have been started before the claim may still be
+            # written into the data file.
+            if session.writes_in_flight:
+                raise UploadConflictError('chunks are being uploaded')
+            if not session.is_complete:
+                raise ValueError('upload incomplete')
+            if not expected_checksum is None:
+                if file_checksum(session.data_file) != expected_checksum.lower():
+                    raise ValueError('checksum mismatch for uploaded file')
+            # Copy the data file. A hard link would share the file with
+            # chunks that are resent to the session.
+            temp_dir = tempfile.mkdtemp(dir=self.upload_dir)
+            upload_file = os.path.join(temp_dir, session.filename)
+            shutil.copyfile(session.data_file, upload_file)
+        except Exception:
+            self.release_session(identifier)
+            raise
+        return session, temp_dir, upload_file
+
+    def get_session(self, identifier):
+        """Get upload session with given identifier. Expired sessions are
+        deleted.
+
+        Parameters
+        ----------
+        identifier : string
+            Unique session identifier
+
+        Returns
+        -------
+        UploadSession
+            None if the session does not exist or has expired
+        """
+        self.delete_expired_sessions(force=False)
+        session = self.read_session(identifier)
+        if not session is None and session.last_activity < time.time() - self.ttl:
+            shutil.rmtree(session.directory, ignore_errors=True)
+            return None
+        return session
+
+    def read_session(self, identifier):
+        """Read the descriptor of the upload session with given identifier.
+
+        Parameters
+        ----------
+        identifier : string
+            Unique session identifier
+
+        Returns
+        -------
+        UploadSession
+            None if the session does not exist
+        """
+        # Session identifier are hex strings. This also prevents access to
+        # files outside of the session directory.
+        if re.match('^[0-9a-f]{32}$', identifier) is None:
+            return None
+        directory = os.path.join(self.directory, identifier)
+        try:
+            with open(os.path.join(directory, SESSION_DESCRIPTOR_FILE), 'r') as f:
+                doc = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return UploadSession(
+            doc['id'],
+            directory,
+            doc['type'],
+            doc['filename'],
+            doc['size'],
+            experiment_id=doc['experiment'] if 'experiment' in doc else None,
+            created_at=datetime.datetime.strptime(
+                doc['createdAt'],
+                '%Y-%m-%dT%H:%M:%S.%f'
+            )
+        )
+
+    def release_session(self, identifier):
+        """Release the claim on an upload session after finalizing the
+        session failed. The session can be finalized again afterwards.
+
+        Parameters
+        ----------
+        identifier : string
+            Unique session identifier
+        """
+        session = self.read_session(identifier)
+        if session is None:
+            return
+        try:
+            os.remove(session.lock_file)
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------------------------------
+#
+# Helper Methods
+#
+# ------------------------------------------------------------------------------
+
+def create_directory(directory):
+    """Create the given directory if it does not exist.
+
+    Parameters
+    ----------
+    directory : string
+        Path to directory
+    """
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # The directory may have been created by another worker process
+            if not os.path.isdir(directory):
+                raise
+
+
+def file_checksum(filename):
+    """Compute the SHA-256 hex digest for the given file.
+
+    Parameters
+    ----------
+    filename : string
+        Path to file on disk
+
+    Returns
+    -------
+    string
+    """
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def save_upload_file(file, expected_checksum=None):
+    """Save an uploaded file under its (secure) file name in a new temporary
+    directory. Files that were streamed into the upload directory are renamed
+    instead of being copied. Raises ValueError if the checksum of the file
+    does not match the expected checksum.
+
+    Parameters
+    ----------
+    file : werkzeug.datastructures.FileStorage
+        Uploaded file
+    expected_checksum : string, optional
+        Expected SHA-256 hex digest of the file content
+
+    Returns
+    -------
+    string, string
+        Path to the temporary directory and to the saved file
+    """
+    filename = secure_filename(file.filename)
+    stream = file.stream
+    if isinstance(stream, ChecksumFile):
+        # Flush the partial file to disk and move it into a temporary
+        # directory on the same file system.
+        stream.close()
+        checksum = stream.checksum
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(stream.filename))
+        upload_file = os.path.join(temp_dir, filename)
+        os.rename(stream.filename, upload_file)
+        stream.is_claimed = True
+    else:
+        temp_dir = tempfile.mkdtemp()
+        upload_file = os.path.join(temp_dir, filename)
+        file.save(upload_file)
+        checksum = None
+    if not expected_checksum is None:
+        if checksum is None:
+            checksum = file_checksum(upload_file)
+        if checksum != expected_checksum.lower():
+            shutil.rmtree(temp_dir)
+            raise ValueError('checksum mismatch for uploaded file')
+    UPLOAD_BYTES.inc(os.path.getsize(upload_file))
+    return temp_dir, upload_file
+
+
+def set_upload_directory(upload_dir):
+    """Set the directory that uploaded files are streamed into. Creates the
+    directory if it does not exist.
+
+    Parameters
+    ----------
+    upload_dir : string
+        Path to upload directory
+    """
+    create_directory(upload_dir)
+    StreamingUploadRequest.upload_dir = upload_dir
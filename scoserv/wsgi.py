@@ -0,0 +1,230 @@
+"""Production entry point for the SCO Web API. Runs the Flask app under a
+pre-forking pool of Gunicorn worker processes.
+
+The server module is loaded by each worker process after it has been forked
+from the master process (i.e., the app is not preloaded). Thus, every worker
+creates its own MongoDB client and no connections are shared across processes.
+The worker pool is configured using the server.workers, server.threads, and
+server.timeout parameters in the server configuration file. Workers are always
+threaded (gthread): a sync worker sends no heartbeat to the master while it
+serves an event stream and would be killed after server.timeout seconds.
+
+Sending HUP to the master process gracefully reloads the server: new workers
+are started with the current app code and configuration file and the old
+workers are shut down once they finished serving their current requests. The
+Gunicorn settings (bind address, worker pool, log file) and the metrics
+directory are computed once by the master process and are not reloaded.
+
+All worker processes append to the same app log file. The workers do not
+rotate the file. It has to be rotated externally (e.g., logrotate); workers
+reopen the file after it has been moved. The Gunicorn master process writes
+its error log to a separate file (server.errorlog).
+
+Worker processes write their metrics to files in a shared directory (server
+configuration parameter metrics.dir). The directory is emptied when the
+master process starts. Metrics of live-only gauges are removed for workers
+that exit.
+
+Usage: python wsgi.py
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+from config import read_config, DEFAULT_THREADS, ENV_PREFORK
+
+
+"""Number of seconds a worker has to finish serving requests on shutdown."""
+GRACEFUL_TIMEOUT = 30
+
+"""Environment variables for the metrics directory (see module metrics)."""
+ENV_MULTIPROC_DIR = ['PROMETHEUS_MULTIPROC_DIR', 'prometheus_multiproc_dir']
+
+
+class SCOServerApplication(BaseApplication):
+    """Gunicorn application for the SCO Web API. The WSGI application is
+    imported lazily by each worker process.
+    """
+    def __init__(self, options):
+        """Initialize the Gunicorn settings.
+
+        Parameters
+        ----------
+        options : dict
+            Dictionary of Gunicorn settings
+        """
+        self.options = options
+        super(SCOServerApplication, self).__init__()
+
+    def load_config(self):
+        """Set the Gunicorn configuration from the options dictionary."""
+        for key in self.options:
+            self.cfg.set(key.lower(), self.options[key])
+
+    def load(self):
+        """Load the WSGI application. Called in each worker process after it
+        has been forked from the master process.
+
+        Returns
+        -------
+        werkzeug.wsgi.DispatcherMiddleware
+        """
+        from server import application
+        return application
+
+
+def child_exit(server, worker):
+    """Gunicorn hook that is called in the master process after a worker has
+    exited. Removes the live-only metrics of the worker.
+
+    Parameters
+    ----------
+    server : gunicorn.arbiter.Arbiter
+        Gunicorn master process
+    worker : gunicorn.workers.base.Worker
+        Exited worker
+    """
+    # Import after the metrics directory has been set
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def get_error_log_file(config):
+    """Get the path to the Gunicorn error log file.
+
+    Parameters
+    ----------
+    config : dict
+        Dictionary of configuration parameters
+
+    Returns
+    -------
+    string
+    """
+    if 'server.errorlog' in config:
+        return os.path.abspath(config['server.errorlog'])
+    log_file = os.path.abspath(config['server.logfile'])
+    return os.path.splitext(log_file)[0] + '.gunicorn.log'
+
+
+def get_options(config):
+    """Get the Gunicorn settings for the given server configuration.
+
+    Parameters
+    ----------
+    config : dict
+        Dictionary of configuration parameters
+
+    Returns
+    -------
+    dict
+    """
+    if 'server.workers' in config:
+        workers = config['server.workers']
+    else:
+        workers = multiprocessing.cpu_count() * 2 + 1
+    threads = config['server.threads'] if 'server.threads' in config else DEFAULT_THREADS
+    timeout = config['server.timeout'] if 'server.timeout' in config else 30
+    return {
+        'bind' : '0.0.0.0:' + str(config['server.port']),
+        'workers' : workers,
+        'threads' : threads,
+        # Always use threaded workers (even with a single thread). A sync
+        # worker does not notify the master while it streams a response, i.e.,
+        # it would be killed after server.timeout seconds while it serves an
+        # event stream.
+        'worker_class' : 'gthread',
+        'timeout' : timeout,
+        'graceful_timeout' : GRACEFUL_TIMEOUT,
+        # Never load the app in the master process. Otherwise, MongoDB clients
+        # would be shared across the forked worker processes.
+        'preload_app' : False,
+        # The Gunicorn master process does not share the app log file with the
+        # workers
+        'errorlog' : get_error_log_file(config),
+        'loglevel' : 'error',
+        'child_exit' : child_exit
+    }
+
+
+def get_events_warning(config, workers):
+    """Get a warning if model run state events are not delivered between the
+    worker processes, i.e., if there is more than one worker and the event bus
+    uses the local backend. Event streams then only receive state changes that
+    are handled by the worker that serves the stream.
+
+    Every open event stream occupies a request thread of its worker for up to
+    events.timeout seconds. Each worker serves at most events.maxstreams
+    streams (default: half of server.threads) and rejects further streams
+    (503). The pool thus serves workers * events.maxstreams streams and at
+    least workers * (server.threads - events.maxstreams) other requests at a
+    time. Size server.workers and server.threads for the expected number of
+    subscribers.
+
+    Parameters
+    ----------
+    config : dict
+        Dictionary of configuration parameters
+    workers : int
+        Number of worker processes
+
+    Returns
+    -------
+    string
+        None if events reach all event streams
+    """
+    backend = config['events.backend'] if 'events.backend' in config else 'local'
+    if workers > 1 and backend == 'local':
+        return (
+            'events.backend is local: event streams only receive state '
+            'changes that are handled by their own worker process. Set '
+            'events.backend to mongo to distribute events between the ' +
+            str(workers) + ' workers.'
+        )
+    return None
+
+
+def set_metrics_directory(config):
+    """Create an empty directory for the metrics of the worker processes.
+    The directory is passed to the workers via environment variables. Has to
+    be called before the Prometheus client library is imported.
+
+    Parameters
+    ----------
+    config : dict
+        Dictionary of configuration parameters
+    """
+    if 'metrics.dir' in config:
+        metrics_dir = os.path.abspath(config['metrics.dir'])
+    else:
+        metrics_dir = os.path.join(
+            tempfile.gettempdir(),
+            'sco-metrics-' + str(config['server.port'])
+        )
+    if os.path.exists(metrics_dir):
+        shutil.rmtree(metrics_dir)
+    os.makedirs(metrics_dir)
+    for var in ENV_MULTIPROC_DIR:
+        os.environ[var] = metrics_dir
+
+
+# ------------------------------------------------------------------------------
+#
+# Main
+#
+# ------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    config = read_config()
+    set_metrics_directory(config)
+    os.environ[ENV_PREFORK] = 'true'
+    options = get_options(config)
+    warning = get_events_warning(config, options['workers'])
+    if not warning is None:
+        sys.stderr.write('WARNING: ' + warning + '\n')
+    SCOServerApplication(options).run()
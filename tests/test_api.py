@@ -8,8 +8,10 @@ import unittest
 sys.path.insert(0, os.path.abspath('..'))
 
 from pymongo import MongoClient
+from scodata.modelrun import ModelRunSuccess
 from scodata.mongo import MongoDBFactory
 from scoserv.api import SCOServerAPI
+from scoserv.monitor import query_counter
 from scoengine import init_registry_from_json
 
 BASE_URL = 'localhost'
@@ -63,6 +65,136 @@ class TestSCOAPI(unittest.TestCase):
         experiment = self.api.experiments_get(experiment_id)
         self.verify_object_handle(experiment, additional_elements=['images', 'subject', 'fmri'])
 
+    def test_experiment_query_count(self):
+        """Test that experiments and their associated objects are retrieved
+        in a single database round trip."""
+        _, _, experiment_id = self.create_experiment(fmri=True)
+        query_counter.reset()
+        experiment = self.api.experiments_get(experiment_id)
+        self.assertEqual(query_counter.count, 1)
+        self.verify_object_handle(experiment, additional_elements=['images', 'subject', 'fmri'])
+        # Unknown experiments are detected using a single round trip
+        query_counter.reset()
+        self.assertIsNone(self.api.experiments_get('UNKNOWN'))
+        self.assertEqual(query_counter.count, 1)
+
+    def test_experiment_sparse_fields(self):
+        """Test field selection and reference expansion for experiments."""
+        subject_id, image_group_id, experiment_id = self.create_experiment(fmri=True)
+        # Identifier and references are always included
+        experiment = self.api.experiments_get(experiment_id, fields=['name'])
+        self.assertEqual(sorted(experiment.keys()), ['id', 'links', 'name'])
+        # Referenced objects that are not expanded contain the identifier and
+        # self reference only
+        experiment = self.api.experiments_get(experiment_id, expand=['subject'])
+        self.verify_object_handle(experiment, additional_elements=['images', 'subject', 'fmri'])
+        self.verify_object_handle(experiment['subject'])
+        self.assertEqual(len(experiment['images']), 2)
+        self.assertEqual(experiment['images']['id'], image_group_id)
+        self.assertEqual(len(experiment['fmri']), 2)
+        # Empty expansion list
+        experiment = self.api.experiments_get(
+            experiment_id,
+            fields=['subject'],
+            expand=[]
+        )
+        self.assertEqual(sorted(experiment.keys()), ['id', 'links', 'subject'])
+        self.assertEqual(experiment['subject']['id'], subject_id)
+
+    def test_prediction_sparse_fields(self):
+        """Test field selection and reference expansion for model runs."""
+        subject_id, _, experiment_id = self.create_experiment()
+        model_id = self.api.models_list()['items'][0]['id']
+        self.api.experiments_predictions_create(experiment_id, model_id, 'Run')
+        run_id = self.api.experiments_predictions_list(experiment_id)['items'][0]['id']
+        # Identifier and references are always included
+        run = self.api.experiments_predictions_get(
+            experiment_id,
+            run_id,
+            fields=['name', 'state']
+        )
+        self.assertEqual(sorted(run.keys()), ['id', 'links', 'name', 'state'])
+        # References that are not expanded contain the identifier and self
+        # reference only
+        run = self.api.experiments_predictions_get(
+            experiment_id,
+            run_id,
+            fields=['model', 'experiment'],
+            expand=[]
+        )
+        self.assertEqual(sorted(run.keys()), ['experiment', 'id', 'links', 'model'])
+        self.assertEqual(len(run['model']), 2)
+        self.assertEqual(run['model']['id'], model_id)
+        self.assertEqual(len(run['experiment']), 2)
+        self.assertEqual(run['experiment']['id'], experiment_id)
+        # The expanded experiment contains references for objects that are
+        # not expanded using the prefix experiment.
+        run = self.api.experiments_predictions_get(
+            experiment_id,
+            run_id,
+            fields=['experiment'],
+            expand=['experiment']
+        )
+        self.verify_object_handle(run['experiment'], additional_elements=['images', 'subject'])
+        self.assertEqual(len(run['experiment']['subject']), 2)
+        self.assertEqual(run['experiment']['subject']['id'], subject_id)
+        self.assertEqual(len(run['experiment']['images']), 2)
+        run = self.api.experiments_predictions_get(
+            experiment_id,
+            run_id,
+            fields=['experiment'],
+            expand=['experiment', 'experiment.subject']
+        )
+        self.verify_object_handle(run['experiment']['subject'])
+        self.assertEqual(len(run['experiment']['images']), 2)
+        # Prefixed references are ignored if the experiment is not expanded
+        run = self.api.experiments_predictions_get(
+            experiment_id,
+            run_id,
+            fields=['experiment'],
+            expand=['experiment.subject']
+        )
+        self.assertEqual(len(run['experiment']), 2)
+
+    def test_prediction_reuse_after_reregistration(self):
+        """Test that model runs reuse the results of identical runs, but not
+        results that were computed before the model was re-registered."""
+        self.config.update({
+            'engine.dedup' : True,
+            'engine.dispatch' : 'sync',
+            'engine.broker' : 'inprocess'
+        })
+        self.api = SCOServerAPI(self.config, BASE_URL)
+        _, _, experiment_id = self.create_experiment(fmri=True)
+        fmri_id = self.api.experiments_get(experiment_id)['fmri']['id']
+        model_id = self.api.models_list()['items'][0]['id']
+        # The first run is dispatched. Mark it as successful.
+        run_id = self.create_model_run(experiment_id, model_id, 'Run 1')
+        self.assertEqual(len(self.api.broker.published), 1)
+        self.api.experiments_predictions_update_state_active(experiment_id, run_id)
+        self.api.db.predictions.update_state(run_id, ModelRunSuccess(fmri_id))
+        self.api.run_cache.set_success(run_id)
+        # An identical run reuses the result
+        run_id = self.create_model_run(experiment_id, model_id, 'Run 2')
+        run = self.api.db.experiments_predictions_get(experiment_id, run_id)
+        self.assertTrue(run.state.is_success)
+        self.assertEqual(len(self.api.broker.published), 1)
+        # After the model has been re-registered, identical runs are
+        # dispatched
+        model = self.api.models_get(model_id)
+        self.api.models_delete(model_id)
+        self.api.models_register(
+            model_id,
+            {p['key'] : p['value'] for p in model['properties']},
+            model['parameters'],
+            model['outputs'],
+            model['connector']
+        )
+        run_id = self.create_model_run(experiment_id, model_id, 'Run 3')
+        run = self.api.db.experiments_predictions_get(experiment_id, run_id)
+        self.assertTrue(run.state.is_idle)
+        self.assertEqual(len(self.api.broker.published), 2)
+
     def test_image_group_serialization(self):
         """Test creation and serialization for image groups."""
         response = self.api.images_create(IMAGES_FILE)
@@ -127,6 +259,27 @@ class TestSCOAPI(unittest.TestCase):
         subject = self.api.subjects_get(subject_item['id'])
         self.verify_object_handle(subject)
 
+    def create_experiment(self, fmri=False):
+        """Create subject, image group, and an experiment for them (with
+        fMRI data if requested). Returns the identifiers of the three objects.
+        """
+        self.api.subjects_create(SUBJECT_FILE)
+        subject_id = self.api.subjects_list()['items'][0]['id']
+        self.api.images_create(IMAGES_FILE)
+        image_group_id = self.api.image_groups_list()['items'][0]['id']
+        self.api.experiments_create(subject_id, image_group_id, {'name':'Test'})
+        experiment_id = self.api.experiments_list()['items'][0]['id']
+        if fmri:
+            self.api.experiments_fmri_create(experiment_id, FMRI_FILE)
+        return subject_id, image_group_id, experiment_id
+
+    def create_model_run(self, experiment_id, model_id, name):
+        """Create a model run and return its identifier."""
+        self.api.experiments_predictions_create(experiment_id, model_id, name)
+        for item in self.api.experiments_predictions_list(experiment_id)['items']:
+            if item['name'] == name:
+                return item['id']
+
     def verify_listing_item(self, item):
         """Verify that an item in a object listing has all relevant elements"""
         self.assertEqual(len(item), 4)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scodata.attribute import AttributeDefinition, FloatType
+from scodata.modelrun import DefaultModelRunManager
+from scoserv.batch import build_model_runs, delete_model_runs, expand_grid
+from scoserv.batch import insert_model_runs
+from scoserv.batch import ModelRunSpec, MAX_BATCH_SIZE
+from scoserv.memdb import InMemoryMongoDBFactory
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_create_model_runs(self):
+        """Test building, inserting, and erasing a batch of model runs."""
+        base_dir = tempfile.mkdtemp()
+        try:
+            db = InMemoryMongoDBFactory(db_name='test_sco').get_database()
+            store = DefaultModelRunManager(db.predictions, base_dir)
+            parameters = [AttributeDefinition('sigma', 'sigma', '', FloatType())]
+            runs = expand_grid('Sweep', [{'name' : 'sigma', 'values' : [0.5, 1.0, 2.0]}])
+            model_runs = build_model_runs(store, 'E1', 'M1', parameters, runs)
+            # Identifiers are known before the runs are inserted
+            self.assertEquals(store.collection.count(), 0)
+            insert_model_runs(store, model_runs)
+            self.assertEquals(store.collection.count({'active' : True}), 3)
+            model_run = store.get_object(model_runs[2].identifier)
+            self.assertEquals(model_run.name, 'Sweep (sigma=2.0)')
+            self.assertEquals(model_run.experiment_id, 'E1')
+            self.assertTrue(model_run.state.is_idle)
+            self.assertEquals(model_run.arguments['sigma'].value, 2.0)
+            self.assertTrue(os.path.isdir(model_run.directory))
+            # Erase all runs of the batch
+            delete_model_runs(store, model_runs)
+            self.assertEquals(store.collection.count(), 0)
+            self.assertFalse(os.path.isdir(model_run.directory))
+        finally:
+            shutil.rmtree(base_dir)
+
+    def test_expand_grid(self):
+        """Test creating run specifications from a parameter grid."""
+        runs = expand_grid(
+            'Sweep',
+            [
+                {'name' : 'sigma', 'values' : [0.5, 1.0]},
+                {'name' : 'gain', 'values' : [1, 2, 4]}
+            ],
+            arguments=[
+                {'name' : 'fixed', 'value' : 1},
+                {'name' : 'gain', 'value' : 0}
+            ],
+            properties={'project' : 'sweep'}
+        )
+        self.assertEquals(len(runs), 6)
+        self.assertEquals(runs[0].name, 'Sweep (sigma=0.5, gain=1)')
+        self.assertEquals(runs[5].name, 'Sweep (sigma=1.0, gain=4)')
+        # Swept parameters replace fixed arguments with the same name
+        self.assertEquals(
+            runs[1].arguments,
+            [
+                {'name' : 'fixed', 'value' : 1},
+                {'name' : 'sigma', 'value' : 0.5},
+                {'name' : 'gain', 'value' : 2}
+            ]
+        )
+        self.assertEquals(runs[0].properties, {'project' : 'sweep'})
+
+    def test_expand_grid_unicode(self):
+        """Test parameter grids with non-ASCII names and values."""
+        runs = expand_grid(
+            u'Sweep',
+            [{'name' : u'r\xe9gion', 'values' : [u'\xe9', u'V1']}]
+        )
+        self.assertEquals(runs[0].name, u'Sweep (r\xe9gion=\xe9)')
+        self.assertEquals(runs[1].name, u'Sweep (r\xe9gion=V1)')
+        self.assertEquals(
+            runs[0].arguments,
+            [{'name' : u'r\xe9gion', 'value' : u'\xe9'}]
+        )
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', [
+                {'name' : u'r\xe9gion', 'values' : [u'\xe9']},
+                {'name' : u'r\xe9gion', 'values' : [u'V1']}
+            ])
+
+    def test_invalid_arguments(self):
+        """Test that runs with arguments that are not a list of Json objects
+        are rejected before any run is created."""
+        for arguments in [{'name' : 'sigma', 'value' : 1}, ['x'], None]:
+            with self.assertRaises(ValueError):
+                build_model_runs(None, 'E1', 'M1', [], [ModelRunSpec('Run', arguments)])
+
+    def test_invalid_grid(self):
+        """Test invalid and oversized parameter grids."""
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', [])
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', [{'name' : 'sigma', 'values' : []}])
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', [
+                {'name' : 'sigma', 'values' : [1]},
+                {'name' : 'sigma', 'values' : [2]}
+            ])
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', [
+                {'name' : 'a', 'values' : range(MAX_BATCH_SIZE)},
+                {'name' : 'b', 'values' : [1, 2]}
+            ])
+        # Grid and arguments have to be lists of Json objects
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', [1])
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', {'name' : 'sigma', 'values' : [1]})
+        with self.assertRaises(ValueError):
+            expand_grid('Sweep', [{'name' : 'sigma', 'values' : [1]}], arguments=['x'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.content import ContentPage
+
+
+class TestContentPage(unittest.TestCase):
+
+    def setUp(self):
+        """Create temporary directory for page content files."""
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'page.html')
+        self.write_body('Hello World')
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def get_page(self, ttl):
+        """Create content page for the temporary file."""
+        return ContentPage(
+            {
+                'id' : 'page',
+                'label' : 'Page',
+                'title' : 'My Page',
+                'sortOrder' : 0,
+                'resource' : self.filename
+            },
+            ttl=ttl
+        )
+
+    def write_body(self, body, mtime=None):
+        """Write page body to the temporary file."""
+        with open(self.filename, 'w') as f:
+            f.write(body)
+        if not mtime is None:
+            os.utime(self.filename, (mtime, mtime))
+
+    def test_cached_body(self):
+        """Test that the page body is served from cache while fresh."""
+        page = self.get_page(3600)
+        self.assertEqual(page.body, 'Hello World')
+        self.write_body('Bye')
+        self.assertEqual(page.body, 'Hello World')
+
+    def test_revalidate_body(self):
+        """Test that the page body is read again once modified."""
+        page = self.get_page(3600)
+        self.assertEqual(page.body, 'Hello World')
+        # Refresh without modification keeps the body
+        page.refresh()
+        self.assertEqual(page.body, 'Hello World')
+        self.write_body('Bye', mtime=time.time() + 10)
+        page.refresh()
+        self.assertEqual(page.body, 'Bye')
+
+    def test_uncached_body(self):
+        """Test reading the body on every access if caching is disabled."""
+        page = self.get_page(0)
+        self.assertEqual(page.body, 'Hello World')
+        self.write_body('Bye', mtime=time.time() + 10)
+        self.assertEqual(page.body, 'Bye')
+
+    def test_invalid_descriptor(self):
+        """Test error for invalid page descriptors."""
+        with self.assertRaises(ValueError):
+            ContentPage({'id' : 'page'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from pymongo import MongoClient
+from scodata.mongo import MongoDBFactory
+from scoserv.dispatch import BatchPublishError, EngineBroker, InProcessBroker
+from scoserv.dispatch import Outbox, OutboxDispatcher, LEASE_TIME
+
+
+class Engine(object):
+    """Engine with models that do not use the RabbitMQ connector. Fails for
+    runs with a given identifier."""
+    def __init__(self, fail_run):
+        self.fail_run = fail_run
+        self.runs = []
+
+    def get_model(self, model_id):
+        return Model()
+
+    def run_model(self, model_run, url):
+        if model_run.identifier == self.fail_run:
+            raise RuntimeError('engine unavailable')
+        self.runs.append(model_run.identifier)
+
+
+class Model(object):
+    """Model with an in-process connector."""
+    def __init__(self):
+        self.connector = {'connector' : 'inprocess'}
+
+
+class ModelRun(object):
+    """Model run handle containing the attributes used by the dispatcher."""
+    def __init__(self, identifier, experiment_id, model_id='M1'):
+        self.identifier = identifier
+        self.experiment_id = experiment_id
+        self.model_id = model_id
+
+
+class ModelRunCollection(object):
+    """Model run store and collection that count the queries for runs."""
+    def __init__(self, runs):
+        self.runs = runs
+        self.queries = 0
+
+    @property
+    def collection(self):
+        return self
+
+    def find(self, query):
+        self.queries += 1
+        return [{'_id' : r} for r in query['_id']['$in'] if r in self.runs]
+
+    def from_dict(self, document):
+        return self.runs[document['_id']]
+
+
+class ModelRunStore(object):
+    """Minimal data store with the model run methods used by the dispatcher."""
+    def __init__(self, runs):
+        self.runs = {run.identifier : run for run in runs}
+        self.predictions = ModelRunCollection(self.runs)
+        self.errors = {}
+
+    def experiments_predictions_update_state_error(self, experiment_id, run_id, errors):
+        self.errors[run_id] = errors
+
+
+class PartialBroker(InProcessBroker):
+    """Broker that fails after publishing a given number of runs."""
+    def __init__(self, limit):
+        super(PartialBroker, self).__init__()
+        self.limit = limit
+
+    def publish_many(self, model_runs, urls):
+        count = min(self.limit, len(model_runs))
+        super(PartialBroker, self).publish_many(model_runs[:count], urls[:count])
+        if count < len(model_runs):
+            raise BatchPublishError(count, 'connection lost')
+
+
+class TestOutboxDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        """Initialize the MongoDB database."""
+        MongoClient().drop_database('test_sco')
+        self.outbox = Outbox(MongoDBFactory(db_name='test_sco'))
+        self.runs = [ModelRun('R' + str(i), 'E1') for i in range(5)]
+        self.db = ModelRunStore(self.runs)
+
+    def tearDown(self):
+        """Delete the database."""
+        MongoClient().drop_database('test_sco')
+
+    def test_dispatch_batches(self):
+        """Test dispatching outbox entries in batches."""
+        for run in self.runs:
+            self.outbox.add(run, 'http://' + run.identifier)
+        broker = InProcessBroker()
+        dispatcher = OutboxDispatcher(self.outbox, self.db, broker, batch_size=2)
+        self.assertEquals(dispatcher.dispatch_pending(), 5)
+        self.assertEquals(len(broker.published), 5)
+        self.assertEquals(self.outbox.collection.count(), 0)
+        # The runs of each batch are retrieved with a single query
+        self.assertEquals(self.db.predictions.queries, 3)
+        # Entries cannot be claimed twice
+        self.outbox.add(self.runs[0], 'http://R0')
+        self.assertEquals(len(self.outbox.claim(10)), 1)
+        self.assertEquals(len(self.outbox.claim(10)), 0)
+
+    def test_dispatch_retries(self):
+        """Test retries and failure of model runs that cannot be published."""
+        self.outbox.add(self.runs[0], 'http://R0')
+        broker = InProcessBroker(failures=2)
+        dispatcher = OutboxDispatcher(self.outbox, self.db, broker, max_attempts=2)
+        self.assertEquals(dispatcher.dispatch_pending(), 0)
+        entry = self.outbox.collection.find_one({'_id' : 'R0'})
+        self.assertEquals(entry['attempts'], 1)
+        self.assertEquals(entry['lastError'], 'broker unavailable')
+        # Make the entry due for the next attempt
+        self.outbox.collection.update_one(
+            {'_id' : 'R0'},
+            {'$set' : {'nextAttempt' : entry['createdAt']}}
+        )
+        self.assertEquals(dispatcher.dispatch_pending(), 0)
+        self.assertEquals(self.db.errors['R0'], ['broker unavailable'])
+        self.assertEquals(self.outbox.collection.count(), 0)
+        self.assertEquals(len(broker.published), 0)
+
+    def test_dispatch_partial_batch(self):
+        """Test that only the unpublished runs of a batch are retried."""
+        for run in self.runs:
+            self.outbox.add(run, 'http://' + run.identifier)
+        broker = PartialBroker(3)
+        dispatcher = OutboxDispatcher(self.outbox, self.db, broker, batch_size=5)
+        self.assertEquals(dispatcher.dispatch_pending(), 3)
+        self.assertEquals(len(broker.published), 3)
+        entries = list(self.outbox.collection.find())
+        self.assertEquals(len(entries), 2)
+        for entry in entries:
+            self.assertEquals(entry['attempts'], 1)
+            self.assertEquals(entry['lastError'], 'connection lost')
+        published = set([run_id for run_id, _ in broker.published])
+        self.assertFalse(published & set([entry['_id'] for entry in entries]))
+
+    def test_dispatch_missing_runs(self):
+        """Test that entries for runs that have not been inserted yet are
+        kept until the lease time after their creation has passed.
+        """
+        self.outbox.add(ModelRun('R9', 'E1'), 'http://R9')
+        broker = InProcessBroker()
+        dispatcher = OutboxDispatcher(self.outbox, self.db, broker)
+        self.assertEquals(dispatcher.dispatch_pending(), 0)
+        self.assertEquals(self.outbox.collection.count(), 1)
+        # Expire the lease and make the entry old
+        created_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=2 * LEASE_TIME)
+        self.outbox.collection.update_one(
+            {'_id' : 'R9'},
+            {'$set' : {'createdAt' : created_at, 'leaseUntil' : created_at, 'nextAttempt' : created_at}}
+        )
+        self.assertEquals(dispatcher.dispatch_pending(), 0)
+        self.assertEquals(self.outbox.collection.count(), 0)
+        self.assertEquals(len(broker.published), 0)
+
+    def test_engine_publish_many(self):
+        """Test the number of published runs for failed batches."""
+        engine = Engine('R2')
+        broker = EngineBroker(engine)
+        with self.assertRaises(BatchPublishError) as cm:
+            broker.publish_many(self.runs, [''] * len(self.runs))
+        self.assertEquals(cm.exception.count, 2)
+        self.assertEquals(cm.exception.message, 'engine unavailable')
+        self.assertEquals(engine.runs, ['R0', 'R1'])
+
+    def test_lazy_start(self):
+        """Test that the dispatcher thread is started on first use only."""
+        dispatcher = OutboxDispatcher(self.outbox, self.db, InProcessBroker())
+        self.assertIsNone(dispatcher.thread)
+        dispatcher.notify()
+        thread = dispatcher.thread
+        self.assertTrue(thread.is_alive())
+        dispatcher.start()
+        dispatcher.notify()
+        self.assertIs(dispatcher.thread, thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from flask import Flask
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.download import DownloadOffload, content_disposition, send_download
+
+
+CONTENT = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        """Create temporary file and app that serves the file."""
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'data.txt')
+        with open(self.filename, 'w') as f:
+            f.write(CONTENT)
+        self.offload = None
+        self.attachment_filename = 'data.txt'
+        app = Flask(__name__)
+        @app.route('/download')
+        def download():
+            return send_download(
+                self.filename,
+                'text/plain',
+                self.attachment_filename,
+                offload=self.offload
+            )
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def test_conditional_get(self):
+        """Test ETag and Last-Modified validation."""
+        response = self.client.get('/download')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        response = self.client.get('/download', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        response = self.client.get('/download', headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/download',
+            headers={'If-Modified-Since': last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+        # The entity tag changes if the file is modified
+        os.utime(self.filename, (0, 0))
+        response = self.client.get('/download', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_range_requests(self):
+        """Test single and multiple range requests."""
+        response = self.client.get('/download', headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, 'CDEF')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/26')
+        response = self.client.get('/download', headers={'Range': 'bytes=-3'})
+        self.assertEqual(response.data, 'XYZ')
+        response = self.client.get('/download', headers={'Range': 'bytes=0-1,24-'})
+        self.assertEqual(response.status_code, 206)
+        content_type = response.headers['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/byteranges'))
+        boundary = content_type.split('boundary=')[1]
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+        parts = response.data.split('--' + boundary)
+        self.assertEqual(len(parts), 4)
+        self.assertTrue(parts[1].endswith('\r\n\r\nAB\r\n'))
+        self.assertTrue('Content-Range: bytes 24-25/26' in parts[2])
+        self.assertTrue(parts[2].endswith('\r\n\r\nYZ\r\n'))
+        response = self.client.get('/download', headers={'Range': 'bytes=30-40'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */26')
+        # Ranges are ignored if the If-Range condition does not match
+        response = self.client.get(
+            '/download',
+            headers={'Range': 'bytes=2-5', 'If-Range': '"other"'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT)
+
+    def test_content_disposition(self):
+        """Test that file names in the Content-Disposition header are
+        quoted for all types of responses."""
+        self.attachment_filename = 'my "data"; x.txt'
+        expected = 'attachment; filename="my \\"data\\"; x.txt"'
+        self.assertEqual(content_disposition(self.attachment_filename), expected)
+        response = self.client.get('/download')
+        self.assertEqual(response.headers['Content-Disposition'], expected)
+        response = self.client.get('/download', headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.headers['Content-Disposition'], expected)
+        self.offload = DownloadOffload('x-sendfile', self.directory)
+        response = self.client.get('/download')
+        self.assertEqual(response.headers['Content-Disposition'], expected)
+        # Non-ASCII file names
+        value = content_disposition(u'd\xe4ta.txt'.encode('utf-8'))
+        params = sorted(value.split('; '))
+        self.assertEqual(
+            params,
+            ['attachment', 'filename*=UTF-8\'\'d%C3%A4ta.txt', 'filename=data.txt']
+        )
+
+    def test_offload(self):
+        """Test headers for downloads that are offloaded to the proxy."""
+        self.offload = DownloadOffload(
+            'x-accel-redirect',
+            self.directory,
+            prefix='/protected/'
+        )
+        response = self.client.get('/download')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, '')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected/data.txt')
+        self.assertEqual(response.headers['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertTrue('data.txt' in response.headers['Content-Disposition'])
+        self.offload = DownloadOffload('x-sendfile', self.directory)
+        response = self.client.get('/download')
+        self.assertEqual(response.headers['X-Sendfile'], self.filename)
+        self.assertFalse('X-Accel-Redirect' in response.headers)
+        # Files outside of the data store directory are sent by the server
+        self.offload = DownloadOffload('x-sendfile', os.path.join(self.directory, 'sub'))
+        response = self.client.get('/download')
+        self.assertFalse('X-Sendfile' in response.headers)
+        self.assertEqual(response.data, CONTENT)
+        with self.assertRaises(ValueError):
+            DownloadOffload('unknown', self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import gzip
+import json
+import os
+import StringIO
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from flask import Flask, Request, Response, request
+from werkzeug.exceptions import BadRequest
+from scoserv.encoding import JsonEncoder, MessagePackEncoder, MessagePackRequestMixin
+from scoserv.encoding import ResponseCompressor, ResponseEncoder
+from scoserv.encoding import parse_accept_encoding
+
+
+class MessagePackRequest(MessagePackRequestMixin, Request):
+    msgpack = MessagePackEncoder()
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_compress_response(self):
+        """Test compression of responses depending on size, type, and
+        accepted encodings."""
+        compressor = ResponseCompressor(encodings=['gzip'], min_size=100)
+        body = json.dumps({'items' : [{'id' : str(i)} for i in range(100)]})
+        # Compressed if gzip is accepted
+        response = Response(body, mimetype='application/json')
+        compressor.compress_response(response, 'gzip, deflate')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertTrue('Accept-Encoding' in response.vary)
+        self.assertTrue(response.content_length < len(body))
+        f = gzip.GzipFile(fileobj=StringIO.StringIO(response.get_data()))
+        self.assertEqual(f.read(), body)
+        # Responses for created and accepted resources are compressed as well
+        for status in [201, 202]:
+            response = Response(body, status=status, mimetype='application/json')
+            compressor.compress_response(response, 'gzip')
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        # Not compressed if gzip is not accepted
+        for accept_encoding in [None, 'deflate', 'gzip;q=0']:
+            response = Response(body, mimetype='application/json')
+            compressor.compress_response(response, accept_encoding)
+            self.assertFalse('Content-Encoding' in response.headers)
+            self.assertEqual(response.get_data(), body)
+        # Not compressed if the body is too small
+        response = Response('{}', mimetype='application/json')
+        compressor.compress_response(response, 'gzip')
+        self.assertFalse('Content-Encoding' in response.headers)
+        # Not compressed for error responses
+        response = Response(body, status=400, mimetype='application/json')
+        compressor.compress_response(response, 'gzip')
+        self.assertFalse('Content-Encoding' in response.headers)
+        # Not compressed for binary content, partial content, or streams
+        response = Response(body, mimetype='image/png')
+        compressor.compress_response(response, 'gzip')
+        self.assertFalse('Content-Encoding' in response.headers)
+        response = Response(body, status=206, mimetype='text/plain')
+        compressor.compress_response(response, 'gzip')
+        self.assertFalse('Content-Encoding' in response.headers)
+        response = Response(iter([body]), mimetype='text/event-stream')
+        compressor.compress_response(response, 'gzip')
+        self.assertFalse('Content-Encoding' in response.headers)
+
+    def test_json_encoder(self):
+        """Test compact Json responses and unknown encoders."""
+        obj = {'links' : [{'href' : 'http://x/y'}]}
+        self.assertEqual(JsonEncoder().dumps(obj), '{"links":[{"href":"http://x/y"}]}')
+        with self.assertRaises(ValueError):
+            JsonEncoder('unknown')
+
+    def test_msgpack_request(self):
+        """Test decoding of MessagePack and Json request bodies."""
+        app = Flask(__name__)
+        app.request_class = MessagePackRequest
+        obj = {'model' : 'm', 'arguments' : [{'name' : 'sigma', 'value' : 0.5}]}
+        body = MessagePackEncoder().dumps(obj)
+        with app.test_request_context('/', method='POST', data=body, content_type='application/msgpack'):
+            self.assertEqual(request.json, obj)
+            self.assertTrue(isinstance(request.json['model'], unicode))
+        with app.test_request_context('/', method='POST', data=json.dumps(obj), content_type='application/json'):
+            self.assertEqual(request.json, obj)
+        with app.test_request_context('/', method='POST', data='\xc1', content_type='application/msgpack'):
+            self.assertIsNone(request.get_json(silent=True))
+            with self.assertRaises(BadRequest):
+                request.json
+
+    def test_response_negotiation(self):
+        """Test selection of the response format."""
+        app = Flask(__name__)
+        obj = {'name' : 'Test', 'items' : [1, 2, 3]}
+        encoder = ResponseEncoder(JsonEncoder(), msgpack_encoder=MessagePackEncoder())
+        with app.test_request_context('/', headers={'Accept' : 'application/msgpack'}):
+            response = encoder.jsonify(obj)
+            self.assertEqual(response.mimetype, 'application/msgpack')
+            self.assertEqual(MessagePackEncoder().loads(response.get_data()), obj)
+            self.assertTrue('Accept' in response.vary)
+        for accept in [None, '*/*', 'application/json', 'application/json, application/msgpack']:
+            headers = {'Accept' : accept} if not accept is None else {}
+            with app.test_request_context('/', headers=headers):
+                response = encoder.jsonify(obj)
+                self.assertEqual(response.mimetype, 'application/json')
+                self.assertEqual(json.loads(response.get_data()), obj)
+        # Json only if MessagePack is disabled
+        encoder = ResponseEncoder(JsonEncoder())
+        with app.test_request_context('/', headers={'Accept' : 'application/msgpack'}):
+            self.assertEqual(encoder.jsonify(obj).mimetype, 'application/json')
+
+    def test_negotiate(self):
+        """Test selection of the content coding."""
+        compressor = ResponseCompressor(encodings=['gzip'])
+        self.assertEqual(compressor.negotiate('gzip'), 'gzip')
+        self.assertEqual(compressor.negotiate('*'), 'gzip')
+        self.assertEqual(compressor.negotiate('br;q=1.0, gzip;q=0.5'), 'gzip')
+        self.assertIsNone(compressor.negotiate('br'))
+        self.assertIsNone(compressor.negotiate('*;q=0'))
+        self.assertIsNone(compressor.negotiate(''))
+        with self.assertRaises(ValueError):
+            ResponseCompressor(encodings=['deflate'])
+
+    def test_parse_accept_encoding(self):
+        """Test parsing Accept-Encoding header values."""
+        accepted = parse_accept_encoding('GZIP;q=0.8, br, identity; q=0')
+        self.assertEqual(accepted, {'gzip' : 0.8, 'br' : 1.0, 'identity' : 0.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
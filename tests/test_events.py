@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.events import EventBus, StreamLimitExceeded, event_stream
+
+
+def state_event(experiment_id, run_id, state):
+    """Create state event for a model run."""
+    return {
+        'type' : 'state',
+        'experiment' : experiment_id,
+        'run' : run_id,
+        'state' : state
+    }
+
+
+class TestEventBus(unittest.TestCase):
+
+    def test_subscriptions(self):
+        """Test delivering events to matching subscriptions."""
+        bus = EventBus()
+        run_sub = bus.subscribe('E1', run_id='R1')
+        exp_sub = bus.subscribe('E1')
+        bus.publish(state_event('E1', 'R1', 'RUNNING'))
+        bus.publish(state_event('E1', 'R2', 'RUNNING'))
+        bus.publish(state_event('E2', 'R3', 'RUNNING'))
+        self.assertEquals(run_sub.get(0)['run'], 'R1')
+        self.assertIsNone(run_sub.get(0))
+        self.assertEquals(exp_sub.get(0)['run'], 'R1')
+        self.assertEquals(exp_sub.get(0)['run'], 'R2')
+        self.assertIsNone(exp_sub.get(0))
+        bus.unsubscribe(run_sub)
+        bus.publish(state_event('E1', 'R1', 'SUCCESS'))
+        self.assertIsNone(run_sub.get(0))
+
+    def test_subscription_limit(self):
+        """Test that subscriptions beyond the maximum are rejected."""
+        bus = EventBus(max_subscriptions=2)
+        sub = bus.subscribe('E1')
+        bus.subscribe('E1', run_id='R1')
+        with self.assertRaises(StreamLimitExceeded):
+            bus.subscribe('E2')
+        # Closed streams release their slot
+        bus.unsubscribe(sub)
+        bus.subscribe('E2')
+
+    def test_event_stream(self):
+        """Test streaming events until the model run has finished."""
+        bus = EventBus()
+        subscription = bus.subscribe('E1', run_id='R1')
+        bus.publish(state_event('E1', 'R1', 'SUCCESS'))
+        stream = event_stream(
+            bus,
+            subscription,
+            initial_events=[state_event('E1', 'R1', 'RUNNING')],
+            until_finished=True
+        )
+        messages = list(stream)
+        self.assertEquals(len(messages), 2)
+        self.assertTrue(messages[0].startswith('event: state\ndata: '))
+        self.assertTrue('"SUCCESS"' in messages[1])
+        # The subscription is removed when the stream is closed
+        self.assertEquals(len(bus.subscriptions), 0)
+        # Keep-alive comments are sent while there are no events
+        subscription = bus.subscribe('E1', run_id='R1')
+        stream = event_stream(bus, subscription, keepalive=0.01, timeout=0.05)
+        messages = list(stream)
+        self.assertTrue(len(messages) > 0)
+        self.assertEquals(messages[0], ': keepalive\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
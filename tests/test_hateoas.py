@@ -0,0 +1,110 @@
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scodata.datastore import PROPERTY_FILENAME, PROPERTY_NAME
+from scodata.experiment import TYPE_EXPERIMENT
+from scodata.image import TYPE_IMAGE, TYPE_IMAGE_GROUP
+from scodata.modelrun import TYPE_MODEL_RUN
+from scodata.modelrun import STATE_FAILED, STATE_IDLE, STATE_RUNNING, STATE_SUCCESS
+from scodata.subject import TYPE_SUBJECT
+from scoserv.hateoas import HATEOASReferenceFactory, PaginationReferenceFactory
+from scoserv.hateoas import to_references, LINKS_RELATIVE
+from scoserv.listing import ListingPage, ObjectSummary, RunStateSummary
+from scoserv.listing import COUNT_EXACT
+from scoserv.widget import TYPE_WIDGET
+
+
+def get_objects():
+    """Object summaries for all object types and model run states."""
+    now = datetime.datetime.utcnow()
+    props = {PROPERTY_NAME : 'Name', PROPERTY_FILENAME : 'file%20.tar.gz'}
+    objects = [
+        ObjectSummary('E1', now, props, TYPE_EXPERIMENT),
+        ObjectSummary('E2', now, props, TYPE_EXPERIMENT, fmri_data_id='F2'),
+        ObjectSummary('I1', now, props, TYPE_IMAGE),
+        ObjectSummary('G1', now, props, TYPE_IMAGE_GROUP),
+        ObjectSummary('S1', now, props, TYPE_SUBJECT),
+        ObjectSummary('W1', now, props, TYPE_WIDGET)
+    ]
+    for state in [STATE_IDLE, STATE_RUNNING, STATE_FAILED, STATE_SUCCESS]:
+        objects.append(
+            ObjectSummary(
+                'R-' + state,
+                now,
+                props,
+                TYPE_MODEL_RUN,
+                experiment_id='E1',
+                state=RunStateSummary(state)
+            )
+        )
+    return objects
+
+
+class TestHATEOAS(unittest.TestCase):
+
+    def test_link_templates(self):
+        """Test that references that are generated from link templates are
+        identical to the references of the object's reference dictionary.
+        """
+        refs = HATEOASReferenceFactory('http://localhost%3A5000/api/', 'doc')
+        # Generate references twice to use compiled templates
+        for i in range(2):
+            for obj in get_objects():
+                self.assertEquals(
+                    sorted([(r['rel'], r['href']) for r in refs.object_references(obj)]),
+                    sorted([(r['rel'], r['href']) for r in to_references(refs.reference_dictionary(obj))])
+                )
+        # One template per object type, experiment with and without fMRI
+        # data, and model run state
+        self.assertEquals(len(refs.templates), 10)
+
+    def test_model_run_links(self):
+        """Test model run references for different states."""
+        refs = HATEOASReferenceFactory('http://localhost/api', 'doc')
+        links = {}
+        for obj in get_objects():
+            if obj.type == TYPE_MODEL_RUN:
+                links[obj.identifier] = {
+                    r['rel'] : r['href'] for r in refs.object_references(obj)
+                }
+        self_ref = 'http://localhost/api/experiments/E1/predictions/R-' + STATE_IDLE
+        self.assertEquals(links['R-' + STATE_IDLE]['self'], self_ref)
+        self.assertEquals(links['R-' + STATE_IDLE]['state.active'], self_ref + '/state/active')
+        self.assertFalse('state.active' in links['R-' + STATE_RUNNING])
+        self.assertTrue('state.success' in links['R-' + STATE_RUNNING])
+        self.assertFalse('state.error' in links['R-' + STATE_FAILED])
+        self.assertFalse('download' in links['R-' + STATE_FAILED])
+        self.assertTrue(links['R-' + STATE_SUCCESS]['download'].endswith('/result'))
+        self.assertFalse('state.success' in links['R-' + STATE_SUCCESS])
+
+    def test_relative_links(self):
+        """Test references in relative reference mode."""
+        refs = HATEOASReferenceFactory(
+            'http://localhost:5000/sco-server/api/v1/',
+            'http://localhost/doc',
+            links=LINKS_RELATIVE
+        )
+        links = {
+            r['rel'] : r['href'] for r in refs.object_references(get_objects()[0])
+        }
+        self.assertEquals(links['self'], '/sco-server/api/v1/experiments/E1')
+        # Navigation references keep the reference mode
+        nav = PaginationReferenceFactory(
+            ListingPage([], 0, 10, 100, COUNT_EXACT, True),
+            None,
+            refs.experiments_reference(),
+            links=LINKS_RELATIVE
+        ).navigation_references()
+        nav = {r['rel'] : r['href'] for r in nav}
+        self.assertEquals(
+            nav['next'],
+            '/sco-server/api/v1/experiments?offset=10&limit=10&links=relative'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import base64
+import json
+import os
+import sys
+import unittest
+import urllib
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scodata.datastore import PROPERTY_FILENAME, PROPERTY_NAME
+from scodata.experiment import TYPE_EXPERIMENT, PROPERTY_RUN_COUNT
+from scodata.image import TYPE_IMAGE_GROUP, PROPERTY_GROUPSIZE
+from scodata.modelrun import TYPE_MODEL_RUN, STATE_SUCCESS
+from scodata.subject import TYPE_SUBJECT
+from scoserv.hateoas import PaginationReferenceFactory
+from scoserv.listing import COUNT_ESTIMATED, COUNT_EXACT, COUNT_NONE
+from scoserv.listing import count_objects, decode_cursor, encode_cursor
+from scoserv.listing import list_objects, set_run_counts, summary_projection
+from scoserv.memdb import InMemoryMongoDBFactory
+
+LISTING_URL = 'http://localhost/subjects'
+
+
+class ObjectStore(object):
+    """Object store containing the collection used by listings."""
+    def __init__(self, collection):
+        self.collection = collection
+
+
+class TestListing(unittest.TestCase):
+
+    def setUp(self):
+        """Create collection with active and deleted objects. Groups of three
+        objects share the same timestamp.
+        """
+        db = InMemoryMongoDBFactory(db_name='test_sco').get_database()
+        self.store = ObjectStore(db.subjects)
+        for i in range(12):
+            self.store.collection.insert_one(
+                subject_document('S' + str(i).zfill(2), i / 3, True)
+            )
+        for i in range(12, 14):
+            self.store.collection.insert_one(
+                subject_document('S' + str(i).zfill(2), 0, False)
+            )
+
+    def test_count_objects(self):
+        """Test that deleted objects are not included in object counts."""
+        query = {'active' : True}
+        self.assertEquals(count_objects(self.store, query, COUNT_EXACT), 12)
+        self.assertEquals(count_objects(self.store, query, COUNT_ESTIMATED), 12)
+        self.assertIsNone(count_objects(self.store, query, COUNT_NONE))
+
+    def test_cursor_encoding(self):
+        """Test cursor round trip and rejection of invalid cursors."""
+        doc = subject_document('S01', 1, True)
+        timestamp, identifier = decode_cursor(encode_cursor(doc))
+        self.assertEquals(timestamp, doc['timestamp'])
+        self.assertEquals(identifier, 'S01')
+        for cursor in ['abc', 'not a cursor!', encode_cursor(doc)[:-4]]:
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+        # Only pairs of strings are valid cursors
+        for value in [
+            {'a' : 1, 'b' : 2},
+            'ab',
+            [{'$gt' : ''}, 'x'],
+            ['2017-01-01T00:00:01.000000', 1],
+            ['2017-01-01T00:00:01.000000', 'S01', 'S02']
+        ]:
+            with self.assertRaises(ValueError):
+                decode_cursor(base64.urlsafe_b64encode(json.dumps(value)))
+        with self.assertRaises(ValueError):
+            list_objects(self.store, TYPE_SUBJECT, limit=5, cursor='abc')
+
+    def test_cursor_pagination(self):
+        """Test that walking all pages of a listing using cursors returns
+        every active object exactly once in listing order.
+        """
+        for limit in [1, 2, 3, 4, 5, 12, 20]:
+            identifiers = []
+            cursor = ''
+            pages = 0
+            while not cursor is None:
+                page = list_objects(self.store, TYPE_SUBJECT, limit=limit, cursor=cursor)
+                self.assertEquals(page.offset, -1)
+                self.assertTrue(len(page.items) <= limit)
+                identifiers.extend([obj.identifier for obj in page.items])
+                # There is a next page if and only if objects remain
+                self.assertEquals(page.has_more, len(identifiers) < 12)
+                self.assertEquals(page.next_cursor is None, not page.has_more)
+                cursor = page.next_cursor
+                pages += 1
+            self.assertEquals(pages, max(1, (12 + limit - 1) / limit))
+            # Ordered by decreasing timestamp and identifier
+            self.assertEquals(
+                identifiers,
+                ['S' + str(i).zfill(2) for i in range(11, -1, -1)]
+            )
+
+    def test_cursor_references(self):
+        """Test navigation references for listings retrieved using a cursor."""
+        page = list_objects(self.store, TYPE_SUBJECT, limit=5, cursor='')
+        nav = navigation_references(page)
+        self.assertEquals(nav['first'], LISTING_URL + '?cursor=&limit=5')
+        self.assertFalse('last' in nav)
+        self.assertFalse('prev' in nav)
+        # The next reference contains the cursor for the next page
+        query = nav['next'][len(LISTING_URL) + 1:]
+        cursor = None
+        for para in query.split('&'):
+            key, value = para.split('=', 1)
+            if key == 'cursor':
+                cursor = urllib.unquote(value)
+        self.assertEquals(cursor, page.next_cursor)
+        page = list_objects(self.store, TYPE_SUBJECT, limit=5, cursor=cursor)
+        self.assertEquals(page.items[0].identifier, 'S06')
+        # The last page has no next reference
+        page = list_objects(self.store, TYPE_SUBJECT, limit=5, cursor=page.next_cursor)
+        self.assertEquals(len(page.items), 2)
+        nav = navigation_references(page)
+        self.assertTrue('first' in nav)
+        self.assertFalse('next' in nav)
+
+    def test_object_summaries(self):
+        """Test that object summaries contain the requested properties and
+        the fields that are needed for object references only.
+        """
+        db = self.store.collection.database
+        experiments = ObjectStore(db.experiments)
+        experiments.collection.insert_one({
+            '_id' : 'E1',
+            'timestamp' : '2017-01-01T00:00:00.000000',
+            'properties' : {PROPERTY_NAME : 'E1', 'project' : 'P', 'notes' : 'N'},
+            'subject' : 'S1',
+            'images' : 'G1',
+            'fmri' : 'F1',
+            'active' : True
+        })
+        page = list_objects(experiments, TYPE_EXPERIMENT, properties=['project'])
+        experiment = page.items[0]
+        self.assertEquals(experiment.type, TYPE_EXPERIMENT)
+        self.assertEquals(experiment.properties, {PROPERTY_NAME : 'E1', 'project' : 'P'})
+        self.assertEquals(experiment.fmri_data_id, 'F1')
+        # Model runs contain the experiment identifier and state type
+        predictions = ObjectStore(db.predictions)
+        predictions.collection.insert_one({
+            '_id' : 'R1',
+            'timestamp' : '2017-01-01T00:00:00.000000',
+            'properties' : {PROPERTY_NAME : 'R1', 'notes' : 'N'},
+            'experiment' : 'E1',
+            'model' : 'M1',
+            'state' : {'type' : STATE_SUCCESS, 'model_output' : 'O1'},
+            'arguments' : [],
+            'active' : True
+        })
+        page = list_objects(predictions, TYPE_MODEL_RUN)
+        model_run = page.items[0]
+        self.assertEquals(model_run.properties, {PROPERTY_NAME : 'R1'})
+        self.assertEquals(model_run.experiment_id, 'E1')
+        self.assertTrue(model_run.state.is_success)
+        self.assertFalse(model_run.state.is_failed)
+        doc = predictions.collection.find_one(
+            {},
+            summary_projection(TYPE_MODEL_RUN)
+        )
+        self.assertEquals(sorted(doc.keys()), ['_id', 'experiment', 'properties', 'state', 'timestamp'])
+        self.assertEquals(doc['state'], {'type' : STATE_SUCCESS})
+        # Subjects contain the file name. Property names that are paths or
+        # operators are ignored.
+        page = list_objects(
+            self.store,
+            TYPE_SUBJECT,
+            limit=1,
+            properties=['', 'a.b', '$where']
+        )
+        self.assertEquals(
+            sorted(page.items[0].properties.keys()),
+            [PROPERTY_FILENAME, PROPERTY_NAME]
+        )
+        projection = summary_projection(TYPE_SUBJECT, properties=['', 'a.b', '$where'])
+        self.assertEquals(
+            sorted(projection.keys()),
+            ['_id', 'properties.' + PROPERTY_FILENAME, 'properties.' + PROPERTY_NAME, 'timestamp']
+        )
+        # The image group size is derived from the group images
+        self.assertEquals(
+            summary_projection(TYPE_IMAGE_GROUP, properties=[PROPERTY_GROUPSIZE])['images.identifier'],
+            True
+        )
+
+    def test_run_counts(self):
+        """Test that run counts are computed for the experiments on a page
+        and exclude deleted runs.
+        """
+        db = self.store.collection.database
+        predictions = ObjectStore(db.predictions)
+        runs = [('E1', True), ('E1', True), ('E1', False), ('E2', True), ('E3', True)]
+        for i in range(len(runs)):
+            experiment_id, active = runs[i]
+            predictions.collection.insert_one({
+                '_id' : 'R' + str(i),
+                'experiment' : experiment_id,
+                'active' : active
+            })
+        experiments = ObjectStore(db.experiments)
+        for identifier in ['E1', 'E2', 'E4']:
+            experiments.collection.insert_one({
+                '_id' : identifier,
+                'timestamp' : '2017-01-01T00:00:00.000000',
+                'properties' : {PROPERTY_NAME : identifier},
+                'active' : True
+            })
+        page = list_objects(experiments, TYPE_EXPERIMENT)
+        set_run_counts(predictions, page.items)
+        counts = {e.identifier : e.properties[PROPERTY_RUN_COUNT] for e in page.items}
+        self.assertEquals(counts, {'E1' : 2, 'E2' : 1, 'E4' : 0})
+
+
+def navigation_references(page):
+    """Dictionary of navigation references for a listing page."""
+    nav = PaginationReferenceFactory(page, None, LISTING_URL).navigation_references()
+    return {r['rel'] : r['href'] for r in nav}
+
+
+def subject_document(identifier, second, active):
+    """Database document for a subject with the given timestamp second."""
+    return {
+        '_id' : identifier,
+        'timestamp' : '2017-01-01T00:00:' + str(second).zfill(2) + '.000000',
+        'properties' : {
+            PROPERTY_NAME : 'Subject ' + identifier,
+            PROPERTY_FILENAME : identifier + '.tar.gz'
+        },
+        'active' : active
+    }
+
+
+if __name__ == '__main__':
+    unittest.main()
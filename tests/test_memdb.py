@@ -0,0 +1,26 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.memdb import InMemoryMongoDBFactory
+
+
+class TestInMemoryDatabase(unittest.TestCase):
+
+    def test_shared_database(self):
+        """Test that all databases of a connector share their data."""
+        mongo = InMemoryMongoDBFactory(db_name='test_sco')
+        mongo.get_database().experiments.insert_one({'_id' : 'E1'})
+        db = mongo.get_database()
+        self.assertEquals(db.name, 'test_sco')
+        self.assertEquals(db.experiments.count(), 1)
+        self.assertIsNotNone(db.experiments.find_one({'_id' : 'E1'}))
+        # Databases of different connectors are independent
+        other = InMemoryMongoDBFactory(db_name='test_sco')
+        self.assertEquals(other.get_database().experiments.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.metrics import export_metrics, observe_request, UPLOAD_BYTES
+
+
+ROUTE = '/experiments/<string:experiment_id>'
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_export_metrics(self):
+        """Test recording and exporting request and transfer metrics."""
+        labels = {'method' : 'GET', 'route' : ROUTE, 'status' : '200'}
+        count = REGISTRY.get_sample_value('sco_http_requests_total', labels) or 0
+        uploaded = REGISTRY.get_sample_value('sco_upload_bytes_total')
+        observe_request('GET', ROUTE, 200, 0.02, 512)
+        observe_request('GET', None, 404, 0.001, None)
+        UPLOAD_BYTES.inc(1024)
+        self.assertEqual(
+            REGISTRY.get_sample_value('sco_http_requests_total', labels),
+            count + 1
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value('sco_upload_bytes_total'),
+            uploaded + 1024
+        )
+        # Responses of unknown size are not included in the size histogram
+        self.assertIsNone(
+            REGISTRY.get_sample_value(
+                'sco_http_response_size_bytes_count',
+                {'method' : 'GET', 'route' : 'unmatched'}
+            )
+        )
+        data, content_type = export_metrics()
+        self.assertTrue(content_type.startswith('text/plain'))
+        self.assertTrue('route="unmatched",status="404"' in data)
+        self.assertTrue('sco_http_request_duration_seconds_bucket' in data)
+
+
+if __name__ == '__main__':
+    unittest.main()
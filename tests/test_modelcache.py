@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.memdb import InMemoryMongoDBFactory
+from scoserv.modelcache import ModelCache, increment_version
+
+
+class Engine(object):
+    """Model registry that counts the number of model reads."""
+    def __init__(self, models):
+        self.models = models
+        self.reads = 0
+
+    def get_model(self, model_id):
+        self.reads += 1
+        return self.models[model_id] if model_id in self.models else None
+
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        """Create the shared in-memory database and the model registry."""
+        self.mongo = InMemoryMongoDBFactory(db_name='test_sco')
+        self.engine = Engine({'M1' : 'Model 1', 'M2' : 'Model 2'})
+
+    def test_cache_lookup(self):
+        """Test that models are read from the registry only once."""
+        cache = ModelCache(self.engine, self.mongo)
+        labels = {'result' : 'hit'}
+        hits = REGISTRY.get_sample_value('sco_model_cache_lookups_total', labels) or 0
+        self.assertEquals(cache.get_model('M1'), 'Model 1')
+        self.assertEquals(cache.get_model('M1'), 'Model 1')
+        self.assertEquals(cache.get_model('M2'), 'Model 2')
+        self.assertEquals(self.engine.reads, 2)
+        self.assertEquals(
+            REGISTRY.get_sample_value('sco_model_cache_lookups_total', labels),
+            hits + 1
+        )
+        # Unknown models are not cached
+        self.assertIsNone(cache.get_model('M3'))
+        self.assertIsNone(cache.get_model('M3'))
+        self.assertEquals(self.engine.reads, 4)
+
+    def test_local_invalidation(self):
+        """Test that the cache is cleared when a model is modified."""
+        cache = ModelCache(self.engine, self.mongo)
+        cache.get_model('M1')
+        self.engine.models['M1'] = 'Model 1 (updated)'
+        cache.invalidate()
+        self.assertEquals(cache.get_model('M1'), 'Model 1 (updated)')
+        self.assertEquals(self.engine.reads, 2)
+
+    def test_remote_invalidation(self):
+        """Test that modifications on other nodes are detected using the
+        version counter."""
+        cache = ModelCache(self.engine, self.mongo, check_interval=0)
+        other = ModelCache(self.engine, self.mongo, check_interval=0)
+        cache.get_model('M1')
+        cache.get_model('M1')
+        self.assertEquals(self.engine.reads, 1)
+        self.engine.models['M1'] = 'Model 1 (updated)'
+        other.invalidate()
+        self.assertEquals(cache.get_model('M1'), 'Model 1 (updated)')
+        self.assertEquals(self.engine.reads, 2)
+        # Modifications that bypass the API increment the counter directly
+        increment_version(self.mongo.get_database().versions)
+        cache.get_model('M1')
+        self.assertEquals(self.engine.reads, 3)
+        # Changes are not detected before the check interval has passed
+        cache = ModelCache(self.engine, self.mongo, check_interval=3600)
+        cache.get_model('M1')
+        other.invalidate()
+        cache.get_model('M1')
+        self.assertEquals(self.engine.reads, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
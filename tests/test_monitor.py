@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+
+from prometheus_client import CollectorRegistry, Histogram
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.monitor import call_stats, request_summary, server_timing
+from scoserv.monitor import InstrumentedProxy
+
+
+class DataStore(object):
+    """Component with methods and attributes."""
+    def __init__(self):
+        self.name = 'store'
+        self.experiments = ObjectStore()
+        self.subjects = ObjectStore()
+
+    def get(self, key):
+        return key.upper()
+
+    def fail(self):
+        raise ValueError('failed')
+
+
+class ObjectStore(object):
+    """Nested component of the data store."""
+    def __init__(self):
+        self.collection = []
+
+    def exists_object(self, identifier):
+        return identifier in self.collection
+
+
+class TestCallStatistics(unittest.TestCase):
+
+    def setUp(self):
+        """Reset the call statistics for the current thread."""
+        call_stats.reset()
+
+    def test_instrumented_proxy(self):
+        """Test recording calls of a proxied component."""
+        store = InstrumentedProxy('db', DataStore(), call_stats)
+        self.assertEqual(store.get('a'), 'A')
+        self.assertEqual(store.get(key='b'), 'B')
+        self.assertEqual(store.name, 'store')
+        with self.assertRaises(ValueError):
+            store.fail()
+        self.assertEqual(call_stats.calls['db.get'][0], 2)
+        self.assertEqual(call_stats.calls['db.fail'][0], 1)
+        self.assertEqual(call_stats.components()['db'][0], 3)
+        summary = request_summary('GET', '/experiments/E1', '/experiments/<string:experiment_id>', 200, 1.5)
+        self.assertEqual(summary['durationMs'], 1500)
+        self.assertEqual(summary['calls']['db.get']['count'], 2)
+        self.assertTrue('db;dur=' in server_timing())
+        self.assertTrue('desc="3 calls"' in server_timing())
+        call_stats.reset()
+        self.assertEqual(call_stats.calls, {})
+
+    def test_nested_proxy(self):
+        """Test recording calls of nested components."""
+        store = InstrumentedProxy('db', DataStore(), call_stats, nested=['experiments'])
+        self.assertFalse(store.experiments.exists_object('E1'))
+        self.assertFalse(store.subjects.exists_object('S1'))
+        self.assertEqual(store.experiments.collection, [])
+        self.assertEqual(call_stats.calls['db.experiments.exists_object'][0], 1)
+        self.assertEqual(call_stats.components()['db'][0], 1)
+        self.assertIs(store.experiments, store.experiments)
+
+    def test_latency_histogram(self):
+        """Test recording call durations in a histogram."""
+        registry = CollectorRegistry()
+        latency = Histogram('calls', 'Call duration', ['operation'], registry=registry)
+        store = InstrumentedProxy('engine', DataStore(), call_stats, latency=latency)
+        store.get('a')
+        with self.assertRaises(ValueError):
+            store.fail()
+        for operation in ['get', 'fail']:
+            count = registry.get_sample_value('calls_count', {'operation' : operation})
+            self.assertEqual(count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from flask import Flask
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.profiling import ProfileStore, ProfilingMiddleware
+from scoserv.profiling import create_token, verify_token, HEADER_PROFILE
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        """Create profile store and app with profiling middleware."""
+        self.directory = tempfile.mkdtemp()
+        self.store = ProfileStore(self.directory, keep=2)
+        app = Flask(__name__)
+        @app.route('/items/<string:item_id>')
+        def items_get(item_id):
+            return item_id
+        app.wsgi_app = ProfilingMiddleware(
+            app.wsgi_app,
+            app.url_map,
+            self.store,
+            secret='secret'
+        )
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Remove profile directory."""
+        shutil.rmtree(self.directory)
+
+    def test_tokens(self):
+        """Test creating and verifying profiling tokens."""
+        token = create_token('secret')
+        self.assertTrue(verify_token('secret', token))
+        self.assertFalse(verify_token('other', token))
+        self.assertFalse(verify_token('secret', token[:-1]))
+        self.assertFalse(verify_token('secret', 'invalid'))
+        self.assertFalse(verify_token('secret', create_token('secret', ttl=-1)))
+
+    def test_profile_requests(self):
+        """Test profiling requests with token and aggregating profiles."""
+        self.client.get('/items/1')
+        self.assertEqual(self.store.endpoints(), [])
+        headers = {HEADER_PROFILE : create_token('secret')}
+        for i in range(3):
+            response = self.client.get('/items/' + str(i), headers=headers)
+            self.assertEqual(response.status_code, 200)
+        self.client.get('/unknown', headers=headers)
+        endpoints = self.store.endpoints()
+        self.assertEqual([e['endpoint'] for e in endpoints], ['items_get', 'unmatched'])
+        # Only the most recent profiles are kept
+        self.assertEqual(endpoints[0]['count'], 2)
+        self.assertTrue('items_get' in self.store.write_report('items_get'))
+        self.assertIsNotNone(self.store.write_aggregate('items_get'))
+        self.assertIsNone(self.store.write_report('../items_get'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scodata.attribute import Attribute, AttributeDefinition, FloatType
+from scoengine.model import ModelHandle
+from scoserv.runcache import fingerprint, link_tree
+
+
+class Experiment(object):
+    """Experiment handle containing the attributes used for fingerprints."""
+    def __init__(self, subject_id, image_group_id, fmri_data_id=None):
+        self.subject_id = subject_id
+        self.image_group_id = image_group_id
+        self.fmri_data_id = fmri_data_id
+
+
+class TestRunCache(unittest.TestCase):
+
+    def test_fingerprint(self):
+        """Test fingerprints for identical and different run inputs."""
+        model = get_model()
+        experiment = Experiment('S1', 'G1')
+        fp = fingerprint(model, experiment, {'gain' : Attribute('gain', 2.0)})
+        # Default values are used for missing arguments
+        self.assertEquals(
+            fp,
+            fingerprint(
+                model,
+                experiment,
+                {'gain' : Attribute('gain', 2.0), 'sigma' : Attribute('sigma', 1.0)}
+            )
+        )
+        self.assertNotEquals(
+            fp,
+            fingerprint(
+                model,
+                experiment,
+                {'gain' : Attribute('gain', 2.0), 'sigma' : Attribute('sigma', 0.5)}
+            )
+        )
+        self.assertNotEquals(
+            fp,
+            fingerprint(
+                model,
+                Experiment('S1', 'G1', fmri_data_id='F1'),
+                {'gain' : Attribute('gain', 2.0)}
+            )
+        )
+
+    def test_fingerprint_model_changes(self):
+        """Test that fingerprints change when the model is re-registered or
+        its connector is updated."""
+        experiment = Experiment('S1', 'G1')
+        arguments = {'gain' : Attribute('gain', 2.0)}
+        fp = fingerprint(get_model(), experiment, arguments)
+        self.assertEquals(fp, fingerprint(get_model(), experiment, arguments))
+        # Re-registration (with identical definition)
+        self.assertNotEquals(
+            fp,
+            fingerprint(
+                get_model(timestamp=datetime.datetime(2017, 1, 2)),
+                experiment,
+                arguments
+            )
+        )
+        # Updated connector
+        self.assertNotEquals(
+            fp,
+            fingerprint(
+                get_model(connector={'connector' : 'rabbitmq', 'queue' : 'v2'}),
+                experiment,
+                arguments
+            )
+        )
+
+    def test_link_tree(self):
+        """Test replicating attachment directories."""
+        directory = tempfile.mkdtemp()
+        try:
+            src_dir = os.path.join(directory, 'src')
+            os.makedirs(os.path.join(src_dir, 'sub'))
+            with open(os.path.join(src_dir, 'sub', 'file.txt'), 'w') as f:
+                f.write('content')
+            dst_dir = os.path.join(directory, 'dst')
+            link_tree(src_dir, dst_dir)
+            filename = os.path.join(dst_dir, 'sub', 'file.txt')
+            with open(filename, 'r') as f:
+                self.assertEquals(f.read(), 'content')
+            self.assertEquals(os.stat(filename).st_nlink, 2)
+        finally:
+            shutil.rmtree(directory)
+
+
+def get_model(timestamp=datetime.datetime(2017, 1, 1), connector=None):
+    """Handle for a model with two parameters."""
+    return ModelHandle(
+        'M1',
+        {'name' : 'Model'},
+        [
+            AttributeDefinition('sigma', 'Sigma', '', FloatType(), default=1.0),
+            AttributeDefinition('gain', 'Gain', '', FloatType())
+        ],
+        None,
+        connector or {'connector' : 'rabbitmq', 'queue' : 'v1'},
+        timestamp=timestamp
+    )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import yaml
+
+sys.path.insert(0, os.path.abspath('..'))
+
+CONFIG_FILE = '../config/config.yaml'
+
+
+class TestServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Import the server module with a configuration for an in-memory
+        database.
+        """
+        cls.base_dir = tempfile.mkdtemp()
+        with open(CONFIG_FILE, 'r') as f:
+            obj = yaml.load(f.read())
+        config = {item['key']:item['value'] for item in obj['properties']}
+        home_page = os.path.join(cls.base_dir, 'home.html')
+        with open(home_page, 'w') as f:
+            f.write('<p>SCO Test</p>')
+        config.update({
+            'server.datadir' : os.path.join(cls.base_dir, 'data'),
+            'server.logfile' : os.path.join(cls.base_dir, 'scoserv.log'),
+            'mongo.inmemory' : True,
+            'app.debug' : False,
+            'home.content' : home_page,
+            'doc.pages' : [],
+            'engine.broker' : 'inprocess'
+        })
+        config_file = os.path.join(cls.base_dir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            yaml.safe_dump(
+                {'properties' : [{'key' : k, 'value' : config[k]} for k in config]},
+                f,
+                default_flow_style=False
+            )
+        os.environ['SCOSERVER_CONFIG'] = config_file
+        import scoserv.server
+        cls.client = scoserv.server.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the server directory."""
+        shutil.rmtree(cls.base_dir)
+
+    def test_composition_arguments(self):
+        """Test that unknown field and reference names are rejected."""
+        for url in [
+            '/experiments/E1?fields=name,unknown',
+            '/experiments/E1?expand=name',
+            '/experiments/E1/predictions/R1?fields=subject',
+            '/experiments/E1/predictions/R1?expand=subject',
+            '/experiments/E1/predictions/R1?expand=experiment.model'
+        ]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(json.loads(response.data)['message'].startswith('invalid'))
+        # Valid names are accepted (the resources do not exist)
+        for url in [
+            '/experiments/E1?fields=name,subject&expand=subject',
+            '/experiments/E1/predictions/R1?fields=experiment&expand=experiment,experiment.subject',
+            '/experiments/E1/predictions/R1?fields=&expand='
+        ]:
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+from werkzeug.datastructures import FileStorage
+
+sys.path.insert(0, os.path.abspath('..'))
+
+from scoserv.upload import ChecksumFile, UploadConflictError, UploadSessionManager
+from scoserv.upload import save_upload_file
+
+
+class TestStreamingUpload(unittest.TestCase):
+
+    def setUp(self):
+        """Create temporary upload directory."""
+        self.upload_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove temporary upload directory."""
+        shutil.rmtree(self.upload_dir)
+
+    def get_upload(self, content):
+        """Stream content into partial file in the upload directory."""
+        part_file = os.path.join(self.upload_dir, 'file.part')
+        stream = ChecksumFile(open(part_file, 'w+b'), part_file)
+        for i in range(0, len(content), 4):
+            stream.write(content[i:i+4])
+        stream.seek(0)
+        return FileStorage(stream=stream, filename='../my file.tar.gz')
+
+    def test_save_streamed_file(self):
+        """Test moving streamed file into temporary directory."""
+        content = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        upload = self.get_upload(content)
+        self.assertEqual(
+            upload.stream.checksum,
+            hashlib.sha256(content).hexdigest()
+        )
+        temp_dir, upload_file = save_upload_file(
+            upload,
+            expected_checksum=hashlib.sha256(content).hexdigest()
+        )
+        # The partial file has been renamed within the upload directory
+        self.assertEqual(os.path.dirname(temp_dir), self.upload_dir)
+        self.assertEqual(os.path.basename(upload_file), 'my_file.tar.gz')
+        self.assertFalse(os.path.isfile(os.path.join(self.upload_dir, 'file.part')))
+        self.assertTrue(upload.stream.is_claimed)
+        with open(upload_file, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_checksum_mismatch(self):
+        """Test rejecting uploaded file with invalid checksum."""
+        upload = self.get_upload('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+        with self.assertRaises(ValueError):
+            save_upload_file(upload, expected_checksum='0' * 64)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+
+class TestUploadSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        """Create temporary upload directory and session manager."""
+        self.upload_dir = tempfile.mkdtemp()
+        self.uploads = UploadSessionManager(self.upload_dir, ttl=60)
+
+    def tearDown(self):
+        """Remove temporary upload directory."""
+        shutil.rmtree(self.upload_dir)
+
+    def test_chunked_upload(self):
+        """Test uploading chunks in arbitrary order and finalizing."""
+        content = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        session = self.uploads.create_session('subject', 'subject.tar.gz', len(content))
+        # Upload chunks out of order
+        session.write_chunk(10, 19, StringIO(content[10:20]))
+        session.write_chunk(0, 4, StringIO(content[0:5]))
+        session = self.uploads.get_session(session.identifier)
+        self.assertEqual(session.ranges, [(0, 4), (10, 19)])
+        self.assertEqual(session.bytes_received, 15)
+        # Finalizing incomplete sessions fails
+        with self.assertRaises(ValueError):
+            self.uploads.finalize_session(session.identifier)
+        # Chunks have to contain all bytes in the range
+        with self.assertRaises(ValueError):
+            session.write_chunk(5, 9, StringIO(content[5:8]))
+        session.write_chunk(5, 9, StringIO(content[5:10]))
+        session.write_chunk(18, 25, StringIO(content[18:]))
+        self.assertEqual(session.ranges, [(0, 25)])
+        self.assertTrue(session.is_complete)
+        _, temp_dir, upload_file = self.uploads.finalize_session(
+            session.identifier,
+            expected_checksum=hashlib.sha256(content).hexdigest()
+        )
+        self.assertEqual(os.path.basename(upload_file), 'subject.tar.gz')
+        with open(upload_file, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        shutil.rmtree(temp_dir)
+        # The session is kept until it is deleted by the caller (after the
+        # object for the uploaded file has been created). The claim has to be
+        # released before the session can be finalized again.
+        self.assertIsNotNone(self.uploads.get_session(session.identifier))
+        self.uploads.release_session(session.identifier)
+        _, temp_dir, upload_file = self.uploads.finalize_session(session.identifier)
+        with open(upload_file, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        shutil.rmtree(temp_dir)
+        self.assertTrue(self.uploads.delete_session(session.identifier))
+        self.assertIsNone(self.uploads.get_session(session.identifier))
+
+    def test_concurrent_finalize(self):
+        """Test that a session can only be finalized by one request at a
+        time."""
+        content = 'ABCDEFGHIJ'
+        session = self.uploads.create_session('image', 'image.png', len(content))
+        session.write_chunk(0, 9, StringIO(content))
+        _, temp_dir, _ = self.uploads.finalize_session(session.identifier)
+        shutil.rmtree(temp_dir)
+        self.assertTrue(session.is_finalizing)
+        with self.assertRaises(UploadConflictError):
+            self.uploads.finalize_session(session.identifier)
+        with self.assertRaises(UploadConflictError):
+            session.write_chunk(0, 4, StringIO(content[0:5]))
+        # Failed attempts release the claim
+        self.uploads.release_session(session.identifier)
+        self.assertFalse(session.is_finalizing)
+        with self.assertRaises(ValueError):
+            self.uploads.finalize_session(session.identifier, expected_checksum='0')
+        self.assertFalse(session.is_finalizing)
+        # Sessions that have been finalized and deleted do not exist
+        _, temp_dir, _ = self.uploads.finalize_session(session.identifier)
+        shutil.rmtree(temp_dir)
+        self.assertTrue(self.uploads.delete_session(session.identifier))
+        self.assertIsNone(self.uploads.finalize_session(session.identifier))
+
+    def test_chunks_in_flight(self):
+        """Test that sessions are not finalized while chunks are written and
+        that chunks are not recorded if the session has been claimed while
+        they were written."""
+        content = 'ABCDEFGHIJ'
+        session = self.uploads.create_session('image', 'image.png', len(content))
+        session.write_chunk(0, 9, StringIO(content))
+        uploads = self.uploads
+        errors = []
+        class FinalizingStream(StringIO):
+            def read(self, size=-1):
+                try:
+                    uploads.finalize_session(session.identifier)
+                except UploadConflictError as ex:
+                    errors.append(ex)
+                return StringIO.read(self, size)
+        # Resending a chunk blocks finalizing
+        session.write_chunk(0, 4, FinalizingStream(content[0:5]))
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(session.is_finalizing)
+        self.assertEqual(session.ranges, [(0, 9)])
+        # Chunks are not recorded if the session is claimed while they are
+        # written
+        class ClaimingStream(StringIO):
+            def read(self, size=-1):
+                open(session.lock_file, 'w').close()
+                return StringIO.read(self, size)
+        session = self.uploads.create_session('image', 'image.png', len(content))
+        with self.assertRaises(UploadConflictError):
+            session.write_chunk(0, 4, ClaimingStream(content[0:5]))
+        self.assertEqual(session.ranges, [])
+        self.assertFalse(session.writes_in_flight)
+        # Stale in-flight markers are removed
+        self.uploads.release_session(session.identifier)
+        marker = os.path.join(session.directory, 'ranges', 'writing.0')
+        open(marker, 'w').close()
+        self.assertTrue(session.writes_in_flight)
+        inactive = time.time() - 3600
+        os.utime(marker, (inactive, inactive))
+        self.assertFalse(session.writes_in_flight)
+        self.assertFalse(os.path.isfile(marker))
+
+    def test_invalid_sessions(self):
+        """Test invalid session arguments and identifier."""
+        with self.assertRaises(ValueError):
+            self.uploads.create_session('unknown', 'file.tar', 10)
+        with self.assertRaises(ValueError):
+            self.uploads.create_session('fmri', 'file.nii', 10)
+        session = self.uploads.create_session('image', 'image.png', 10)
+        with self.assertRaises(ValueError):
+            session.write_chunk(5, 10, StringIO('ABCDEF'))
+        self.assertIsNone(self.uploads.get_session('../' + session.identifier))
+        self.assertTrue(self.uploads.delete_session(session.identifier))
+        self.assertFalse(self.uploads.delete_session(session.identifier))
+
+    def test_expired_sessions(self):
+        """Test removal of sessions without activity."""
+        session = self.uploads.create_session('image', 'image.png', 10)
+        # Move the last activity of the session into the past
+        inactive = time.time() - 120
+        for path in [
+            session.directory,
+            session.data_file,
+            os.path.join(session.directory, 'ranges')
+        ]:
+            os.utime(path, (inactive, inactive))
+        active = self.uploads.create_session('image', 'image.png', 10)
+        self.assertIsNone(self.uploads.get_session(session.identifier))
+        self.assertIsNotNone(self.uploads.get_session(active.identifier))
+        self.assertFalse(os.path.isdir(session.directory))
+        # Expired sessions are removed when sessions are accessed
+        for path in [
+            active.directory,
+            active.data_file,
+            os.path.join(active.directory, 'ranges')
+        ]:
+            os.utime(path, (inactive, inactive))
+        self.uploads.last_cleanup = 0
+        self.assertIsNone(self.uploads.get_session('0' * 32))
+        self.assertFalse(os.path.isdir(active.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()